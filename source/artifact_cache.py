@@ -0,0 +1,144 @@
+# Cache of artifacts derived from datasets and models.
+#
+# Artifacts (class counts, graph sizes, base GNN outputs) are saved in data/cache under a key that hashes the
+# contents of their input files, e.g. the processed files of a dataset and the model checkpoint. A changed input file
+# gives a new key, so stale artifacts are never read. Content hashes of files are memoized by (path, size, mtime) in
+# data/cache/hashes.json, a file is read again only when it changes.
+
+import os
+import glob
+import json
+import hashlib
+
+import numpy as np
+import torch
+
+import packed_storage
+
+CACHE_FOLDER = os.path.join('data', 'cache')
+HASHES_FILE_NAME = 'hashes.json'
+
+
+def atomic_save(obj, path):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_hashes(hashes_path):
+    """ Memoized file hashes, empty if the file is missing, partially written or corrupt"""
+    try:
+        with open(hashes_path) as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return hashes if isinstance(hashes, dict) else {}
+
+
+def file_hash(path, folder=CACHE_FOLDER):
+    """ sha256 of the contents of a file, memoized by (path, size, mtime)"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    hashes_path = os.path.join(folder, HASHES_FILE_NAME)
+    hashes = read_hashes(hashes_path)
+    entry = hashes.get(path)
+    if isinstance(entry, list) and len(entry) == 3 and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return entry[2]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    hashes[path] = (stat.st_size, stat.st_mtime_ns, digest)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f'{hashes_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(hashes, f)
+    os.replace(tmp_path, hashes_path)
+    return digest
+
+
+def make_key(*parts):
+    """ Hash of json serializable parts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def dataset_key(dataset):
+    """
+    Key of the contents of a dataset: hash of the files directly in its processed_dir, indices of index views.
+    :return: key, None for datasets without processed files (lists, lazily perturbed datasets)
+    """
+    if hasattr(dataset, 'indices') and hasattr(dataset, 'dataset'):
+        base_key = dataset_key(dataset.dataset)
+        if base_key is None:
+            return None
+        return make_key(base_key, hashlib.sha256(np.asarray(dataset.indices, dtype=np.int64).tobytes()).hexdigest())
+    processed_dir = getattr(dataset, 'processed_dir', None)
+    if processed_dir is None or not os.path.isdir(processed_dir):
+        return None
+    files = sorted(path for path in glob.glob(os.path.join(processed_dir, '*')) if os.path.isfile(path))
+    if packed_storage.is_sharded(processed_dir):
+        files += sorted(glob.glob(os.path.join(processed_dir, packed_storage.SHARD_FOLDER_PREFIX + '*', '*')))
+    if len(files) == 0:
+        return None
+    return make_key([file_hash(path) for path in files])
+
+
+def cached(kind, key, compute, folder=CACHE_FOLDER):
+    """
+    :param kind: name of the artifact, prefix of its file
+    :param key: key of the inputs, see make_key. None computes the artifact without caching it.
+    :param compute: function computing the artifact
+    :return: the cached artifact, computed and saved if missing
+    """
+    if key is None:
+        return compute()
+    path = os.path.join(folder, f'{kind}_{key}.pt')
+    if os.path.exists(path):
+        return torch.load(path)
+    artifact = compute()
+    os.makedirs(folder, exist_ok=True)
+    atomic_save(artifact, path)
+    return artifact
+
+
+def split_indices(num_graphs, lengths, seed=0):
+    """
+    Indices of torch.utils.data.random_split of num_graphs elements, they only depend on the number of graphs.
+    :return: list of index lists
+    """
+    assert sum(lengths) == num_graphs
+    generator = torch.Generator().manual_seed(seed)
+    permutation = torch.randperm(num_graphs, generator=generator).tolist()
+    offsets = np.cumsum([0] + list(lengths))
+    return [permutation[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def num_classes(dataset):
+    """ Number of distinct graph labels of dataset"""
+    return cached('num_classes', dataset_key(dataset),
+                  lambda: len(torch.unique(torch.cat([graph.y.view(-1) for graph in dataset]))))
+
+
+def graph_sizes(dataset):
+    """
+    :return: num_nodes LongTensor [num_graphs], num_edges LongTensor [num_graphs]
+    """
+    def compute():
+        sizes = torch.tensor([[graph.num_nodes, graph.edge_index.shape[1]] for graph in dataset], dtype=torch.long)
+        sizes = sizes.view(-1, 2)
+        return sizes[:, 0].clone(), sizes[:, 1].clone()
+
+    return cached('graph_sizes', dataset_key(dataset), compute)
+
+
+def model_outputs_key(dataset, checkpoint_path, name=None):
+    """
+    Key of the outputs of a model checkpoint on a dataset, name identifies datasets without processed files.
+    """
+    key = dataset_key(dataset)
+    if key is None and name is None:
+        return None
+    return make_key(key or name, len(dataset), file_hash(checkpoint_path))
@@ -11,12 +11,13 @@ def parse_args():
     parser.add_argument('--device', type=int, default=0, help='Index of cuda device to use. Default is 0.')
     parser.add_argument('--runs', type=int, default=10)
     parser.add_argument('--start_run', type=int, default=1)
+    parser.add_argument('--categorical', action='store_true', help='Category id node features instead of one-hot features.')
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     args = parse_args()
-    trainer = GNNTrainer(dataset_name=args.dataset, gnn_type=args.gnn_type, task='basegnn', device=args.device)
+    trainer = GNNTrainer(dataset_name=args.dataset, gnn_type=args.gnn_type, task='basegnn', device=args.device, categorical=args.categorical)
 
     runs = range(args.start_run, args.start_run + args.runs)
     trainer.run(runs=runs)
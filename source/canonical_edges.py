@@ -0,0 +1,115 @@
+# Canonical undirected edge index of graphs.
+#
+# Every directed edge (u, v) gets the id of its undirected edge {u, v}, ids follow the order of (min(u, v), max(u, v))
+# pairs, and a pointer to its reverse edge (v, u), -1 if the graph does not have it. Selecting undirected edges and
+# mapping them back to directed edges, or symmetrizing edge weights, are then gather/scatter operations.
+# The index of every graph of a dataset is stored next to the dataset in packed format, see dataset_canonical_edges.
+
+import os
+
+import torch
+from torch_geometric.data import Data
+
+import packed_storage
+
+FOLDER_NAME = 'canonical_edges'
+
+
+def canonical_edge_index(edge_index, num_nodes):
+    """
+    :param edge_index: LongTensor [2, num_edges]
+    :param num_nodes: number of nodes of the graph
+    :return: undirected_id LongTensor [num_edges], reverse_edge LongTensor [num_edges]
+    """
+    row, col = edge_index
+    if row.numel() == 0:
+        return torch.zeros(0, dtype=torch.long), torch.zeros(0, dtype=torch.long)
+    sorted_keys, order = torch.sort(row * num_nodes + col)
+    reverse_keys = col * num_nodes + row
+    found = torch.searchsorted(sorted_keys, reverse_keys).clamp(max=sorted_keys.shape[0] - 1)
+    reverse_edge = torch.where(sorted_keys[found] == reverse_keys, order[found], torch.full_like(found, -1))
+    undirected_keys = torch.minimum(row, col) * num_nodes + torch.maximum(row, col)
+    undirected_id = torch.unique(undirected_keys, return_inverse=True)[1]
+    return undirected_id, reverse_edge
+
+
+def add_canonical_edge_index(graph):
+    graph.undirected_id, graph.reverse_edge = canonical_edge_index(graph.edge_index, graph.num_nodes)
+    return graph
+
+
+def edge_structure(graph):
+    """ Stored canonical edge index of graph, computed if the graph does not have one"""
+    if getattr(graph, 'undirected_id', None) is not None:
+        return graph.undirected_id, graph.reverse_edge
+    return canonical_edge_index(graph.edge_index, graph.num_nodes)
+
+
+def dataset_canonical_edges(dataset):
+    """
+    Canonical edge indices of every graph of dataset, stored in processed_dir/canonical_edges. The folder is built on
+    first use, datasets without processed_dir get an in-memory list.
+    :return: indexable of Data(undirected_id, reverse_edge)
+    """
+    def structures():
+        for graph in dataset:
+            undirected_id, reverse_edge = canonical_edge_index(graph.edge_index, graph.num_nodes)
+            yield Data(undirected_id=undirected_id, reverse_edge=reverse_edge, num_nodes=graph.num_nodes)
+
+    processed_dir = getattr(dataset, 'processed_dir', None)
+    if processed_dir is None:
+        return list(structures())
+    folder = os.path.join(processed_dir, FOLDER_NAME)
+    if not packed_storage.is_packed(folder):
+        packed_storage.pack_graphs(structures(), folder)
+    return packed_storage.PackedGraphs(folder)
+
+
+def undirected_edge_mask(undirected_id, positions):
+    """
+    Mask of the directed edges of the undirected edges of the edges at positions: both directions of every selected
+    edge that are in the edge index of undirected_id.
+    :param undirected_id: LongTensor [num_edges], see canonical_edge_index
+    :param positions: LongTensor, positions of selected edges
+    :return: BoolTensor [num_edges]
+    """
+    selected = torch.zeros(num_undirected_edges(undirected_id), dtype=torch.bool, device=undirected_id.device)
+    selected[undirected_id[positions]] = True
+    return selected[undirected_id]
+
+
+def select_undirected(graph, positions):
+    """
+    Directed edges of the undirected edges of the edges at positions: both directions of every selected edge, sorted
+    by (row, col) without duplicates, the same edges as ToUndirected on graph.edge_index[:, positions].
+    :param graph: PyTorch Geometric Data
+    :param positions: LongTensor, positions of selected edges in graph.edge_index
+    :return: edge_index LongTensor [2, num_selected_directed_edges], undirected_id LongTensor of every returned edge
+    """
+    undirected_id, reverse_edge = edge_structure(graph)
+    num_nodes = graph.num_nodes
+    directed = undirected_edge_mask(undirected_id, positions)
+    edge_index, edge_undirected_id = graph.edge_index[:, directed], undirected_id[directed]
+
+    # edges without their reverse in the graph are added in both directions
+    missing = directed & (reverse_edge < 0)
+    if missing.any():
+        edge_index = torch.cat([edge_index, graph.edge_index[:, missing].flip(0)], dim=1)
+        edge_undirected_id = torch.cat([edge_undirected_id, undirected_id[missing]])
+    keys = edge_index[0] * num_nodes + edge_index[1]
+    if missing.any() or (keys[1:] <= keys[:-1]).any():
+        keys, inverse = torch.unique(keys, return_inverse=True)
+        edge_index = torch.stack([keys // num_nodes, keys % num_nodes])
+        edge_undirected_id = torch.zeros_like(keys).scatter_(0, inverse, edge_undirected_id)
+    return edge_index, edge_undirected_id
+
+
+def num_undirected_edges(undirected_id):
+    return int(undirected_id.max()) + 1 if undirected_id.numel() > 0 else 0
+
+
+def symmetric_edge_weight(edge_weight, undirected_id, reduce='mean'):
+    """ Gives both directions of every undirected edge the reduction of their weights"""
+    undirected_weight = torch.zeros(num_undirected_edges(undirected_id), dtype=edge_weight.dtype, device=edge_weight.device)
+    undirected_weight = undirected_weight.scatter_reduce(0, undirected_id, edge_weight, reduce=reduce, include_self=False)
+    return undirected_weight[undirected_id]
@@ -4,11 +4,13 @@ from torch_geometric.utils import to_dense_adj, is_undirected
 import numpy as np
 import torch.nn.functional as F
 from torch_geometric.data import Data
-from torch_geometric.transforms import RemoveIsolatedNodes, ToUndirected
+from torch_geometric.transforms import RemoveIsolatedNodes
 from torch_geometric.utils import to_networkx
-import networkx as nx
 import math
 
+import canonical_edges
+from lazy_imports import networkx as nx
+
 def mean_stdev(stdev_list, num_samples=5, include_nan=False):
     total_sum = []
     non_nan = 0
@@ -39,26 +41,27 @@ def stdev_samples(sample_list, include_nan=False):
         return np.round(np.nanstd(sample_list),3)
 
 def remove_top_k(model, explanation, k=1):
-    directed_edge_weight = explanation.edge_weight[explanation.edge_index[0] <= explanation.edge_index[1]]
-    directed_edge_index = explanation.edge_index[:, explanation.edge_index[0] <= explanation.edge_index[1]]
-    directed_edge_attr = explanation.edge_attr[explanation.edge_index[0] <= explanation.edge_index[1],:] if explanation.edge_attr is not None else None#shape: num_edges * attr_dim
+    canonical = (explanation.edge_index[0] <= explanation.edge_index[1]).nonzero().flatten()
+    directed_edge_weight = explanation.edge_weight[canonical]
     #remove top-k edges
-    idx = torch.ones(directed_edge_weight.numel(), dtype=torch.bool)
     del_idx = directed_edge_weight.topk(min(k, directed_edge_weight.shape[0]), largest=False).indices 
     edge_mask = torch.ones(directed_edge_weight.shape[0])
     edge_mask[del_idx] = 0
     directed_edge_weight[del_idx] = 0
-    
+
+    # make graph undirected, both directions of an edge take the values of its canonical direction
+    edge_index, edge_undirected_id = canonical_edges.select_undirected(explanation, canonical)
+    undirected_id = canonical_edges.edge_structure(explanation)[0]
+    source = torch.zeros(canonical_edges.num_undirected_edges(undirected_id), dtype=torch.long, device=canonical.device)
+    source[undirected_id[canonical]] = torch.arange(canonical.shape[0], device=canonical.device)
+    source = source[edge_undirected_id]
     new_data = Data(
-        edge_index=directed_edge_index.clone(),
+        edge_index=edge_index,
         x=explanation.x.clone(),
-        edge_weight=directed_edge_weight.clone(),
-        edge_mask = edge_mask,
-        edge_attr=directed_edge_attr.clone() if directed_edge_attr is not None else None    
+        edge_weight=directed_edge_weight[source].clone(),
+        edge_mask = edge_mask[source],
+        edge_attr=explanation.edge_attr[canonical][source].clone() if explanation.edge_attr is not None else None
     )
-    
-    # make graph undirected
-    new_data = ToUndirected()(new_data)    
     # not removing isolated nodes to prevent change in graph max nodes
     # new_data = RemoveIsolatedNodes()(new_data)
 
@@ -143,63 +146,68 @@ def find_cf_edges(data_dict, explainer_name):
 
     return perbs_list, perb_type 
 
-def sufficiency(explainer, explanations, indices):
-    same = 0
-    
-    for i in indices:
-        data_dict = explanations[i] 
-        pred_orig = torch.argmax(data_dict['pred']).item()
-        pred_cf = torch.argmax(data_dict['pred_cf']).item()
+def graph_scores(explainer, explanations, i, undirected):
+    """
+    Sufficiency, size and sparsity of counterfactual explanation i, see sufficiency, size and sparsity.
+    :return: sufficiency, size, sparsity, size and sparsity are NaN without a counterfactual
+    """
+    data_dict = explanations[i]
+    pred_orig = torch.argmax(data_dict['pred']).item()
+    pred_cf = torch.argmax(data_dict['pred_cf']).item()
 
-        #sufficiency = number of instances whose label remains the same, or for whom we are unable to find a counterfactual
-        if (pred_orig == pred_cf):
-            same += 1
-    
-    return np.round((same/len(indices)), 4)
+    #sufficiency = number of instances whose label remains the same, or for whom we are unable to find a counterfactual
+    if (pred_orig == pred_cf):
+        return 1.0, float('nan'), float('nan')
 
-def size(explainer, explanations, indices):
+    #initialize inside the if condition, since graph_cf_up would not exist if cf does not exist
+    orig_adj, cf_adj = get_adj_mat(data_dict, explainer)
+    changed = sum(sum(abs(orig_adj - cf_adj)))
+    if(changed == 0):
+        return 0.0, float('nan'), float('nan')
+
+    if(undirected):
+        size = changed/2
+    else:
+        size = changed
+    #for sparsity
+    perbs = (orig_adj - cf_adj)
+    perbs_del = np.maximum(perbs, 0)
+    # sparsity = num deletions/ num possible deletions
+    sparsity = 1 - (sum(sum(perbs_del)) / data_dict['graph'].edge_index.shape[1])
+    return 0.0, size, sparsity
+
+def instance_scores(explainer, explanations, indices):
+    """
+    Per graph sufficiency, size and sparsity of the explanations at indices, computed once for every subset of them.
+    :return: dict of metric name to np.array [len(indices)], NaN where the metric is undefined
+    """
     #check if graph is undirected, if true divide size by 2
     undirected = is_undirected(explanations[0]['graph'].edge_index)
-    size = []
-                
-    for i in indices:
-        data_dict = explanations[i] 
-        pred_orig = torch.argmax(data_dict['pred']).item()
-        pred_cf = torch.argmax(data_dict['pred_cf']).item()
-        
-        if(pred_orig != pred_cf):
-            #initialize inside the if condition, since graph_cf_up would not exist if cf does not exist
-            orig_adj, cf_adj = get_adj_mat(data_dict, explainer)
-            if(sum(sum(abs(orig_adj - cf_adj))) == 0):
-                continue
-            
-            if(undirected):
-                size.append(sum(sum(abs(orig_adj - cf_adj)))/2)
-            else:
-                size.append(sum(sum(abs(orig_adj - cf_adj))))    
-       
+    scores = np.array([graph_scores(explainer, explanations, i, undirected) for i in indices], dtype=np.float64).reshape(-1, 3)
+    return {'sufficiency': scores[:, 0], 'size': scores[:, 1], 'sparsity': scores[:, 2]}
+
+def add_instance_scores(store, explainer, explanations, param):
+    """ Adds per graph sufficiency, size and sparsity of the graphs of an InstanceStore as (metric, param)"""
+    for metric, scores in instance_scores(explainer, explanations, store.graph_ids).items():
+        store.add(metric, param, scores)
+
+def sample_mean(store, metric, param, indices, decimals=4):
+    return np.round(store.mean(metric, param, indices), decimals)
+
+def sample_mean_std(store, metric, param, indices, decimals=4):
+    return np.round(store.mean(metric, param, indices), decimals), np.round(store.std(metric, param, indices), decimals)
+
+def sufficiency(explainer, explanations, indices):
+    return np.round(np.mean(instance_scores(explainer, explanations, indices)['sufficiency']), 4)
+
+def size(explainer, explanations, indices):
+    size = instance_scores(explainer, explanations, indices)['size']
+    size = size[~np.isnan(size)]
     return np.round(np.mean(size), 4), np.round(np.std(size), 4)
 
 def sparsity(explainer, explanations, indices):
-    relu = torch.nn.ReLU()
-    sparsity = []
-    for i in indices:
-        data_dict = explanations[i] 
-        pred_orig = torch.argmax(data_dict['pred']).item()
-        pred_cf = torch.argmax(data_dict['pred_cf']).item()
-        
-        if(pred_orig != pred_cf):
-            orig_adj, cf_adj = get_adj_mat(data_dict, explainer)
-            if(sum(sum(abs(orig_adj - cf_adj))) == 0):
-                continue
-            #for sparsity
-            perbs = (orig_adj - cf_adj)
-            perbs_del = relu(torch.from_numpy(perbs)).numpy()
-            # perbs_add = relu(-perbs)
-            # sparsity = num deletions/ num possible deletions
-            sparsity.append(1 - (sum(sum(perbs_del)) / data_dict['graph'].edge_index.shape[1]))
-    
-    return np.round(np.mean(sparsity),4)
+    sparsity = instance_scores(explainer, explanations, indices)['sparsity']
+    return np.round(np.mean(sparsity[~np.isnan(sparsity)]),4)
 
 #computes jaccard similarity between generated counterfactual graphs
 def jaccard_cf_graph(explainer, data_dict1, data_dict2):
@@ -218,7 +226,11 @@ def jaccard_cf_graph(explainer, data_dict1, data_dict2):
     #return intersection/union
     return float(len(l1.intersection(l2))) / len(l2.union(l1))
 
-def robustness(explainer, explanation_1, explanation_2, indices):
+def robustness_scores(explainer, explanation_1, explanation_2, indices):
+    """
+    Per graph jaccard of the counterfactual graphs of two explanation sets at indices.
+    :return: np.array [len(indices)], NaN unless both explanations are counterfactuals
+    """
     jaccard = []
     for i in indices:
         data_dict1 = explanation_1[i]
@@ -233,7 +245,17 @@ def robustness(explainer, explanation_1, explanation_2, indices):
         if((pred_orig1 != pred_cf1) and (pred_orig2 != pred_cf2)):
             #for each graph compute jaccard of cf edge_index
             jaccard.append(jaccard_cf_graph(explainer, data_dict1, data_dict2))
-        
+        else:
+            jaccard.append(float('nan'))
+    return np.array(jaccard, dtype=np.float64)
+
+def add_robustness_scores(store, explainer, explanation_1, explanation_2, param):
+    """ Adds per graph jaccard of the graphs of an InstanceStore as ('jaccard', param)"""
+    store.add('jaccard', param, robustness_scores(explainer, explanation_1, explanation_2, store.graph_ids))
+
+def robustness(explainer, explanation_1, explanation_2, indices):
+    jaccard = robustness_scores(explainer, explanation_1, explanation_2, indices)
+    jaccard = jaccard[~np.isnan(jaccard)]
     #return avg jaccard, std jaccard
     return np.mean(jaccard), np.std(jaccard)
 
@@ -4,7 +4,9 @@ import torch
 import argparse
 from gnn_trainer import GNNTrainer
 import data_utils
+from index_view import positions_of
 import cf_metrics as metrics
+from instance_store import InstanceStore
 import numpy as np
 import os
 import pickle
@@ -87,15 +89,7 @@ if __name__ == '__main__':
     test_indices = indices[2]
     #cff and clear have only test_idx. mapping test ids to integer range. ensured order is maintained
     if(args.explainer_name == 'cff_0.0' or args.explainer_name == 'clear'):
-        test_indices_map = {}
-        for i in range(len(indices[2])):
-            test_indices_map[indices[2][i]] = i
-        
-        test_samples_mapped = []
-        for sample in test_samples:
-            test_samples_mapped.append([test_indices_map[val] for val in sample])
-            
-        test_samples = test_samples_mapped
+        test_samples = [positions_of(indices[2], sample) for sample in test_samples]
         test_indices = np.arange(len(indices[2]))
         
     explanations = data_utils.load_explanations(args.dataset, args.explainer_name, args.gnn_type, torch.device('cpu'), args.explainer_run)
@@ -107,6 +101,11 @@ if __name__ == '__main__':
         
     print(f'Started: {args.dataset}, {args.explainer_name}, {args.gnn_type}, {args.explanation_metric}')
 
+    # per graph scores of every explanation set are computed once, the test samples aggregate them
+    instances = InstanceStore(np.unique(np.concatenate([np.asarray(sample) for sample in test_samples])))
+    if any(metric in args.explanation_metric for metric in ['sufficiency', 'size', 'sparsity']):
+        metrics.add_instance_scores(instances, args.explainer_name, explanations, 'original')
+
     #flag to track non-implemeted metric
     flag = False
     # Generate explanation quality based on metrics
@@ -114,7 +113,7 @@ if __name__ == '__main__':
         flag = True
         sufficiency_scores_dict = {'sufficiency':[]}
         for sample in test_samples: 
-            sufficiency = metrics.sufficiency(args.explainer_name, explanations, sample)
+            sufficiency = metrics.sample_mean(instances, 'sufficiency', 'original', sample)
             sufficiency_scores_dict['sufficiency'].append(sufficiency)
         
         sufficiency_scores_dict['mean'] = metrics.mean_samples(sufficiency_scores_dict['sufficiency'])
@@ -128,7 +127,7 @@ if __name__ == '__main__':
         flag = True
         size_scores_dict = {'size': []}
         for sample in test_samples: 
-            avg_size, stdev_size = metrics.size(args.explainer_name, explanations, sample)
+            avg_size, stdev_size = metrics.sample_mean_std(instances, 'size', 'original', sample)
             size_scores_dict['size'].append([avg_size, stdev_size])
         
         size_scores_dict['mean'] =  metrics.mean_samples([size[0] for size in size_scores_dict['size']])
@@ -143,7 +142,7 @@ if __name__ == '__main__':
         flag = True
         sparsity_scores_dict = {'sparsity':[]}
         for sample in test_samples: 
-            sparsity = metrics.sparsity(args.explainer_name, explanations, sample)
+            sparsity = metrics.sample_mean(instances, 'sparsity', 'original', sample)
             sparsity_scores_dict['sparsity'].append(sparsity)
         
         sparsity_scores_dict['mean'] = metrics.mean_samples(sparsity_scores_dict['sparsity'])
@@ -163,12 +162,14 @@ if __name__ == '__main__':
         
         for k in ks:
             explanations_noise = explanations_noise_dict[k]
+            metrics.add_instance_scores(instances, args.explainer_name, explanations_noise, ('noise', k))
+            metrics.add_robustness_scores(instances, args.explainer_name, explanations, explanations_noise, ('noise', k))
             
             for sample in test_samples:  
                 #generate score
-                avg_jaccard, stdev_jaccard = metrics.robustness(args.explainer_name, explanations, explanations_noise, sample)
-                sufficiency = metrics.sufficiency(args.explainer_name, explanations_noise, sample)
-                avg_size, stdev_size = metrics.size(args.explainer_name, explanations_noise, sample)
+                avg_jaccard, stdev_jaccard = instances.mean('jaccard', ('noise', k), sample), instances.std('jaccard', ('noise', k), sample)
+                sufficiency = metrics.sample_mean(instances, 'sufficiency', ('noise', k), sample)
+                avg_size, stdev_size = metrics.sample_mean_std(instances, 'size', ('noise', k), sample)
             
                 robustness_scores_dict[k]['jaccard'].append([avg_jaccard, stdev_jaccard])
                 robustness_scores_dict[k]['size'].append([avg_size, stdev_size])
@@ -200,12 +201,14 @@ if __name__ == '__main__':
         
         for k in ks:
             explanations_adv_noise = explanations_adv_noise_dict[k]
+            metrics.add_instance_scores(instances, args.explainer_name, explanations_adv_noise, ('adversarial_noise', k))
+            metrics.add_robustness_scores(instances, args.explainer_name, explanations, explanations_adv_noise, ('adversarial_noise', k))
             
             for sample in test_samples:  
                 #generate score
-                avg_jaccard, stdev_jaccard = metrics.robustness(args.explainer_name, explanations, explanations_adv_noise, sample)
-                sufficiency = metrics.sufficiency(args.explainer_name, explanations_adv_noise, sample)
-                avg_size, stdev_size = metrics.size(args.explainer_name, explanations_adv_noise, sample)
+                avg_jaccard, stdev_jaccard = instances.mean('jaccard', ('adversarial_noise', k), sample), instances.std('jaccard', ('adversarial_noise', k), sample)
+                sufficiency = metrics.sample_mean(instances, 'sufficiency', ('adversarial_noise', k), sample)
+                avg_size, stdev_size = metrics.sample_mean_std(instances, 'size', ('adversarial_noise', k), sample)
             
                 robustness_adv_scores_dict[k]['jaccard'].append([avg_jaccard, stdev_jaccard])
                 robustness_adv_scores_dict[k]['size'].append([avg_size, stdev_size])
@@ -239,12 +242,14 @@ if __name__ == '__main__':
         
         for k in ks:
             explanations_feat_noise = explanations_feat_noise_dict[k]
+            metrics.add_instance_scores(instances, args.explainer_name, explanations_feat_noise, ('feature_noise', k))
+            metrics.add_robustness_scores(instances, args.explainer_name, explanations, explanations_feat_noise, ('feature_noise', k))
             
             for sample in test_samples:  
                 #generate score
-                avg_jaccard, stdev_jaccard = metrics.robustness(args.explainer_name, explanations, explanations_feat_noise, sample)
-                sufficiency = metrics.sufficiency(args.explainer_name, explanations_feat_noise, sample)
-                avg_size, stdev_size = metrics.size(args.explainer_name, explanations_feat_noise, sample)
+                avg_jaccard, stdev_jaccard = instances.mean('jaccard', ('feature_noise', k), sample), instances.std('jaccard', ('feature_noise', k), sample)
+                sufficiency = metrics.sample_mean(instances, 'sufficiency', ('feature_noise', k), sample)
+                avg_size, stdev_size = metrics.sample_mean_std(instances, 'size', ('feature_noise', k), sample)
             
                 robustness_feat_scores_dict[k]['jaccard'].append([avg_jaccard, stdev_jaccard])
                 robustness_feat_scores_dict[k]['size'].append([avg_size, stdev_size])
@@ -284,17 +289,20 @@ if __name__ == '__main__':
                     
         for i in range(len(seeds)):
             explanations_seed_i = explanations_seed_dict[seeds[i]]
+            metrics.add_instance_scores(instances, args.explainer_name, explanations_seed_i, ('seed', seeds[i]))
+            for j in range(i + 1, len(seeds)):
+                metrics.add_robustness_scores(instances, args.explainer_name, explanations_seed_i, explanations_seed_dict[seeds[j]], ('seed', seeds[i], seeds[j]))
 
             for k, sample in enumerate(test_samples): 
-                sufficiency = metrics.sufficiency(args.explainer_name, explanations_seed_i, sample)
-                avg_size, stdev_size = metrics.size(args.explainer_name, explanations_seed_i, sample)
+                sufficiency = metrics.sample_mean(instances, 'sufficiency', ('seed', seeds[i]), sample)
+                avg_size, stdev_size = metrics.sample_mean_std(instances, 'size', ('seed', seeds[i]), sample)
                 
                 stability_seed_scores_dict[i]['size'].append([avg_size, stdev_size])
                 stability_seed_scores_dict[i]['sufficiency'].append(sufficiency)
 
                 for j in range(i + 1, len(seeds)):
-                    explanations_seed_j = explanations_seed_dict[seeds[j]]
-                    avg_jaccard, stdev_jaccard = metrics.robustness(args.explainer_name, explanations_seed_i, explanations_seed_j, sample)
+                    avg_jaccard = instances.mean('jaccard', ('seed', seeds[i], seeds[j]), sample)
+                    stdev_jaccard = instances.std('jaccard', ('seed', seeds[i], seeds[j]), sample)
                     stability_seed_scores_dict[i]['jaccard'][f'{i}_{j}'].append([avg_jaccard, stdev_jaccard])
             
             #compute avg metric for seed[i]
@@ -340,16 +348,19 @@ if __name__ == '__main__':
                          
         for i in range(len(bases)):
             explanations_base1 = explanations_base_dict[bases[i]]
+            metrics.add_instance_scores(instances, args.explainer_name, explanations_base1, ('base', bases[i]))
+            for j in range(i + 1, len(bases)):
+                metrics.add_robustness_scores(instances, args.explainer_name, explanations_base1, explanations_base_dict[bases[j]], ('base', bases[i], bases[j]))
             for k, sample in enumerate(test_samples): 
-                sufficiency = metrics.sufficiency(args.explainer_name, explanations_base1, sample)
-                avg_size, stdev_size = metrics.size(args.explainer_name, explanations_base1, sample)
+                sufficiency = metrics.sample_mean(instances, 'sufficiency', ('base', bases[i]), sample)
+                avg_size, stdev_size = metrics.sample_mean_std(instances, 'size', ('base', bases[i]), sample)
                 
                 stability_base_scores_dict[bases[i]]['size'].append([avg_size, stdev_size])
                 stability_base_scores_dict[bases[i]]['sufficiency'].append(sufficiency)
              
                 for j in range(i + 1, len(bases)):
-                    explanations_base2 = explanations_base_dict[bases[j]]
-                    avg_jaccard, stdev_jaccard = metrics.robustness(args.explainer_name, explanations_base1, explanations_base2, sample)
+                    avg_jaccard = instances.mean('jaccard', ('base', bases[i], bases[j]), sample)
+                    stdev_jaccard = instances.std('jaccard', ('base', bases[i], bases[j]), sample)
                     stability_base_scores_dict[bases[i]]['jaccard'][bases[i]+'_'+ bases[j]].append([avg_jaccard, stdev_jaccard])
 
             #compute avg metric for seed[i]
@@ -395,4 +406,6 @@ if __name__ == '__main__':
     if(flag == False):
         raise NotImplementedError
 
+    instances.save(result_folder + f"cf_instances_{'_'.join(args.explanation_metric)}_{args.gnn_type}_run_{args.explainer_run}.pt")
+
     print(f'Finished: {args.dataset}, {args.explainer_name}, {args.gnn_type}, {args.explanation_metric}')
@@ -172,6 +172,7 @@ parser.add_argument('--gnn_run', type=int, default=1)
 parser.add_argument('--explainer_run', type=int, default=1)
 parser.add_argument('--gnn_type', type=str, default='gcn', choices=['gcn', 'gat', 'gin', 'sage'])
 parser.add_argument('--robustness', type=str, default='na', choices=['topology_random', 'topology_adversarial', 'feature', 'na'], help="na by default means we do not run for perturbed data")
+parser.add_argument('--lazy_variants', action='store_true', help='Perturbs the graphs of the robustness runs on access instead of loading the materialized noisy datasets.')
 
 args = parser.parse_args()
 
@@ -182,6 +183,7 @@ if not os.path.exists(result_folder):
 
 device = torch.device(f'cuda:{args.device}' if torch.cuda.is_available() and args.device != 'cpu' else 'cpu')
 dataset = data_utils.load_dataset(args.dataset)
+dataset_variants = data_utils.DatasetVariants(args.dataset, original_graphs=dataset, lazy=args.lazy_variants)
 splits, indices = data_utils.split_data(dataset)
 if args.alp == 0:
     dataset = dataset[indices[2]] # test graphs only as this is not an inductive explainer.
@@ -217,7 +219,7 @@ elif args.robustness == 'topology_random':
     for noise in [1, 2, 3, 4, 5]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_noise_{noise}.pt')
         counterfactual_path = os.path.join(result_folder, f'counterfactuals_{args.gnn_type}_run_{args.explainer_run}_noise_{noise}.pt')
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_dataset_name(dataset_name=args.dataset, noise=noise))
+        noisy_dataset = dataset_variants.get('topology_random', noise)
         splits, indices = data_utils.split_data(noisy_dataset)
         if args.alp == 0:
             noisy_dataset = noisy_dataset[indices[2]] # test graphs only as this is not an inductive explainer.
@@ -236,7 +238,7 @@ elif args.robustness == 'feature':
     for noise in [10, 20, 30, 40, 50]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_feature_noise_{noise}.pt')
         counterfactual_path = os.path.join(result_folder, f'counterfactuals_{args.gnn_type}_run_{args.explainer_run}_feature_noise_{noise}.pt')
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_feature_dataset_name(dataset_name=args.dataset, noise=noise))
+        noisy_dataset = dataset_variants.get('feature', noise)
         splits, indices = data_utils.split_data(noisy_dataset)
         if args.alp == 0:
             noisy_dataset = noisy_dataset[indices[2]] # test graphs only as this is not an inductive explainer.
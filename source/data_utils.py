@@ -1,39 +1,41 @@
 from torch_geometric.data import Dataset, InMemoryDataset, Data
 import os
+import copy
 import glob
 import numpy as np
 import json
 import pickle
+import multiprocessing
+from functools import partial
+from collections import OrderedDict
 
 from torch_geometric.datasets import TUDataset
 from torch_geometric.utils import degree, dense_to_sparse, to_dense_adj
 from torch_geometric.transforms import RemoveIsolatedNodes, ToUndirected
 
-from torch.utils.data import random_split
 import torch
 import torch.nn.functional as F
 
-from ogb.graphproppred import PygGraphPropPredDataset
 from torch_geometric.utils import negative_sampling, sort_edge_index, to_dense_adj
 import random
 
+import packed_storage
+import explanation_store
+import edge_ranking
+import canonical_edges
+import perturbations
+import artifact_cache
+from index_view import IndexView
+from lazy_imports import ogb_graphproppred
 
-class MutagenicityNoisy(Dataset):
-    def __init__(self, root, noise, transform=None, pre_transform=None):
-        """
-        root = Where the dataset should be stored. This folder is split
-        into raw_dir (downloaded dataset) and processed_dir (processed data).
-        """
-        self.root = root
-        self.noise = noise
-        self.name = f'MutagenicityNoisy{noise}'
-        self.cleaned = False
-        self.max_graph_size = float('inf')
-
-        self.original_graphs = TUDataset(root=root, name='Mutagenicity', use_node_attr=True)
-        self.graph_count = len(self.original_graphs)
 
-        super(MutagenicityNoisy, self).__init__(root, transform, pre_transform)
+class DerivedDataset(Dataset):
+    """
+    Base class of the datasets derived from an original dataset (noisy, feature noisy, adversarially attacked).
+    Derived graphs are stored in packed format in processed_dir, see packed_storage.py.
+    Subclasses set root, name, original_dataset_name and implement generate_graphs. The original dataset is only
+    loaded when the derived graphs have to be generated, an already loaded one can be passed as original_graphs.
+    """
 
     @property
     def raw_file_names(self):
@@ -45,7 +47,7 @@ class MutagenicityNoisy(Dataset):
     @property
     def processed_file_names(self):
         """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
+        return [packed_storage.META_FILE_NAME]
 
     def download(self):
         pass
@@ -64,119 +66,87 @@ class MutagenicityNoisy(Dataset):
     def num_classes(self) -> int:
         return 2
 
-    @staticmethod
-    def sample_negative_edges(graph, num_samples):
-        random.seed(0)
-        new_edges = negative_sampling(graph.edge_index, num_neg_samples=num_samples * 2, num_nodes=graph.num_nodes, force_undirected=True)
-        return new_edges
+    @property
+    def packed_graphs(self):
+        if getattr(self, '_packed_graphs', None) is None:
+            self._packed_graphs = packed_storage.PackedGraphs(self.processed_dir)
+        return self._packed_graphs
 
-    def noise_graph(self, graph, num_samples):
-        new_edges = self.sample_negative_edges(graph, num_samples)
-        new_edge_index = torch.hstack([graph.edge_index, new_edges])
-        new_edge_index = sort_edge_index(new_edge_index)
-        data = Data(edge_index=new_edge_index.clone(),
-                    x=graph.x.clone(),
-                    y=graph.y.clone())
-        return data
+    @property
+    def original_graphs(self):
+        if self._original_graphs is None:
+            self._original_graphs = load_dataset(self.original_dataset_name, root=self.root)
+        return self._original_graphs
+
+    def generate_graphs(self):
+        """ Yields the derived graphs in the order of original graphs"""
+        raise NotImplementedError
 
     def process(self):
-        for i, graph in enumerate(self.original_graphs):
-            data = self.noise_graph(graph, self.noise)
-            torch.save(data, os.path.join(self.processed_dir, f'data_{i}.pt'))
+        # older versions saved one data_{i}.pt per graph, these are converted instead of generated again
+        if len(packed_storage.legacy_files(self.processed_dir)) > 0:
+            packed_storage.convert_processed_dir(self.processed_dir)
+        else:
+            packed_storage.pack_graphs(self.generate_graphs(), self.processed_dir)
 
     def len(self):
-        return self.graph_count
+        return self.packed_graphs.num_graphs
 
     def get(self, idx):
         """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
+            - Slices memory-mapped packed arrays, no file is loaded
         """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
+        return self.packed_graphs.get(idx)
 
 
-class ProteinsNoisy(Dataset):
-    def __init__(self, root, noise, transform=None, pre_transform=None):
+class MutagenicityNoisy(DerivedDataset):
+    def __init__(self, root, noise, transform=None, pre_transform=None, original_graphs=None):
         """
         root = Where the dataset should be stored. This folder is split
         into raw_dir (downloaded dataset) and processed_dir (processed data).
         """
         self.root = root
         self.noise = noise
-        self.name = f'ProteinsNoisy{noise}'
+        self.name = f'MutagenicityNoisy{noise}'
         self.cleaned = False
         self.max_graph_size = float('inf')
 
-        self.original_graphs = TUDataset(root=root, name='PROTEINS_full', use_node_attr=True)
-        self.graph_count = len(self.original_graphs)
+        self.original_dataset_name = 'Mutagenicity'
+        self._original_graphs = original_graphs
 
-        super(ProteinsNoisy, self).__init__(root, transform, pre_transform)
-
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
-
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
-
-    def download(self):
-        pass
-
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
+        super(MutagenicityNoisy, self).__init__(root, transform, pre_transform)
 
-    @property
-    def num_classes(self) -> int:
-        return 2
+    def generate_graphs(self):
+        # same per graph seeding as generate_noisy_datasets, which builds every noise level in parallel
+        for graph in self.original_graphs:
+            yield noise_graph(graph, self.noise)
 
-    @staticmethod
-    def sample_negative_edges(graph, num_samples):
-        random.seed(0)
-        new_edges = negative_sampling(graph.edge_index, num_neg_samples=num_samples * 2, num_nodes=graph.num_nodes,
-                                      force_undirected=True)
-        return new_edges
 
-    def noise_graph(self, graph, num_samples):
-        new_edges = self.sample_negative_edges(graph, num_samples)
-        new_edge_index = torch.hstack([graph.edge_index, new_edges])
-        new_edge_index = sort_edge_index(new_edge_index)
-        data = Data(edge_index=new_edge_index.clone(),
-                    x=graph.x.clone(),
-                    y=graph.y.clone())
-        return data
+class ProteinsNoisy(DerivedDataset):
+    def __init__(self, root, noise, transform=None, pre_transform=None, original_graphs=None):
+        """
+        root = Where the dataset should be stored. This folder is split
+        into raw_dir (downloaded dataset) and processed_dir (processed data).
+        """
+        self.root = root
+        self.noise = noise
+        self.name = f'ProteinsNoisy{noise}'
+        self.cleaned = False
+        self.max_graph_size = float('inf')
 
-    def process(self):
-        for i, graph in enumerate(self.original_graphs):
-            data = self.noise_graph(graph, self.noise)
-            torch.save(data, os.path.join(self.processed_dir, f'data_{i}.pt'))
+        self.original_dataset_name = 'Proteins'
+        self._original_graphs = original_graphs
 
-    def len(self):
-        return self.graph_count
+        super(ProteinsNoisy, self).__init__(root, transform, pre_transform)
 
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
+    def generate_graphs(self):
+        # same per graph seeding as generate_noisy_datasets, which builds every noise level in parallel
+        for graph in self.original_graphs:
+            yield noise_graph(graph, self.noise)
 
 
-class IMDBNoisy(Dataset):
-    def __init__(self, root, noise, transform=None, pre_transform=None):
+class IMDBNoisy(DerivedDataset):
+    def __init__(self, root, noise, transform=None, pre_transform=None, original_graphs=None):
         """
         root = Where the dataset should be stored. This folder is split
         into raw_dir (downloaded dataset) and processed_dir (processed data).
@@ -187,75 +157,19 @@ class IMDBNoisy(Dataset):
         self.cleaned = False
         self.max_graph_size = float('inf')
 
-        self.original_graphs = TUDataset(root=root, name='IMDB-BINARY', pre_transform=IMDBPreTransform())
-        self.graph_count = len(self.original_graphs)
+        self.original_dataset_name = 'IMDB-B'
+        self._original_graphs = original_graphs
 
         super(IMDBNoisy, self).__init__(root, transform, pre_transform)
 
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
-
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
-
-    def download(self):
-        pass
-
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def num_classes(self) -> int:
-        return 2
-
-    @staticmethod
-    def sample_negative_edges(graph, num_samples):
-        random.seed(0)
-        new_edges = negative_sampling(graph.edge_index, num_neg_samples=num_samples * 2, num_nodes=graph.num_nodes,
-                                      force_undirected=True)
-        return new_edges
-
-    def noise_graph(self, graph, num_samples):
-        new_edges = self.sample_negative_edges(graph, num_samples)
-        new_edge_index = torch.hstack([graph.edge_index, new_edges])
-        new_edge_index = sort_edge_index(new_edge_index)
-        data = Data(edge_index=new_edge_index.clone(),
-                    x=graph.x.clone(),
-                    y=graph.y.clone())
-        return data
-
-    def process(self):
-        for i, graph in enumerate(self.original_graphs):
-            data = self.noise_graph(graph, self.noise)
-            torch.save(data, os.path.join(self.processed_dir, f'data_{i}.pt'))
+    def generate_graphs(self):
+        # same per graph seeding as generate_noisy_datasets, which builds every noise level in parallel
+        for graph in self.original_graphs:
+            yield noise_graph(graph, self.noise)
 
-    def len(self):
-        return self.graph_count
 
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
-
-
-class AIDSNoisy(Dataset):
-    def __init__(self, root, noise, transform=None, pre_transform=None):
+class AIDSNoisy(DerivedDataset):
+    def __init__(self, root, noise, transform=None, pre_transform=None, original_graphs=None):
         """
         root = Where the dataset should be stored. This folder is split
         into raw_dir (downloaded dataset) and processed_dir (processed data).
@@ -266,71 +180,15 @@ class AIDSNoisy(Dataset):
         self.cleaned = False
         self.max_graph_size = float('inf')
 
-        self.original_graphs = TUDataset(root=root, name='AIDS', use_node_attr=True)
-        self.graph_count = len(self.original_graphs)
+        self.original_dataset_name = 'AIDS'
+        self._original_graphs = original_graphs
 
         super(AIDSNoisy, self).__init__(root, transform, pre_transform)
 
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
-
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
-
-    def download(self):
-        pass
-
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def num_classes(self) -> int:
-        return 2
-
-    @staticmethod
-    def sample_negative_edges(graph, num_samples):
-        random.seed(0)
-        new_edges = negative_sampling(graph.edge_index, num_neg_samples=num_samples * 2, num_nodes=graph.num_nodes,
-                                      force_undirected=True)
-        return new_edges
-
-    def noise_graph(self, graph, num_samples):
-        new_edges = self.sample_negative_edges(graph, num_samples)
-        new_edge_index = torch.hstack([graph.edge_index, new_edges])
-        new_edge_index = sort_edge_index(new_edge_index)
-        data = Data(edge_index=new_edge_index.clone(),
-                    x=graph.x.clone(),
-                    y=graph.y.clone())
-        return data
-
-    def process(self):
-        for i, graph in enumerate(self.original_graphs):
-            data = self.noise_graph(graph, self.noise)
-            torch.save(data, os.path.join(self.processed_dir, f'data_{i}.pt'))
-
-    def len(self):
-        return self.graph_count
-
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
+    def generate_graphs(self):
+        # same per graph seeding as generate_noisy_datasets, which builds every noise level in parallel
+        for graph in self.original_graphs:
+            yield noise_graph(graph, self.noise)
 
 
 def undirected_graph(data):
@@ -339,6 +197,55 @@ def undirected_graph(data):
     return data
 
 
+def undirected_collated_graph(data, batch):
+    """
+    undirected_graph applied to every graph of collated data at once, edges stay grouped by graph in the same order as
+    the per graph transform.
+    :param data: collated Data, edges of a graph are contiguous and ordered by graph
+    :param batch: np.array, graph index of every node
+    """
+    edge_index = torch.cat([data.edge_index.flip(0), data.edge_index], dim=1)
+    edge_graph = torch.from_numpy(np.asarray(batch))[edge_index[0]]
+    data.edge_index = edge_index[:, torch.sort(edge_graph, stable=True)[1]]
+    return data
+
+
+def read_int_text(file_path, chunk_size=1 << 26):
+    """
+    Parses a text file of integers (whitespace or comma separated, the same number of columns on every line) in chunks.
+    The parsed array is saved as a .npy file next to the text file and later reads load it memory mapped.
+    :param file_path: path of the text file
+    :param chunk_size: bytes parsed at once
+    :return: int64 array, [num_lines] for one column like np.genfromtxt, [num_lines, num_columns] otherwise
+    """
+    cache_path = os.path.splitext(file_path)[0] + '.npy'
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(file_path):
+        return np.load(cache_path, mmap_mode='r')
+
+    def parse(lines):
+        return np.fromstring(lines.replace(b',', b' '), dtype=np.int64, sep=' ')
+
+    chunks = []
+    rest = b''
+    with open(file_path, 'rb') as f:
+        num_columns = len(f.readline().replace(b',', b' ').split())
+        f.seek(0)
+        for block in iter(lambda: f.read(chunk_size), b''):
+            # a chunk ends at its last line break, the partial line is parsed with the next chunk
+            block = rest + block
+            end = block.rfind(b'\n') + 1
+            chunks.append(parse(block[:end]))
+            rest = block[end:]
+    chunks.append(parse(rest))
+    values = np.concatenate(chunks)
+    values = values if num_columns <= 1 else values.reshape(-1, num_columns)
+
+    tmp_path = cache_path + '.tmp.npy'
+    np.save(tmp_path, values)
+    os.replace(tmp_path, cache_path)
+    return values
+
+
 def split(data, batch):
     # i-th contains elements from slice[i] to slice[i+1]
     node_slice = torch.cumsum(torch.from_numpy(np.bincount(batch)), 0)
@@ -384,10 +291,10 @@ class SentiGraphDataset(InMemoryDataset):
     @staticmethod
     def read_file(folder, prefix, name):
         file_path = os.path.join(folder, prefix + f'_{name}.txt')
-        return np.genfromtxt(file_path, dtype=np.int64)
+        return read_int_text(file_path)
 
     @staticmethod
-    def read_sentigraph_data(folder: str, prefix: str):
+    def read_sentigraph_data(folder: str, prefix: str, undirected=False):
         txt_files = glob.glob(os.path.join(folder, "{}_*.txt".format(prefix)))
         json_files = glob.glob(os.path.join(folder, "{}_*.json".format(prefix)))
         txt_names = [f.split(os.sep)[-1][len(prefix) + 1:-4] for f in txt_files]
@@ -414,28 +321,31 @@ class SentiGraphDataset(InMemoryDataset):
             supplement['sentence_tokens'] = sentence_tokens
 
         data = Data(x=x, edge_index=edge_index, y=y)
+        if undirected:
+            data = undirected_collated_graph(data, batch)
         data, slices = split(data, batch)
 
         return data, slices, supplement
 
     def process(self):
-        # Read data into huge `Data` list.
-        self.data, self.slices, self.supplement = SentiGraphDataset.read_sentigraph_data(self.raw_dir, self.name)
+        # Read data into huge `Data` list, the default pre_transform is applied to the collated edges.
+        undirected = self.pre_transform is undirected_graph and self.pre_filter is None
+        self.data, self.slices, self.supplement = SentiGraphDataset.read_sentigraph_data(self.raw_dir, self.name, undirected=undirected)
 
         if self.pre_filter is not None:
             data_list = [self.get(idx) for idx in range(len(self))]
             data_list = [data for data in data_list if self.pre_filter(data)]
             self.data, self.slices = self.collate(data_list)
 
-        if self.pre_transform is not None:
+        if self.pre_transform is not None and not undirected:
             data_list = [self.get(idx) for idx in range(len(self))]
             data_list = [self.pre_transform(data) for data in data_list]
             self.data, self.slices = self.collate(data_list)
         torch.save((self.data, self.slices, self.supplement), self.processed_paths[0])
 
 
-class MutagenicityFeatureNoisy(Dataset):
-    def __init__(self, root, noise, transform=None, pre_transform=None):
+class MutagenicityFeatureNoisy(DerivedDataset):
+    def __init__(self, root, noise, transform=None, pre_transform=None, original_graphs=None):
         """
         root = Where the dataset should be stored. This folder is split
         into raw_dir (downloaded dataset) and processed_dir (processed data).
@@ -445,459 +355,89 @@ class MutagenicityFeatureNoisy(Dataset):
         self.name = f'MutagenicityFeatureNoisy{noise}'
         self.cleaned = False
         self.max_graph_size = float('inf')
-        self.original_graphs = TUDataset(root=root, name='Mutagenicity', use_node_attr=True)
-        self.graph_count = len(self.original_graphs)
+        self.original_dataset_name = 'Mutagenicity'
+        self._original_graphs = original_graphs
 
         super(MutagenicityFeatureNoisy, self).__init__(root, transform, pre_transform)
 
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
-
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
-
-    def download(self):
-        pass
-
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def num_classes(self) -> int:
-        return 2
-
-    def process(self):
-        raise NotImplementedError
-
-    def len(self):
-        return self.graph_count
-
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
-
-
-class MutagFeatureNoisy(Dataset):
-    def __init__(self, root, noise, transform=None, pre_transform=None):
-        """
-        root = Where the dataset should be stored. This folder is split
-        into raw_dir (downloaded dataset) and processed_dir (processed data).
-        """
-        self.root = root
-        self.noise = noise
-        self.name = f'MutagenicityFeatureNoisy{noise}'
-        self.cleaned = False
-        self.max_graph_size = float('inf')
-        self.original_graphs = TUDataset(root=root, name='MUTAG', use_node_attr=True)
-        self.graph_count = len(self.original_graphs)
-
-        super(MutagFeatureNoisy, self).__init__(root, transform, pre_transform)
-
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
-
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
-
-    def download(self):
-        pass
-
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def num_classes(self) -> int:
-        return 2
-
-    def process(self):
-        raise NotImplementedError
-
-    def len(self):
-        return self.graph_count
-
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
-
-
-class ProteinsFeatureNoisy(Dataset):
-    def __init__(self, root, noise, transform=None, pre_transform=None):
-        """
-        root = Where the dataset should be stored. This folder is split
-        into raw_dir (downloaded dataset) and processed_dir (processed data).
-        """
-        self.root = root
-        self.noise = noise
-        self.name = f'ProteinsFeatureNoisy{noise}'
-        self.cleaned = False
-        self.max_graph_size = float('inf')
-        self.original_graphs = TUDataset(root=root, name='PROTEINS_full', use_node_attr=True)
-        self.graph_count = len(self.original_graphs)
-
-        super(ProteinsFeatureNoisy, self).__init__(root, transform, pre_transform)
-
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
-
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
-
-    def download(self):
-        pass
-
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def num_classes(self) -> int:
-        return 2
-
-    @staticmethod
-    def perturb_features(graph, num_samples):
-        np.random.seed(0)
-        perturbed_x = graph.x.clone().detach().numpy()
-        # sample 50% nodes randomly chosen
-        chosen_idx = np.random.randint(0, graph.x.shape[0], size=int(0.5 * graph.x.shape[0]))
-
-        for idx in chosen_idx:
-            # for sampled nodes generate perturbation mark where num_samples% features are perturbed
-            mask = np.random.choice([0, 1], size=graph.x.shape[1], p=[1 - num_samples / 100, num_samples / 100])
-            perb_idx = np.where(mask == 1)[0]
-            # perturb the features
-            # feature-informed perb
-            for id in perb_idx:
-                mu, sigma = np.mean(perturbed_x[:, id]), np.std(perturbed_x[:, id])
-                delta = np.random.uniform(-0.1, 0.1, 1)
-                perturbed_x[idx][id] = perturbed_x[idx][id] + delta * sigma
-                # completely random perb
-            # mu, sigma = 0, 2 # mean and standard deviation
-            # noise = np.random.normal(mu, sigma, perb_idx.shape[0])
-            # for i, perb in enumerate(noise):
-            #     perturbed_x[idx][perb_idx[i]] = perturbed_x[idx][perb_idx[i]] + perb 
-        # return perturbed features
-        return torch.tensor(perturbed_x)
-
-    def noise_graph(self, graph, num_samples):
-        perturbed_x = self.perturb_features(graph, num_samples)
-        data = Data(edge_index=graph.edge_index.clone(),
-                    x=perturbed_x.clone(),
-                    y=graph.y.clone())
-        return data
-
-    def process(self):
-        for i, graph in enumerate(self.original_graphs):
-            data = self.noise_graph(graph, self.noise)
-            torch.save(data, os.path.join(self.processed_dir, f'data_{i}.pt'))
-
-    def len(self):
-        return self.graph_count
-
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
-
-
-class MutagenicityTopologyAdversarialAttack(Dataset):
-    def __init__(self, root, flip_count, transform=None, pre_transform=None):
-        """
-        root = Where the dataset should be stored. This folder is split
-        into raw_dir (downloaded dataset) and processed_dir (processed data).
-        """
-        self.root = root
-        self.flip_count = flip_count
-        self.name = f'MutagenicityTopologyAdversarialAttack{flip_count}'
-        self.cleaned = False
-        self.max_graph_size = float('inf')
-        self.original_graphs = TUDataset(root=root, name='Mutagenicity', use_node_attr=True)
-        self.graph_count = len(self.original_graphs)
-
-        super(MutagenicityTopologyAdversarialAttack, self).__init__(root, transform, pre_transform)
-
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
-
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
-
-    def download(self):
-        pass
-
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def num_classes(self) -> int:
-        return 2
-
-    def random_sample_flip(self, graph, flip_count):
-        random.seed(0)
-        np.random.seed(0)
-        edges_to_flip = set()
-        while len(edges_to_flip) < flip_count:
-            patience = 100
-            while patience > 0:
-                all_nodes = range(graph.num_nodes)
-                allowed_nodes = all_nodes
-                u = np.random.choice(allowed_nodes, replace=False, )
-                v = np.random.choice(allowed_nodes, replace=False, )
-                if u == v:
-                    patience -= 1
-                    continue
-                u, v = min(u, v), max(u, v)
-                edges_to_flip.add((u, v))
-                break
-            if patience < 0:
-                pass
-        return edges_to_flip
-
-    def flip_edges(self, graph, edges_to_flip):
-        adj = to_dense_adj(graph.edge_index, max_num_nodes=graph.num_nodes).squeeze()
-        for u, v in edges_to_flip:
-            if adj[u, v] == 1:
-                adj[u, v] = 0
-                adj[v, u] = 0
-            else:
-                adj[u, v] = 1
-                adj[v, u] = 1
-        new_edge_index = dense_to_sparse(adj)[0]
-        data = Data(edge_index=new_edge_index.clone(),
-                    x=graph.x.clone(),
-                    y=graph.y.clone())
-        return data
-
-    def noise_graph(self, graph, flip_count):
-        edges_to_flip = self.random_sample_flip(graph, flip_count)
-        new_data = self.flip_edges(graph, edges_to_flip)
-        return new_data
-
-    def process(self):
-        for i, graph in enumerate(self.original_graphs):
-            data = self.noise_graph(graph, self.flip_count)
-            torch.save(data, os.path.join(self.processed_dir, f'data_{i}.pt'))
-
-    def len(self):
-        return self.graph_count
-
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
+    def generate_graphs(self):
+        raise NotImplementedError
 
 
-class ProteinsTopologyAdversarialAttack(Dataset):
-    def __init__(self, root, flip_count, transform=None, pre_transform=None):
+class MutagFeatureNoisy(DerivedDataset):
+    def __init__(self, root, noise, transform=None, pre_transform=None, original_graphs=None):
         """
         root = Where the dataset should be stored. This folder is split
         into raw_dir (downloaded dataset) and processed_dir (processed data).
         """
         self.root = root
-        self.flip_count = flip_count
-        self.name = f'ProteinsTopologyAdversarialAttack{flip_count}'
+        self.noise = noise
+        self.name = f'MutagenicityFeatureNoisy{noise}'
         self.cleaned = False
         self.max_graph_size = float('inf')
-        self.original_graphs = TUDataset(root=root, name='PROTEINS_full', use_node_attr=True)
-        self.graph_count = len(self.original_graphs)
-
-        super(ProteinsTopologyAdversarialAttack, self).__init__(root, transform, pre_transform)
-
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
+        self.original_dataset_name = 'Mutag'
+        self._original_graphs = original_graphs
 
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
-
-    def download(self):
-        pass
+        super(MutagFeatureNoisy, self).__init__(root, transform, pre_transform)
 
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
+    def generate_graphs(self):
+        raise NotImplementedError
 
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
 
-    @property
-    def num_classes(self) -> int:
-        return 2
+class ProteinsFeatureNoisy(DerivedDataset):
+    def __init__(self, root, noise, transform=None, pre_transform=None, mode='legacy', original_graphs=None):
+        """
+        root = Where the dataset should be stored. This folder is split
+        into raw_dir (downloaded dataset) and processed_dir (processed data).
+        mode = 'legacy' reproduces the random numbers of the original perturbation loop,
+        'vectorized' is faster, see perturbations.perturb_features.
+        """
+        self.root = root
+        self.noise = noise
+        self.mode = mode
+        self.name = f'ProteinsFeatureNoisy{noise}' if mode == 'legacy' else f'ProteinsFeatureNoisy{noise}_{mode}'
+        self.cleaned = False
+        self.max_graph_size = float('inf')
+        self.original_dataset_name = 'Proteins'
+        self._original_graphs = original_graphs
 
-    def random_sample_flip(self, graph, flip_count):
-        random.seed(0)
-        np.random.seed(0)
-        edges_to_flip = set()
-        while len(edges_to_flip) < flip_count:
-            patience = 100
-            while patience > 0:
-                all_nodes = range(graph.num_nodes)
-                allowed_nodes = all_nodes
-                u = np.random.choice(allowed_nodes, replace=False, )
-                v = np.random.choice(allowed_nodes, replace=False, )
-                if u == v:
-                    patience -= 1
-                    continue
-                u, v = min(u, v), max(u, v)
-                edges_to_flip.add((u, v))
-                break
-            if patience < 0:
-                pass
-        return edges_to_flip
+        super(ProteinsFeatureNoisy, self).__init__(root, transform, pre_transform)
 
-    def flip_edges(self, graph, edges_to_flip):
-        adj = to_dense_adj(graph.edge_index, max_num_nodes=graph.num_nodes).squeeze()
-        for u, v in edges_to_flip:
-            if adj[u, v] == 1:
-                adj[u, v] = 0
-                adj[v, u] = 0
-            else:
-                adj[u, v] = 1
-                adj[v, u] = 1
-        new_edge_index = dense_to_sparse(adj)[0]
-        data = Data(edge_index=new_edge_index.clone(),
-                    x=graph.x.clone(),
+    def noise_graph(self, graph, num_samples):
+        # sample 50% nodes randomly and perturb num_samples% features of them, feature-informed perturbation
+        perturbed_x = perturbations.perturb_features(graph.x, num_samples, mode=self.mode, seed=0)
+        data = Data(edge_index=graph.edge_index.clone(),
+                    x=perturbed_x.clone(),
                     y=graph.y.clone())
         return data
 
-    def noise_graph(self, graph, flip_count):
-        edges_to_flip = self.random_sample_flip(graph, flip_count)
-        new_data = self.flip_edges(graph, edges_to_flip)
-        return new_data
-
-    def process(self):
-        for i, graph in enumerate(self.original_graphs):
-            data = self.noise_graph(graph, self.flip_count)
-            torch.save(data, os.path.join(self.processed_dir, f'data_{i}.pt'))
-
-    def len(self):
-        return self.graph_count
+    def generate_graphs(self):
+        for graph in self.original_graphs:
+            yield self.noise_graph(graph, self.noise)
 
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
 
+class TopologyAdversarialAttack(DerivedDataset):
+    """
+    Base class of the topology adversarial attack datasets, every graph of the original dataset with flip_count node
+    pairs flipped. Subclasses set dataset_prefix and original_dataset_name.
+    """
+    dataset_prefix = None
 
-class IMDBTopologyAdversarialAttack(Dataset):
-    def __init__(self, root, flip_count, transform=None, pre_transform=None):
+    def __init__(self, root, flip_count, transform=None, pre_transform=None, mode='legacy', original_graphs=None):
         """
         root = Where the dataset should be stored. This folder is split
         into raw_dir (downloaded dataset) and processed_dir (processed data).
+        mode = 'legacy' samples flips with the original loop, 'vectorized' uses perturbations.flip_graphs.
         """
         self.root = root
         self.flip_count = flip_count
-        self.name = f'IMDBTopologyAdversarialAttack{flip_count}'
+        self.mode = mode
+        self.name = f'{self.dataset_prefix}TopologyAdversarialAttack{flip_count}' + ('' if mode == 'legacy' else f'_{mode}')
         self.cleaned = False
         self.max_graph_size = float('inf')
-        self.original_graphs = TUDataset(root=root, name='IMDB-BINARY', pre_transform=IMDBPreTransform())
-        self.graph_count = len(self.original_graphs)
-
-        super(IMDBTopologyAdversarialAttack, self).__init__(root, transform, pre_transform)
-
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
-
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
-
-    def download(self):
-        pass
-
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
-
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
+        self._original_graphs = original_graphs
 
-    @property
-    def num_classes(self) -> int:
-        return 2
+        super(TopologyAdversarialAttack, self).__init__(root, transform, pre_transform)
 
     def random_sample_flip(self, graph, flip_count):
         random.seed(0)
@@ -940,67 +480,32 @@ class IMDBTopologyAdversarialAttack(Dataset):
         new_data = self.flip_edges(graph, edges_to_flip)
         return new_data
 
-    def process(self):
-        for i, graph in enumerate(self.original_graphs):
-            data = self.noise_graph(graph, self.flip_count)
-            torch.save(data, os.path.join(self.processed_dir, f'data_{i}.pt'))
-
-    def len(self):
-        return self.graph_count
-
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
-
+    def generate_graphs(self):
+        if self.mode == 'vectorized':
+            yield from flip_dataset(self.original_graphs, [self.flip_count])[self.flip_count]
+        else:
+            for graph in self.original_graphs:
+                yield self.noise_graph(graph, self.flip_count)
 
-class AIDSTopologyAdversarialAttack(Dataset):
-    def __init__(self, root, flip_count, transform=None, pre_transform=None):
-        """
-        root = Where the dataset should be stored. This folder is split
-        into raw_dir (downloaded dataset) and processed_dir (processed data).
-        """
-        self.root = root
-        self.flip_count = flip_count
-        self.name = f'AIDSTopologyAdversarialAttack{flip_count}'
-        self.cleaned = False
-        self.max_graph_size = float('inf')
-        self.original_graphs = TUDataset(root=root, name='AIDS', use_node_attr=True)
-        self.graph_count = len(self.original_graphs)
 
-        super(AIDSTopologyAdversarialAttack, self).__init__(root, transform, pre_transform)
+class MutagenicityTopologyAdversarialAttack(TopologyAdversarialAttack):
+    dataset_prefix = 'Mutagenicity'
+    original_dataset_name = 'Mutagenicity'
 
-    @property
-    def raw_file_names(self):
-        """ If this file exists in raw_dir, the download is not triggered.
-            (The download func. is not implemented here)
-        """
-        return []
 
-    @property
-    def processed_file_names(self):
-        """ If these files are found in processed_dir, processing is skipped"""
-        return [f'data_{i}.pt' for i in range(self.graph_count)]
+class ProteinsTopologyAdversarialAttack(TopologyAdversarialAttack):
+    dataset_prefix = 'Proteins'
+    original_dataset_name = 'Proteins'
 
-    def download(self):
-        pass
 
-    @property
-    def raw_dir(self) -> str:
-        name = f'raw{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
+class IMDBTopologyAdversarialAttack(TopologyAdversarialAttack):
+    dataset_prefix = 'IMDB'
+    original_dataset_name = 'IMDB-B'
 
-    @property
-    def processed_dir(self) -> str:
-        name = f'processed{"_cleaned" if self.cleaned else ""}'
-        return os.path.join(self.root, self.name, name)
 
-    @property
-    def num_classes(self) -> int:
-        return 2
+class AIDSTopologyAdversarialAttack(TopologyAdversarialAttack):
+    dataset_prefix = 'AIDS'
+    original_dataset_name = 'AIDS'
 
     def random_sample_flip(self, graph, flip_count):
         random.seed(0)
@@ -1024,72 +529,36 @@ class AIDSTopologyAdversarialAttack(Dataset):
                 pass
         return edges_to_flip
 
-    def flip_edges(self, graph, edges_to_flip):
-        adj = to_dense_adj(graph.edge_index, max_num_nodes=graph.num_nodes).squeeze()
-        for u, v in edges_to_flip:
-            if adj[u, v] == 1:
-                adj[u, v] = 0
-                adj[v, u] = 0
-            else:
-                adj[u, v] = 1
-                adj[v, u] = 1
-        new_edge_index = dense_to_sparse(adj)[0]
-        data = Data(edge_index=new_edge_index.clone(),
-                    x=graph.x.clone(),
-                    y=graph.y.clone())
-        return data
-
-    def noise_graph(self, graph, flip_count):
-        edges_to_flip = self.random_sample_flip(graph, flip_count)
-        new_data = self.flip_edges(graph, edges_to_flip)
-        return new_data
-
-    def process(self):
-        for i, graph in enumerate(self.original_graphs):
-            data = self.noise_graph(graph, self.flip_count)
-            torch.save(data, os.path.join(self.processed_dir, f'data_{i}.pt'))
-
-    def len(self):
-        return self.graph_count
-
-    def get(self, idx):
-        """ - Equivalent to __getitem__ in pytorch
-            - Is not needed for PyG's InMemoryDataset
-        """
-        data = torch.load(os.path.join(self.processed_dir,
-                                       f'data_{idx}.pt'))
-        return data
-
 
 def split_data(data, train_ratio=0.8, val_ratio=0.1):
-    gen = torch.Generator().manual_seed(0)
     train_size = int(len(data) * train_ratio)
     val_size = int(len(data) * val_ratio)
     test_size = len(data) - train_size - val_size
-    splits = random_split(data, lengths=[train_size, val_size, test_size], generator=gen)
-    return splits, [split.indices for split in splits]
+    indices = artifact_cache.split_indices(len(data), [train_size, val_size, test_size], seed=0)
+    return [IndexView(data, split_indices) for split_indices in indices], indices
 
 
 def split_data_equally(data, num_splits=5):
-    gen = torch.Generator().manual_seed(0)
     number = len(data)
     base_quotient = number // num_splits
     remainder = number % num_splits
     numbers = [base_quotient for _ in range(num_splits)]
     for i in range(remainder):
         numbers[i] += 1
-    splits = random_split(data, lengths=numbers, generator=gen)
-    return splits, [split.indices for split in splits]
+    indices = artifact_cache.split_indices(len(data), numbers, seed=0)
+    return [IndexView(data, split_indices) for split_indices in indices], indices
 
 
-def sample_negative_edges(graph, num_samples):
-    random.seed(0)
+def sample_negative_edges(graph, num_samples, seed=0):
+    # negative_sampling draws from python's random module, seeding it per graph makes every graph independent of
+    # the graphs processed before it
+    random.seed(seed)
     new_edges = negative_sampling(graph.edge_index, num_neg_samples=num_samples * 2, num_nodes=graph.num_nodes, force_undirected=True)
     return new_edges
 
 
-def noise_graph(graph, num_samples):
-    new_edges = sample_negative_edges(graph, num_samples)
+def noise_graph(graph, num_samples, seed=0):
+    new_edges = sample_negative_edges(graph, num_samples, seed)
     new_edge_index = torch.hstack([graph.edge_index, new_edges])
     new_edge_index = sort_edge_index(new_edge_index)
     data = Data(edge_index=new_edge_index.clone(),
@@ -1098,6 +567,140 @@ def noise_graph(graph, num_samples):
     return data
 
 
+def noise_graph_levels(graph, noises, seed=0):
+    """ Returns the noisy versions of graph for every noise level in noises"""
+    return [noise_graph(graph, noise, seed) for noise in noises]
+
+
+def generate_noisy_datasets(dataset_name, noises=(1, 2, 3, 4, 5), num_workers=None, root='data/', seed=0):
+    """
+    Generates the topology noise datasets (*Noisy classes) of all noise levels in a single pass over original graphs.
+    Every (graph, noise) pair is seeded on its own, so the output is the same as the serial generation of the *Noisy
+    classes for any number of workers.
+    :param dataset_name: original dataset name, e.g. Mutagenicity
+    :param noises: noise levels to generate
+    :param num_workers: number of worker processes, None uses every cpu, 0 runs in the current process
+    :param root: data folder
+    :param seed: seed of every graph
+    :return: paths of the processed folders, one per noise level
+    """
+    original_graphs = load_dataset(dataset_name, root=root)
+    folders = [os.path.join(root, get_noisy_dataset_name(dataset_name, noise), 'processed') for noise in noises]
+    folders_to_generate = [folder for folder in folders if not packed_storage.is_packed(folder)]
+    if len(folders_to_generate) == 0:
+        return folders
+    noises = [noise for noise, folder in zip(noises, folders) if folder in folders_to_generate]
+
+    generate = partial(noise_graph_levels, noises=noises, seed=seed)
+    noisy_graphs = [[] for _ in noises]
+    if num_workers == 0:
+        results = map(generate, original_graphs)
+        for graphs in results:
+            for level, graph in enumerate(graphs):
+                noisy_graphs[level].append(graph)
+    else:
+        with multiprocessing.Pool(num_workers) as pool:
+            # imap keeps the order of original graphs
+            for graphs in pool.imap(generate, original_graphs, chunksize=64):
+                for level, graph in enumerate(graphs):
+                    noisy_graphs[level].append(graph)
+
+    for folder, graphs in zip(folders_to_generate, noisy_graphs):
+        packed_storage.pack_graphs(graphs, folder)
+    return folders
+
+
+def flip_dataset(original_graphs, flip_counts, seed=0):
+    """
+    Topology adversarial attack of a whole dataset for several flip counts at once, see perturbations.flip_graphs.
+    :return: dict of flip count to list of flipped graphs
+    """
+    graphs = list(original_graphs)
+    flipped_edge_indices = perturbations.flip_graphs(graphs, flip_counts=flip_counts, seed=seed)
+    return {flip_count: [Data(edge_index=edge_index, x=graph.x.clone(), y=graph.y.clone())
+                         for graph, edge_index in zip(graphs, flipped_edge_indices[flip_count])]
+            for flip_count in flip_counts}
+
+
+def generate_topology_adversarial_datasets(dataset_name, flip_counts=(1, 2, 3, 4, 5), root='data/', seed=0, original_graphs=None):
+    """
+    Generates the vectorized topology adversarial datasets (mode='vectorized' of *TopologyAdversarialAttack classes)
+    of all flip counts together.
+    :param original_graphs: already loaded original dataset
+    :return: paths of the processed folders, one per flip count
+    """
+    folders = [os.path.join(root, get_variant_dataset_name(dataset_name, 'topology_adversarial', flip_count, flip_mode='vectorized'), 'processed')
+               for flip_count in flip_counts]
+    flip_counts = [flip_count for flip_count, folder in zip(flip_counts, folders) if not packed_storage.is_packed(folder)]
+    if len(flip_counts) > 0:
+        if original_graphs is None:
+            original_graphs = load_dataset(dataset_name, root=root)
+        flipped_graphs = flip_dataset(original_graphs, flip_counts, seed=seed)
+        for flip_count in flip_counts:
+            folder = os.path.join(root, get_variant_dataset_name(dataset_name, 'topology_adversarial', flip_count, flip_mode='vectorized'), 'processed')
+            packed_storage.pack_graphs(flipped_graphs[flip_count], folder)
+    return folders
+
+
+class PerturbedDataset(Dataset):
+    """
+    Perturbs the graphs of any dataset returned by load_dataset on access, instead of materializing a noisy dataset
+    on disk. Perturbations only depend on the seed and the graph index, so with the same seed the graphs are equal to
+    the ones of the corresponding materialized dataset: *Noisy for 'topology_random', ProteinsFeatureNoisy for
+    'feature' and *TopologyAdversarialAttack with mode='vectorized' for 'topology_adversarial'.
+    Recently used perturbed graphs are kept in a bounded LRU cache.
+    """
+
+    def __init__(self, dataset, family, level, seed=0, cache_size=1024, feature_mode='legacy', transform=None):
+        """
+        :param dataset: original dataset
+        :param family: 'topology_random', 'feature' or 'topology_adversarial'
+        :param level: number of added edges, percentage of perturbed features or number of flips
+        :param seed: seed of the perturbations
+        :param cache_size: maximum number of cached perturbed graphs, 0 disables the cache
+        :param feature_mode: mode of perturbations.perturb_features
+        """
+        if family not in ['topology_random', 'feature', 'topology_adversarial']:
+            raise NotImplementedError(f'Perturbation family: {family} is not implemented!')
+        self.dataset = dataset
+        self.family = family
+        self.level = level
+        self.seed = seed
+        self.cache_size = cache_size
+        self.feature_mode = feature_mode
+        self.cache = OrderedDict()
+        super(PerturbedDataset, self).__init__(None, transform)
+
+    @property
+    def num_classes(self) -> int:
+        return self.dataset.num_classes
+
+    def perturb(self, idx, graph):
+        if self.family == 'topology_random':
+            return noise_graph(graph, self.level, seed=self.seed)
+        elif self.family == 'feature':
+            perturbed_x = perturbations.perturb_features(graph.x, self.level, mode=self.feature_mode, seed=self.seed)
+            return Data(edge_index=graph.edge_index.clone(), x=perturbed_x, y=graph.y.clone())
+        else:
+            flipped_edge_indices = perturbations.flip_graphs([graph], flip_counts=[self.level], graph_ids=[idx], seed=self.seed)
+            return Data(edge_index=flipped_edge_indices[self.level][0], x=graph.x.clone(), y=graph.y.clone())
+
+    def len(self):
+        return len(self.dataset)
+
+    def get(self, idx):
+        # copies as InMemoryDataset.get, transforms and callers may modify the returned graph in place
+        if idx in self.cache:
+            self.cache.move_to_end(idx)
+            return copy.copy(self.cache[idx])
+        graph = self.perturb(idx, self.dataset[idx])
+        if self.cache_size > 0:
+            self.cache[idx] = graph
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return copy.copy(graph)
+
+
 def adj_from_edge_index(graph):
     if graph.edge_index.shape[1] == 0:
         adj = torch.zeros(graph.num_nodes, graph.num_nodes)
@@ -1143,64 +746,289 @@ def get_topology_adversarial_attack_dataset_name(dataset_name, flip_count):
         raise NotImplementedError
 
 
+def get_variant_dataset_name(dataset_name, family, level, flip_mode='legacy'):
+    """
+    :param flip_mode: mode of the topology adversarial datasets, 'vectorized' names the datasets of
+                      generate_topology_adversarial_datasets
+    """
+    if family == 'topology_random':
+        return get_noisy_dataset_name(dataset_name, level)
+    elif family == 'feature':
+        return get_noisy_feature_dataset_name(dataset_name, level)
+    elif family == 'topology_adversarial':
+        name = get_topology_adversarial_attack_dataset_name(dataset_name, level)
+        return name if flip_mode == 'legacy' else f'{name}_{flip_mode}'
+    else:
+        raise NotImplementedError(f'Perturbation family: {family} is not implemented!')
+
+
+class DatasetVariants(object):
+    """
+    Perturbed variants of a dataset keyed by (perturbation family, level), e.g. ('topology_random', 3) is
+    MutagenicityNoisy3 for Mutagenicity. The original dataset is loaded at most once and shared by every variant,
+    variants whose processed data is already on disk do not need it at all.
+    """
+
+    def __init__(self, dataset_name, root='data/', original_graphs=None, lazy=False, seed=0, flip_mode='legacy'):
+        """
+        :param dataset_name: original dataset name
+        :param root: data folder
+        :param original_graphs: already loaded original dataset
+        :param lazy: perturbs graphs on access with PerturbedDataset instead of loading materialized datasets, lazy
+                     topology adversarial variants are the vectorized ones
+        :param seed: seed of PerturbedDataset
+        :param flip_mode: 'legacy' or 'vectorized' topology adversarial datasets, see get_variant_dataset_name
+        """
+        self.dataset_name = dataset_name
+        self.root = root
+        self.lazy = lazy
+        self.seed = seed
+        self.flip_mode = flip_mode
+        self._original_graphs = original_graphs
+        self.variants = {}
+
+    @property
+    def original_graphs(self):
+        if self._original_graphs is None:
+            self._original_graphs = load_dataset(self.dataset_name, root=self.root)
+        return self._original_graphs
+
+    def name(self, family, level):
+        """ Dataset name of a variant for load_dataset, e.g. the name saved with its explanations"""
+        # lazily perturbed graphs are equal to the materialized graphs of this name
+        flip_mode = 'vectorized' if self.lazy else self.flip_mode
+        return get_variant_dataset_name(self.dataset_name, family, level, flip_mode=flip_mode)
+
+    def get(self, family, level):
+        key = (family, level)
+        if key not in self.variants:
+            if self.lazy:
+                self.variants[key] = PerturbedDataset(self.original_graphs, family, level, seed=self.seed)
+            else:
+                name = self.name(family, level)
+                processed_dir = os.path.join(self.root, name, 'processed')
+                original_graphs = self._original_graphs if packed_storage.is_packed(processed_dir) else self.original_graphs
+                self.variants[key] = load_dataset(name, root=self.root, original_graphs=original_graphs)
+        return self.variants[key]
+
+    def __getitem__(self, key):
+        return self.get(*key)
+
+
 class IMDBPreTransform(object):
+    def __init__(self, categorical=False):
+        self.categorical = categorical
+
     def __call__(self, data):
         data.x = degree(data.edge_index[0], data.num_nodes, dtype=torch.long)
-        data.x = F.one_hot(data.x, num_classes=136).to(torch.float)
+        if self.categorical:
+            data.x = data.x.view(-1, 1)
+        else:
+            data.x = F.one_hot(data.x, num_classes=136).to(torch.float)
         return data
 
 
 class REDDITPreTransform(object):
+    def __init__(self, categorical=False):
+        self.categorical = categorical
+
     def __call__(self, data):
         data.x = degree(data.edge_index[0], data.num_nodes, dtype=torch.long)
-        data.x = F.one_hot(data.x, num_classes=3063).to(torch.float)
+        if self.categorical:
+            data.x = data.x.view(-1, 1)
+        else:
+            data.x = F.one_hot(data.x, num_classes=3063).to(torch.float)
+        return data
+
+
+class OneHotIndexPreTransform(object):
+    """Replaces one-hot node features by the index of their category."""
+    def __call__(self, data):
+        if not torch.all(data.x.sum(dim=1) == 1):
+            raise ValueError('Node features are not one-hot!')
+        data.x = data.x.argmax(dim=1, keepdim=True)
         return data
 
 
-def load_dataset(dataset_name, root='data/'):
+class CategoricalTUDataset(TUDataset):
+    """
+    TUDataset with category id node features, stored as a [num_nodes, 1] long tensor instead of a one-hot matrix.
+    It shares the raw files of the one-hot version and is processed in processed_categorical next to it.
+    """
+    def __init__(self, root, name, num_categories, pre_transform, use_node_attr=False):
+        self.num_categories = num_categories
+        super().__init__(root=root, name=name, pre_transform=pre_transform, use_node_attr=use_node_attr)
+
+    @property
+    def processed_dir(self):
+        return os.path.join(self.root, self.name, 'processed_categorical')
+
+
+def parse_variant_suffix(suffix):
+    """Parses '<level>' or '<level>_<mode>' at the end of a derived dataset name, mode defaults to 'legacy'."""
+    level, _, mode = suffix.partition('_')
+    return int(level), mode or 'legacy'
+
+
+def load_categorical_dataset(dataset_name, root='data/'):
+    """
+    Dataset whose node features are category ids, num_categories of the dataset is the width of its one-hot features.
+    """
     if dataset_name == 'Mutagenicity':
+        data = CategoricalTUDataset(root=root, name='Mutagenicity', num_categories=14, pre_transform=OneHotIndexPreTransform(), use_node_attr=True)
+    elif dataset_name == 'Mutag':
+        data = CategoricalTUDataset(root=root, name='MUTAG', num_categories=7, pre_transform=OneHotIndexPreTransform(), use_node_attr=True)
+    elif dataset_name == 'IMDB-B':
+        data = CategoricalTUDataset(root=root, name='IMDB-BINARY', num_categories=136, pre_transform=IMDBPreTransform(categorical=True))
+    elif dataset_name == 'REDDIT-B':
+        data = CategoricalTUDataset(root=root, name='REDDIT-BINARY', num_categories=3063, pre_transform=REDDITPreTransform(categorical=True))
+    else:
+        raise NotImplementedError(f'Categorical dataset: {dataset_name} is not implemented!')
+
+    return data
+
+
+SHARED_DATASETS_ENV = 'GNNX_SHARED_DATASETS'
+SHARDED_DATASETS_ENV = 'GNNX_SHARDED_DATASETS'
+# datasets too large to hold one in-memory copy per process, they can be streamed from shards, see ShardedDataset
+SHARDED_DATASETS = ['Graph-SST2', 'ogbg_molhiv', 'REDDIT-B', 'DD']
+
+
+class SharedDataset(Dataset):
+    """
+    Dataset backed by a packed folder that the processes of one host map instead of holding private copies of an
+    in-memory dataset. The first process publishes the graphs, the others attach to the files without loading the
+    dataset, so the pages of the dataset are in memory once however many processes use it.
+    """
+    reader = packed_storage.PackedGraphs
+
+    def __init__(self, folder, transform=None):
+        self.folder = folder
+        self.packed_graphs = self.reader(folder)
+        if 'num_categories' in self.packed_graphs.attributes:
+            self.num_categories = self.packed_graphs.attributes['num_categories']
+        super(SharedDataset, self).__init__(None, transform)
+
+    @property
+    def processed_dir(self) -> str:
+        return self.folder
+
+    @property
+    def num_classes(self) -> int:
+        return self.packed_graphs.attributes['num_classes']
+
+    def len(self):
+        return self.packed_graphs.num_graphs
+
+    def get(self, idx):
+        return self.packed_graphs.get(idx)
+
+
+class ShardedDataset(SharedDataset):
+    """
+    SharedDataset backed by a sharded folder, only the shards of the graphs a process reads are mapped. Shuffled
+    loaders stream it shard by shard, see loaders.py.
+    """
+    reader = packed_storage.ShardedGraphs
+
+
+def get_shared_dataset_folder(dataset_name, root='data/', shared=True, categorical=False, sharded=False):
+    """
+    :param shared: True or '1' for root, otherwise the folder of the shared copies, e.g. a folder in /dev/shm
+    :param sharded: folder of the sharded copy instead of the packed one
+    """
+    shared_root = root if shared in [True, '1'] else shared
+    folder_name = 'sharded' if sharded else 'shared'
+    return os.path.join(shared_root, dataset_name, f'{folder_name}_categorical' if categorical else folder_name)
+
+
+def share_dataset(dataset, folder, shard_size=None):
+    """
+    Publishes an in-memory dataset in packed format in folder, once for all processes.
+    :param shard_size: publishes the dataset in sharded format with shard_size graphs per shard
+    :return: SharedDataset or ShardedDataset reading folder
+    """
+    attributes = {'num_classes': dataset.num_classes}
+    if hasattr(dataset, 'num_categories'):
+        attributes['num_categories'] = dataset.num_categories
+    packed_storage.publish_graphs((dataset[i] for i in range(len(dataset))), folder, attributes=attributes,
+                                  shard_size=shard_size)
+    return SharedDataset(folder) if shard_size is None else ShardedDataset(folder)
+
+
+def load_dataset(dataset_name, root='data/', original_graphs=None, categorical=False, shared=None, sharded=None):
+    """
+    :param dataset_name: original or derived dataset name
+    :param root: data folder
+    :param original_graphs: already loaded original dataset of a derived dataset, see DerivedDataset
+    :param categorical: category id node features instead of one-hot features, see load_categorical_dataset
+    :param shared: backs in-memory datasets by files shared between processes, see SharedDataset. True shares them in
+                   root/<dataset_name>/shared, a path shares them in that folder. None reads the GNNX_SHARED_DATASETS
+                   environment variable ('1' or a path), so shell drivers can opt in for all of their processes. Shared
+                   copies are not rebuilt when the dataset is processed again, remove their folder to do so.
+    :param sharded: backs the datasets of SHARDED_DATASETS by a sharded folder instead, see ShardedDataset. True or a
+                    path as for shared, None reads the GNNX_SHARDED_DATASETS environment variable.
+    """
+    if shared is None:
+        shared = os.environ.get(SHARED_DATASETS_ENV, '') or False
+    if sharded is None:
+        sharded = os.environ.get(SHARDED_DATASETS_ENV, '') or False
+    if dataset_name not in SHARDED_DATASETS:
+        sharded = False
+    if sharded:
+        shared_folder = get_shared_dataset_folder(dataset_name, root=root, shared=sharded, categorical=categorical, sharded=True)
+        if packed_storage.is_sharded(shared_folder):
+            return ShardedDataset(shared_folder)
+    elif shared:
+        shared_folder = get_shared_dataset_folder(dataset_name, root=root, shared=shared, categorical=categorical)
+        if packed_storage.is_packed(shared_folder):
+            return SharedDataset(shared_folder)
+
+    if categorical:
+        data = load_categorical_dataset(dataset_name, root=root)
+    elif dataset_name == 'Mutagenicity':
         data = TUDataset(root=root, name='Mutagenicity', use_node_attr=True)
     elif "MutagenicityNoisy" in dataset_name:
         noise = int(dataset_name[17:])
-        data = MutagenicityNoisy(root=root, noise=noise)
+        data = MutagenicityNoisy(root=root, noise=noise, original_graphs=original_graphs)
     elif 'MutagenicityFeatureNoisy' in dataset_name:
         noise = int(dataset_name[24:])
-        data = MutagenicityFeatureNoisy(root=root, noise=noise)
+        data = MutagenicityFeatureNoisy(root=root, noise=noise, original_graphs=original_graphs)
     elif 'MutagenicityTopologyAdversarialAttack' in dataset_name:
-        flip = int(dataset_name[37:])
-        data = MutagenicityTopologyAdversarialAttack(root=root, flip_count=flip)
+        flip, mode = parse_variant_suffix(dataset_name[37:])
+        data = MutagenicityTopologyAdversarialAttack(root=root, flip_count=flip, mode=mode, original_graphs=original_graphs)
     elif dataset_name == 'Mutag':
         data = TUDataset(root=root, name='MUTAG', use_node_attr=True)
     elif 'MutagFeatureNoisy' in dataset_name:
         noise = int(dataset_name[17:])
-        data = MutagFeatureNoisy(root=root, noise=noise)
+        data = MutagFeatureNoisy(root=root, noise=noise, original_graphs=original_graphs)
     elif dataset_name == 'Proteins':
         data = TUDataset(root=root, name='PROTEINS_full', use_node_attr=True)
     elif "ProteinsNoisy" in dataset_name:
         noise = int(dataset_name[13:])
-        data = ProteinsNoisy(root=root, noise=noise)
+        data = ProteinsNoisy(root=root, noise=noise, original_graphs=original_graphs)
     elif 'ProteinsFeatureNoisy' in dataset_name:
-        noise = int(dataset_name[20:])
-        data = ProteinsFeatureNoisy(root=root, noise=noise)
+        noise, mode = parse_variant_suffix(dataset_name[20:])
+        data = ProteinsFeatureNoisy(root=root, noise=noise, mode=mode, original_graphs=original_graphs)
     elif 'ProteinsTopologyAdversarialAttack' in dataset_name:
-        flip = int(dataset_name[33:])
-        data = ProteinsTopologyAdversarialAttack(root=root, flip_count=flip)
+        flip, mode = parse_variant_suffix(dataset_name[33:])
+        data = ProteinsTopologyAdversarialAttack(root=root, flip_count=flip, mode=mode, original_graphs=original_graphs)
     elif dataset_name == 'IMDB-B':
         data = TUDataset(root=root, name='IMDB-BINARY', pre_transform=IMDBPreTransform())
     elif 'IMDBNoisy' in dataset_name:
         noise = int(dataset_name[9:])
-        data = IMDBNoisy(root=root, noise=noise)
+        data = IMDBNoisy(root=root, noise=noise, original_graphs=original_graphs)
     elif 'IMDBTopologyAdversarialAttack' in dataset_name:
-        flip = int(dataset_name[29:])
-        data = IMDBTopologyAdversarialAttack(root=root, flip_count=flip)
+        flip, mode = parse_variant_suffix(dataset_name[29:])
+        data = IMDBTopologyAdversarialAttack(root=root, flip_count=flip, mode=mode, original_graphs=original_graphs)
     elif dataset_name == 'AIDS':
         data = TUDataset(root=root, name='AIDS', use_node_attr=True)
     elif 'AIDSNoisy' in dataset_name:
         noise = int(dataset_name[9:])
-        data = AIDSNoisy(root=root, noise=noise)
+        data = AIDSNoisy(root=root, noise=noise, original_graphs=original_graphs)
     elif 'AIDSTopologyAdversarialAttack' in dataset_name:
-        flip = int(dataset_name[29:])
-        data = AIDSTopologyAdversarialAttack(root=root, flip_count=flip)
+        flip, mode = parse_variant_suffix(dataset_name[29:])
+        data = AIDSTopologyAdversarialAttack(root=root, flip_count=flip, mode=mode, original_graphs=original_graphs)
     elif dataset_name == 'NCI1':
         data = TUDataset(root=root, name='NCI1', use_node_attr=True)
     elif dataset_name == 'Graph-SST2':
@@ -1210,54 +1038,57 @@ def load_dataset(dataset_name, root='data/'):
     elif dataset_name == 'REDDIT-B':
         data = TUDataset(root=root, name='REDDIT-BINARY', pre_transform=REDDITPreTransform())
     elif dataset_name == 'ogbg_molhiv':
-        data = PygGraphPropPredDataset(root=root, name='ogbg-molhiv')
+        data = ogb_graphproppred.PygGraphPropPredDataset(root=root, name='ogbg-molhiv')
     else:
         raise NotImplementedError(f'Dataset: {dataset_name} is not implemented!')
 
+    if sharded:
+        data = share_dataset(data, shared_folder, shard_size=packed_storage.SHARD_SIZE)
+    elif shared and not isinstance(data, DerivedDataset):
+        # derived datasets are already memory mapped
+        data = share_dataset(data, shared_folder)
     return data
 
 
 def load_explanations(dataset_name, explainer_name, gnn_type, device, run):
     path = f'data/{dataset_name}/{explainer_name}/explanations_{gnn_type}_run_{run}.pt'
-    return torch.load(path, map_location=device)
+    return explanation_store.load_explanations(path, device)
 
 
 def load_explanations_test(dataset_name, explainer_name, gnn_type, device, run):
     path = f'data/{dataset_name}/{explainer_name}/explanations_{gnn_type}_run_{run}_test.pt'
-    return torch.load(path, map_location=device)
+    return explanation_store.load_explanations(path, device)
 
 
 def load_explanations_noisy(dataset_name, explainer_name, gnn_type, device, run, k):
     path = f'data/{dataset_name}/{explainer_name}/explanations_{gnn_type}_run_{run}_noise_{k}.pt'
-    return torch.load(path, map_location=device)
+    return explanation_store.load_explanations(path, device)
+
 
 def load_explanations_noisy_test(dataset_name, explainer_name, gnn_type, device, run, k):
     path = f'data/{dataset_name}/{explainer_name}/explanations_{gnn_type}_run_{run}_noise_{k}_test.pt'
-    return torch.load(path, map_location=device)
+    return explanation_store.load_explanations(path, device)
+
 
 def load_explanations_noisy_feature(dataset_name, explainer_name, gnn_type, device, run, k):
     path = f'data/{dataset_name}/{explainer_name}/explanations_{gnn_type}_run_{run}_feature_noise_{k}.pt'
-    return torch.load(path, map_location=device)
+    return explanation_store.load_explanations(path, device)
 
 
 def load_explanations_topology_adversarial(dataset_name, explainer_name, gnn_type, device, run, k):
     path = f'data/{dataset_name}/{explainer_name}/explanations_{gnn_type}_run_{run}_topology_adversarial_{k}.pt'
-    return torch.load(path, map_location=device)
+    return explanation_store.load_explanations(path, device)
 
 
 def select_top_k_explanations(dataset, top_k):
     top_k_dataset = []
     for graph in dataset:
         if graph.edge_index.shape[1] > 0 and not graph.edge_weight.sum().isnan().item():
-            directed_edge_weight = graph.edge_weight[graph.edge_index[0] <= graph.edge_index[1]]
-            directed_edge_index = graph.edge_index[:, graph.edge_index[0] <= graph.edge_index[1]]
-            idx = directed_edge_weight >= directed_edge_weight.topk(min(top_k, directed_edge_weight.shape[0]))[0][-1]
-            directed_edge_index = directed_edge_index[:, idx]
+            edge_index = canonical_edges.select_undirected(graph, edge_ranking.top_k_positions(graph, top_k))[0]
             new_data = Data(
-                edge_index=directed_edge_index.clone(),
+                edge_index=edge_index,
                 x=graph.x.clone()
             )
-            new_data = ToUndirected()(new_data)
             new_data = RemoveIsolatedNodes()(new_data)
             new_data.y = graph.y.clone()
             top_k_dataset.append(new_data)
@@ -1273,15 +1104,11 @@ def remove_top_k_explanations(dataset, top_k):
         if num_edges <= top_k:  # we keep at least one edge on each graph
             top_k = num_edges - 1
         if graph.edge_index.shape[1] > 0 and not graph.edge_weight.sum().isnan().item() and not top_k == 0:
-            directed_edge_weight = graph.edge_weight[graph.edge_index[0] <= graph.edge_index[1]]
-            directed_edge_index = graph.edge_index[:, graph.edge_index[0] <= graph.edge_index[1]]
-            idx = directed_edge_weight < directed_edge_weight.topk(min(top_k, directed_edge_weight.shape[0]))[0][-1]
-            directed_edge_index = directed_edge_index[:, idx]
+            edge_index = canonical_edges.select_undirected(graph, edge_ranking.remaining_positions(graph, top_k))[0]
             new_data = Data(
-                edge_index=directed_edge_index.clone(),
+                edge_index=edge_index,
                 x=graph.x.clone()
             )
-            new_data = ToUndirected()(new_data)
             new_data = RemoveIsolatedNodes()(new_data)
             new_data.y = graph.y.clone()
             if new_data.edge_index.shape[1] == 0:  # get random edge from the original graph with the least edge weight
@@ -1323,13 +1150,19 @@ if __name__ == '__main__':
     for dataset_name in ['Mutagenicity', 'Proteins', 'IMDB-B', 'Mutag', 'AIDS', 'NCI1', 'Graph-SST2', 'DD', 'REDDIT-B']:
         dataset = load_dataset(dataset_name)
 
-    # generate noisy datasets
-    for dataset_name in ['Mutagenicity', 'Proteins', 'IMDB', 'AIDS']:
+    # generate noisy datasets, every noise level in one parallel pass
+    for dataset_name in ['Mutagenicity', 'Proteins', 'IMDB-B', 'AIDS']:
+        generate_noisy_datasets(dataset_name, noises=[1, 2, 3, 4, 5])
         for noise in [1, 2, 3, 4, 5]:
-            load_dataset(f'{dataset_name}Noisy{noise}')
+            load_dataset(get_noisy_dataset_name(dataset_name, noise))
 
     # generate noisy datasets: feature-space perturbation
     for dataset_name in ['Proteins']:
         # % of features perturbed
         for noise in [10, 20, 30, 40, 50]:
             load_dataset(f'{dataset_name}FeatureNoisy{noise}')
+
+    # generate topology adversarial datasets of the vectorized flips, every flip count in one pass. The legacy
+    # datasets (*TopologyAdversarialAttack{flip_count}) are generated when they are first loaded.
+    for dataset_name in ['Mutagenicity', 'Proteins', 'IMDB-B', 'AIDS']:
+        generate_topology_adversarial_datasets(dataset_name, flip_counts=[1, 2, 3, 4, 5])
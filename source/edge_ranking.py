@@ -0,0 +1,79 @@
+# Canonical edge ranking of explanations.
+#
+# Explanations weight both directions of an undirected edge, top-k queries only look at the canonical direction
+# u <= v. The ranking of an explanation is the list of canonical edge positions sorted by decreasing weight (ties keep
+# the edge order) together with the first rank of every tie group. Top-k with ties (weights >= k-th largest weight) is
+# a prefix of the ranking and all but top-k (weights < k-th largest weight) is the rest, so a sweep over k does not
+# call topk again.
+
+import torch
+
+
+def rank_edges(edge_index, edge_weight):
+    """
+    Ranks the canonical (u <= v) edges of an explanation by decreasing weight.
+    :param edge_index: LongTensor [2, num_edges]
+    :param edge_weight: Tensor [num_edges]
+    :return: edge_rank LongTensor [num_canonical_edges], positions in edge_index sorted by decreasing weight,
+             edge_rank_tie LongTensor [num_canonical_edges], first rank of the tie group of every rank
+    """
+    positions = (edge_index[0] <= edge_index[1]).nonzero().flatten()
+    sorted_weight, order = torch.sort(edge_weight[positions], descending=True, stable=True)
+    ranks = torch.arange(sorted_weight.shape[0])
+    group_start = torch.ones_like(ranks, dtype=torch.bool)
+    group_start[1:] = sorted_weight[1:] != sorted_weight[:-1]
+    edge_rank_tie = torch.cummax(torch.where(group_start, ranks, torch.zeros_like(ranks)), dim=0)[0]
+    return positions[order], edge_rank_tie
+
+
+def has_valid_weights(explanation):
+    return explanation.edge_index.shape[1] > 0 and not explanation.edge_weight.sum().isnan().item()
+
+
+def add_edge_ranking(explanation):
+    """ Stores the ranking of an explanation as edge_rank and edge_rank_tie attributes, skipped for invalid weights"""
+    if has_valid_weights(explanation):
+        explanation.edge_rank, explanation.edge_rank_tie = rank_edges(explanation.edge_index, explanation.edge_weight)
+    else:
+        explanation.edge_rank = torch.zeros(0, dtype=torch.long)
+        explanation.edge_rank_tie = torch.zeros(0, dtype=torch.long)
+    return explanation
+
+
+def edge_ranking(explanation):
+    """ Stored ranking of explanation, computed if the explanation does not have one"""
+    if getattr(explanation, 'edge_rank', None) is not None and explanation.edge_rank.shape[0] > 0:
+        return explanation.edge_rank, explanation.edge_rank_tie
+    return rank_edges(explanation.edge_index, explanation.edge_weight)
+
+
+def top_k_end(edge_rank_tie, k):
+    """ Length of the ranking prefix with weights >= k-th largest weight"""
+    k = min(k, edge_rank_tie.shape[0])
+    return torch.searchsorted(edge_rank_tie, edge_rank_tie[k - 1], right=True)
+
+
+def top_k_ends(edge_rank_tie, ks):
+    """ top_k_end of every k of ks, LongTensor"""
+    ks = torch.as_tensor(ks, dtype=torch.long).clamp(min=1, max=edge_rank_tie.shape[0])
+    return torch.searchsorted(edge_rank_tie, edge_rank_tie[ks - 1], right=True)
+
+
+def top_k_positions(explanation, k):
+    """
+    Positions of the canonical edges whose weight is at least the k-th largest weight, in edge order.
+    :param explanation: PyTorch Geometric Data where edge_weight is assigned as explanations
+    :param k: number of top edges, all edges are selected if there are fewer canonical edges
+    """
+    edge_rank, edge_rank_tie = edge_ranking(explanation)
+    return edge_rank[:top_k_end(edge_rank_tie, k)].sort()[0]
+
+
+def remaining_positions(explanation, k):
+    """
+    Positions of the canonical edges whose weight is less than the k-th largest weight, in edge order.
+    :param explanation: PyTorch Geometric Data where edge_weight is assigned as explanations
+    :param k: number of top edges to remove
+    """
+    edge_rank, edge_rank_tie = edge_ranking(explanation)
+    return edge_rank[top_k_end(edge_rank_tie, k):].sort()[0]
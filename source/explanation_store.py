@@ -0,0 +1,200 @@
+# Columnar explanation store: explanations_{...}.pt files of pickled Data lists are stored as a packed folder with the
+# same name without .pt suffix (see packed_storage.py), so one graph or one fold is read without unpickling the rest.
+#
+# Explainers store only edge weights: `edge_weight.npy` with `edge_weight_ptr.npy` offsets and the dataset index of
+# every explained graph in `graph_index.npy`. `references.json` names the dataset (variant) the indices refer to,
+# x, edge_index and y are read from that dataset when an explanation is accessed.
+#
+# Both formats store the canonical edge ranking of every explanation (edge_rank, edge_rank_tie, see edge_ranking.py),
+# computed once at save or convert time.
+
+import os
+import sys
+import glob
+import json
+
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+import packed_storage
+import edge_ranking
+import canonical_edges
+
+REFERENCES_FILE_NAME = 'references.json'
+
+
+def store_folder(path):
+    """ Packed folder of an explanations_{...}.pt path"""
+    return path[:-3] if path.endswith('.pt') else path
+
+
+def save_explanations(explanations, path):
+    """
+    Saves a list of explanation graphs in packed format.
+    :param explanations: list of PyTorch Geometric Data where edge_weight is assigned as explanations
+    :param path: explanations_{...}.pt path, explanations are written to store_folder(path)
+    :return: number of saved explanations
+    """
+    return packed_storage.pack_graphs((edge_ranking.add_edge_ranking(explanation.clone()) for explanation in explanations), store_folder(path))
+
+
+def save_array_list(arrays, folder, key):
+    """ Saves a list of 1-D arrays as <key>.npy and <key>_ptr.npy offsets"""
+    sizes = [array.shape[0] for array in arrays]
+    np.save(os.path.join(folder, f'{key}.npy'), np.concatenate(arrays) if len(arrays) > 0 else np.zeros(0))
+    np.save(os.path.join(folder, f'{key}_ptr.npy'), np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64))
+
+
+def save_edge_weights(edge_weights, path, dataset_name, graph_indices, dataset=None):
+    """
+    Saves explanations as edge weights of dataset graphs, without copying their features and topology.
+    :param edge_weights: list of edge weight tensors, ordered like the edges of the explained graphs
+    :param path: explanations_{...}.pt path, explanations are written to store_folder(path)
+    :param dataset_name: name of the explained dataset (variant) for load_dataset, e.g. MutagenicityNoisy3
+    :param graph_indices: dataset index of every explained graph
+    :param dataset: already loaded explained dataset, used for the edge rankings
+    :return: number of saved explanations
+    """
+    folder = store_folder(path)
+    os.makedirs(folder, exist_ok=True)
+    edge_weights = [edge_weight.detach().cpu().reshape(-1) for edge_weight in edge_weights]
+    graph_indices = np.asarray(list(graph_indices), dtype=np.int64)
+    if len(edge_weights) != graph_indices.shape[0]:
+        raise ValueError(f'{len(edge_weights)} edge weights are given for {graph_indices.shape[0]} graphs.')
+    save_array_list([edge_weight.numpy() for edge_weight in edge_weights], folder, 'edge_weight')
+    np.save(os.path.join(folder, 'graph_index.npy'), graph_indices)
+
+    if dataset is None:
+        # data_utils imports this module
+        import data_utils
+        dataset = data_utils.load_dataset(dataset_name)
+    rankings = [edge_ranking.add_edge_ranking(Data(edge_index=dataset[int(graph_index)].edge_index, edge_weight=edge_weight))
+                for graph_index, edge_weight in zip(graph_indices, edge_weights)]
+    save_array_list([ranking.edge_rank.numpy() for ranking in rankings], folder, 'edge_rank')
+    save_array_list([ranking.edge_rank_tie.numpy() for ranking in rankings], folder, 'edge_rank_tie')
+
+    # references file is written last, a folder without it is considered incomplete
+    with open(os.path.join(folder, REFERENCES_FILE_NAME), 'w') as f:
+        json.dump({'dataset': dataset_name, 'num_graphs': len(edge_weights)}, f)
+    return len(edge_weights)
+
+
+def is_referenced(folder):
+    return os.path.exists(os.path.join(folder, REFERENCES_FILE_NAME))
+
+
+class ReferencedExplanations(object):
+    """
+    Reader of explanations saved with save_edge_weights. Edge weights are memory-mapped, explanation i is rehydrated
+    on access as Data(edge_index, x, y, edge_weight) of its dataset graph, with the canonical edge index of the
+    graph stored next to the dataset (undirected_id, reverse_edge, see canonical_edges.py).
+    """
+    keys = ['edge_weight', 'edge_rank', 'edge_rank_tie']
+
+    def __init__(self, folder, dataset=None, root='data/'):
+        """
+        :param folder: explanation folder
+        :param dataset: already loaded dataset of the explanations, loaded on first access otherwise
+        :param root: data folder of load_dataset
+        """
+        self.folder = folder
+        self.root = root
+        with open(os.path.join(folder, REFERENCES_FILE_NAME)) as f:
+            references = json.load(f)
+        self.dataset_name = references['dataset']
+        self.num_graphs = references['num_graphs']
+        self.arrays = {key: np.load(os.path.join(folder, f'{key}.npy'), mmap_mode='c') for key in self.keys}
+        self.ptrs = {key: np.load(os.path.join(folder, f'{key}_ptr.npy')) for key in self.keys}
+        self.graph_indices = np.load(os.path.join(folder, 'graph_index.npy'))
+        self._dataset = dataset
+        self._canonical_edges = None
+
+    @property
+    def dataset(self):
+        if self._dataset is None:
+            # data_utils imports this module
+            import data_utils
+            self._dataset = data_utils.load_dataset(self.dataset_name, root=self.root)
+        return self._dataset
+
+    @property
+    def canonical_edges(self):
+        if self._canonical_edges is None:
+            self._canonical_edges = canonical_edges.dataset_canonical_edges(self.dataset)
+        return self._canonical_edges
+
+    def __len__(self):
+        return self.num_graphs
+
+    def __getitem__(self, idx):
+        """ Explanation idx, or list of explanations of a slice or an index array"""
+        if isinstance(idx, slice):
+            return [self.get(i) for i in range(*idx.indices(self.num_graphs))]
+        if isinstance(idx, (int, np.integer)) or (torch.is_tensor(idx) and idx.dim() == 0):
+            return self.get(int(idx))
+        return [self.get(int(i)) for i in idx]
+
+    def __iter__(self):
+        for idx in range(self.num_graphs):
+            yield self.get(idx)
+
+    def slice(self, key, idx):
+        return torch.from_numpy(self.arrays[key][self.ptrs[key][idx]:self.ptrs[key][idx + 1]])
+
+    def get(self, idx):
+        if idx < 0:
+            idx += self.num_graphs
+        if not 0 <= idx < self.num_graphs:
+            raise IndexError(f'Index {idx} is out of range for {self.num_graphs} explanations.')
+        graph = self.dataset[int(self.graph_indices[idx])]
+        edge_weight = self.slice('edge_weight', idx)
+        if edge_weight.shape[0] != graph.edge_index.shape[1]:
+            raise ValueError(f'Explanation {idx} has {edge_weight.shape[0]} edge weights but graph '
+                             f'{self.graph_indices[idx]} of {self.dataset_name} has {graph.edge_index.shape[1]} edges.')
+        structure = self.canonical_edges[int(self.graph_indices[idx])]
+        return Data(edge_index=graph.edge_index, x=graph.x, y=graph.y, edge_weight=edge_weight,
+                    edge_rank=self.slice('edge_rank', idx), edge_rank_tie=self.slice('edge_rank_tie', idx),
+                    undirected_id=structure.undirected_id, reverse_edge=structure.reverse_edge)
+
+
+def load_explanations(path, device):
+    """
+    Loads explanations saved with save_edge_weights or in packed format from the folder of path if it exists,
+    otherwise from the pickled .pt file. Explanations of folders are memory-mapped on cpu and support store[i], index
+    arrays and iteration, they are only moved to device (as a list) when device is not cpu.
+    """
+    folder = store_folder(path)
+    if is_referenced(folder) or packed_storage.is_packed(folder):
+        store = ReferencedExplanations(folder) if is_referenced(folder) else packed_storage.PackedGraphs(folder)
+        if torch.device(device).type == 'cpu':
+            return store
+        return [graph.to(device) for graph in store]
+    return torch.load(path, map_location=device)
+
+
+def convert_explanations(path, remove_legacy=False):
+    """
+    Converts a pickled explanations_{...}.pt file into packed format.
+    :param path: explanations_{...}.pt path
+    :param remove_legacy: removes the .pt file after conversion
+    :return: number of converted explanations
+    """
+    count = save_explanations(torch.load(path, map_location='cpu'), path)
+    if remove_legacy:
+        os.remove(path)
+    return count
+
+
+if __name__ == '__main__':
+    # usage: python source/explanation_store.py [explanations_{...}.pt files...] [--remove]
+    # converts every data/*/*/explanations_*.pt file if no file is given.
+    remove = '--remove' in sys.argv
+    paths = [arg for arg in sys.argv[1:] if arg != '--remove'] or sorted(glob.glob('data/*/*/explanations_*.pt'))
+    for explanations_path in paths:
+        if packed_storage.is_packed(store_folder(explanations_path)) or is_referenced(store_folder(explanations_path)):
+            continue
+        try:
+            print(f'Converting {explanations_path}: {convert_explanations(explanations_path, remove_legacy=remove)} explanations')
+        except ValueError as e:
+            print(f'Skipping {explanations_path}: {e}')
@@ -6,6 +6,7 @@ import os
 import time
 
 import data_utils
+import loaders
 from tqdm import tqdm
 import torch.nn.functional as F
 from torch import nn, optim
@@ -234,21 +235,21 @@ if args.robustness == 'na':
         train_graphs,
         batch_size=1,
         shuffle=False,
-        num_workers=0,
+        **loaders.worker_options(loaders.num_loader_workers()),
     )
     val_graphs = GraphSampler(val_indices, distillations)
     val_dataset = torch.utils.data.DataLoader(
         val_graphs,
         batch_size=1,
         shuffle=False,
-        num_workers=0,
+        **loaders.worker_options(loaders.num_loader_workers()),
     )
     test_graphs = GraphSampler(test_indices, distillations)
     test_dataset = torch.utils.data.DataLoader(
         test_graphs,
         batch_size=1,
         shuffle=False,
-        num_workers=0,
+        **loaders.worker_options(loaders.num_loader_workers()),
     )
 
     model.train()
@@ -6,19 +6,26 @@ import time
 
 import torch.nn.functional as F
 from torch_geometric.nn import GCNConv, global_max_pool
-from torch_geometric.loader import DataLoader
 from wrappers.gin import GINConv
 from wrappers.gat import GATConvModified
 from wrappers.sage import SAGEConvModified
+from wrappers.categorical import CategoricalLinear
 from tqdm import tqdm
 
 import data_utils
 import metrics
+import artifact_cache
+import loaders
 
 
 class GNN(torch.nn.Module):
 
-    def __init__(self, num_features, num_classes=2, num_layers=3, dim=20, dropout=0.0, layer='gcn', pool='max'):
+    def __init__(self, num_features, num_classes=2, num_layers=3, dim=20, dropout=0.0, layer='gcn', pool='max', categorical=False):
+        """
+        :param categorical: node features are category ids of one-hot features with num_features categories, the first
+                            layer looks up the weights of the categories instead of multiplying the one-hot matrix. It
+                            has the same parameters as the dense model, so the state dicts of both are interchangeable.
+        """
         super(GNN, self).__init__()
 
         self.num_features = num_features
@@ -26,6 +33,7 @@ class GNN(torch.nn.Module):
         self.num_layers = num_layers
         self.dim = dim
         self.dropout = dropout
+        self.categorical = categorical
 
         self.convs = torch.nn.ModuleList()
         self.bns = torch.nn.ModuleList()
@@ -44,7 +52,15 @@ class GNN(torch.nn.Module):
             raise NotImplementedError(f'Layer: {layer} is not implemented!')
 
         # First GCN layer.
-        self.convs.append(self.layer(num_features, dim))
+        if not categorical:
+            self.convs.append(self.layer(num_features, dim))
+        elif layer == 'gcn':
+            conv = GCNConv(num_features, dim)
+            conv.lin = CategoricalLinear(num_features, dim, bias=False, weight_initializer='glorot')
+            conv.reset_parameters()
+            self.convs.append(conv)
+        else:
+            self.convs.append(self.layer(num_features, dim, categorical=True))
         self.bns.append(torch.nn.BatchNorm1d(dim))
 
         # Follow-up GCN layers.
@@ -64,7 +80,16 @@ class GNN(torch.nn.Module):
             elif isinstance(m, torch.nn.Linear):
                 m.reset_parameters()
 
-    def forward(self, data, edge_weight=None):
+    @property
+    def masks_by_edge_weight(self):
+        """ Whether a 0 edge weight is the same as removing the edge, it is not for attention and mean aggregation"""
+        return self.layer in [GCNConv, GINConv]
+
+    def forward(self, data, edge_weight=None, node_mask=None):
+        """
+        :param edge_weight: Tensor [num_edges], e.g. a 0/1 mask of a subgraph
+        :param node_mask: BoolTensor [num_nodes] of the nodes to pool, all nodes if None
+        """
 
         x = data.x.float()
         edge_index = data.edge_index
@@ -79,17 +104,50 @@ class GNN(torch.nn.Module):
 
         # Pooling and FCs.
         node_embeddings = x
+        pooled_embeddings, pooled_batch, num_graphs = node_embeddings, batch, None
+        if node_mask is not None:
+            # nodes outside the mask, e.g. isolated nodes of a masked subgraph, are not pooled
+            pooled_embeddings, pooled_batch = node_embeddings[node_mask], None if batch is None else batch[node_mask]
+            num_graphs = getattr(data, 'num_graphs', 1)
         if self.pool == 'max':
-            graph_embedding = global_max_pool(node_embeddings, batch)
+            graph_embedding = global_max_pool(pooled_embeddings, pooled_batch, size=num_graphs)
         else:
             raise NotImplementedError(f'Pooling: {self.pool} is not implemented!')
         out = self.fc(graph_embedding)
 
         return node_embeddings, graph_embedding, out
 
+def restore_gnn(checkpoint_path, num_features, num_classes, gnn_type, device, num_layers=3, dim=20, dropout=0.0, pool='max',
+                categorical=False):
+    """ GNN with the weights of a checkpoint, the defaults are the hyperparameters of GNNTrainer"""
+    model = GNN(
+        num_features=num_features,
+        num_classes=num_classes,
+        num_layers=num_layers,
+        dim=dim,
+        dropout=dropout,
+        layer=gnn_type,
+        pool=pool,
+        categorical=categorical,
+    ).to(device)
+    model.load_state_dict(torch.load(checkpoint_path, map_location=device))
+    return model
+
+
+def load_base_gnn(dataset, dataset_name, gnn_type, run, device, categorical=False):
+    """
+    Base GNN of run trained by GNNTrainer(task='basegnn'), restored without building a trainer: the already loaded
+    dataset is used and the log of the trainer is kept.
+    :param dataset: original dataset of dataset_name
+    :param device: torch device
+    """
+    checkpoint_path = f'data/{dataset_name}/basegnn/{gnn_type}-max/best_model_run_{run}.pt'
+    return restore_gnn(checkpoint_path, num_features=dataset.num_categories if categorical else dataset.num_features,
+                       num_classes=dataset.num_classes, gnn_type=gnn_type, device=device, categorical=categorical)
+
 
 class GNNTrainer:
-    def __init__(self, dataset_name, gnn_type, task, device, explainer_name=None, top_k=10):
+    def __init__(self, dataset_name, gnn_type, task, device, explainer_name=None, top_k=10, categorical=False):
 
         self.dataset_name = dataset_name
         self.gnn_type = gnn_type
@@ -98,6 +156,7 @@ class GNNTrainer:
         self.device = torch.device(self.device_name)
         self.explainer_name = explainer_name
         self.top_k = top_k
+        self.categorical = categorical
 
         self.num_layers = 3
         self.dim = 20
@@ -113,7 +172,7 @@ class GNNTrainer:
 
         # Load and split the datasets based on the task
         if self.task == 'basegnn':
-            self.dataset = data_utils.load_dataset(self.dataset_name)
+            self.dataset = data_utils.load_dataset(self.dataset_name, categorical=self.categorical)
         elif self.task == 'reproducibility':
             assert self.explainer_name is not None
             if self.explainer_name == 'subgraphx':  # only for subgraphx because of time constraints
@@ -147,48 +206,39 @@ class GNNTrainer:
         self.method = 'classification'
 
     def load(self, run):
-        self.model = GNN(
-            num_features=self.dataset.num_features,
-            num_classes=self.dataset.num_classes,
-            num_layers=self.num_layers,
-            dim=self.dim,
-            dropout=self.dropout,
-            layer=self.gnn_type,
-            pool=self.pool,
-        ).to(self.device)
-        self.model.load_state_dict(torch.load(os.path.join(self.gnn_folder, f'best_model_run_{run}.pt'), map_location=self.device))
+        self.model = restore_gnn(os.path.join(self.gnn_folder, f'best_model_run_{run}.pt'),
+                                 num_features=self.dataset.num_categories if self.categorical else self.dataset.num_features,
+                                 num_classes=self.dataset.num_classes, gnn_type=self.gnn_type, device=self.device,
+                                 num_layers=self.num_layers, dim=self.dim, dropout=self.dropout, pool=self.pool,
+                                 categorical=self.categorical)
         return self.model
 
     @torch.no_grad()
     def load_gnn_outputs(self, run):
-        node_embeddings_path = os.path.join(self.gnn_folder, f'node_embeddings_run_{run}.pt')
-        graph_embeddings_path = os.path.join(self.gnn_folder, f'graph_embeddings_run_{run}.pt')
-        outs_path = os.path.join(self.gnn_folder, f'outs_run_{run}.pt')
-
-        if os.path.exists(node_embeddings_path) and os.path.exists(graph_embeddings_path) and os.path.exists(outs_path):
-            node_embeddings = torch.load(node_embeddings_path, map_location=self.device)
-            graph_embeddings = torch.load(graph_embeddings_path, map_location=self.device)
-            outs = torch.load(outs_path, map_location=self.device)
-            return node_embeddings, graph_embeddings, outs
-        else:
+        """
+        Node embeddings, graph embeddings and outputs of the model of run on every graph, cached under a key of the
+        dataset and checkpoint contents, see artifact_cache.
+        """
+        checkpoint_path = os.path.join(self.gnn_folder, f'best_model_run_{run}.pt')
+        key = artifact_cache.model_outputs_key(self.dataset, checkpoint_path, name=self.gnn_folder)
+
+        def compute():
             self.model = self.load(run)
             self.model.eval()
-            loader = DataLoader(self.dataset, batch_size=self.batch_size, shuffle=False)
+            loader = loaders.data_loader(self.dataset, self.batch_size, shuffle=False)
             graph_embeddings, node_embeddings, outs = [], [], []
             for batch in tqdm(loader):
                 node_emb, graph_emb, out = self.model(batch.to(self.device))
-                max_batch_number = max(batch.batch)
-                for i in range(max_batch_number + 1):
-                    idx = torch.where(batch.batch == i)[0]
-                    node_embeddings.append(node_emb[idx])
-                graph_embeddings.append(graph_emb)
-                outs.append(out)
-            graph_embeddings = torch.cat(graph_embeddings)
-            outs = torch.cat(outs)
-            torch.save([node_embedding for node_embedding in node_embeddings], node_embeddings_path)
-            torch.save(graph_embeddings, graph_embeddings_path)
-            torch.save(outs, outs_path)
-            return node_embeddings, graph_embeddings, outs
+                node_embeddings.append(node_emb.cpu())
+                graph_embeddings.append(graph_emb.cpu())
+                outs.append(out.cpu())
+            # node embeddings of all graphs are stored in one tensor, batches keep the nodes of a graph contiguous
+            num_nodes = artifact_cache.graph_sizes(self.dataset)[0].tolist()
+            return torch.cat(node_embeddings), num_nodes, torch.cat(graph_embeddings), torch.cat(outs)
+
+        node_embeddings, num_nodes, graph_embeddings, outs = artifact_cache.cached('gnn_outputs', key, compute)
+        node_embeddings = list(torch.split(node_embeddings.to(self.device), num_nodes))
+        return node_embeddings, graph_embeddings.to(self.device), outs.to(self.device)
 
     def run(self, runs):
         train_scores = {'accuracy_or_mae': [], 'auc_or_r2': [], 'ap_or_mse': []}
@@ -227,13 +277,14 @@ class GNNTrainer:
         torch.cuda.manual_seed(run)
         np.random.seed(run)
 
-        self.train_loader = DataLoader(self.train_set, batch_size=self.batch_size, shuffle=True, num_workers=0)
-        self.valid_loader = DataLoader(self.valid_set, batch_size=self.batch_size, shuffle=True, num_workers=0)
-        self.test_loader = DataLoader(self.test_set, batch_size=self.batch_size, shuffle=True, num_workers=0)
+        pin_memory = self.device.type == 'cuda'
+        self.train_loader = loaders.data_loader(self.train_set, self.batch_size, shuffle=True, pin_memory=pin_memory)
+        self.valid_loader = loaders.data_loader(self.valid_set, self.batch_size, shuffle=True, pin_memory=pin_memory)
+        self.test_loader = loaders.data_loader(self.test_set, self.batch_size, shuffle=True, pin_memory=pin_memory)
 
         # Initialize the model.
-        num_features = self.dataset[0].x.shape[1]
-        num_classes = len(torch.unique(torch.tensor([self.dataset[i].y for i in range(len(self.dataset))])))
+        num_features = self.dataset.num_categories if self.categorical else self.dataset[0].x.shape[1]
+        num_classes = artifact_cache.num_classes(self.dataset)
 
         self.model = GNN(
             num_features=num_features,
@@ -243,6 +294,7 @@ class GNNTrainer:
             dropout=self.dropout,
             layer=self.gnn_type,
             pool=self.pool,
+            categorical=self.categorical,
         ).to(self.device)
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.lr)
 
@@ -8,8 +8,8 @@ import os
 from tqdm import tqdm
 
 import data_utils
+import explanation_store
 from gnn_trainer import GNNTrainer
-from torch_geometric.data import Data
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--batch_size', type=int, default=128)
@@ -22,6 +22,8 @@ parser.add_argument('--explainer_run', type=int, default=1)
 parser.add_argument('--gnn_type', type=str, default='gcn', choices=['gcn', 'gat', 'gin', 'sage'])
 parser.add_argument('--epochs', type=int, default=100)
 parser.add_argument('--robustness', type=str, default='na', choices=['topology_random', 'topology_adversarial', 'feature', 'na'], help="na by default means we do not run for perturbed data")
+parser.add_argument('--lazy_variants', action='store_true', help='Perturbs the graphs of the robustness runs on access instead of loading the materialized noisy datasets, topology adversarial graphs are the vectorized flips.')
+parser.add_argument('--flip_mode', type=str, default='legacy', choices=['legacy', 'vectorized'], help='Topology adversarial datasets of the original flip loop or of the vectorized flips.')
 
 args = parser.parse_args()
 
@@ -32,6 +34,7 @@ if not os.path.exists(result_folder):
 
 device = torch.device(f'cuda:{args.device}' if torch.cuda.is_available() else 'cpu')
 dataset = data_utils.load_dataset(args.dataset)
+dataset_variants = data_utils.DatasetVariants(args.dataset, original_graphs=dataset, flip_mode=args.flip_mode, lazy=args.lazy_variants)
 splits, indices = data_utils.split_data(dataset)
 
 torch.manual_seed(args.explainer_run)
@@ -49,70 +52,42 @@ if args.robustness == 'na':
     data_indices = range(len(dataset))
     explanations = []
     for index in tqdm(data_indices):
-        graph = dataset[index]
         explainer = GNNExplainer(model, dataset, task='graph', device=device, epochs=args.epochs)
         explanation = explainer.explain(index)
-        explanation_graph = Data(
-            edge_index=graph.edge_index.clone(),
-            x=graph.x.clone(),
-            y=graph.y.clone(),
-            edge_weight=explanation.detach().clone()
-        )
-        explanations.append(explanation_graph)
-    torch.save(explanations, explanations_path)
+        explanations.append(explanation.detach().clone())
+    explanation_store.save_edge_weights(explanations, explanations_path, args.dataset, data_indices, dataset=dataset)
 elif args.robustness == 'topology_random':
     for noise in [1, 2, 3, 4, 5]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_noise_{noise}.pt')
         explanations = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_dataset_name(dataset_name=args.dataset, noise=noise))
+        noisy_dataset = dataset_variants.get('topology_random', noise)
         data_indices = range(len(dataset))
         for index in tqdm(data_indices):
-            noisy_graph = noisy_dataset[index]
             explainer = GNNExplainer(model, noisy_dataset, task='graph', device=device, epochs=args.epochs)
             explanation = explainer.explain(index)
-            explanation_graph = Data(
-                edge_index=noisy_graph.edge_index.clone(),
-                x=noisy_graph.x.clone(),
-                y=noisy_graph.y.clone(),
-                edge_weight=explanation.detach().clone()
-            )
-            explanations.append(explanation_graph)
-        torch.save(explanations, explanations_path)
+            explanations.append(explanation.detach().clone())
+        explanation_store.save_edge_weights(explanations, explanations_path, dataset_variants.name('topology_random', noise), data_indices, dataset=noisy_dataset)
 elif args.robustness == 'feature':
     for noise in [10, 20, 30, 40, 50]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_feature_noise_{noise}.pt')
         explanations = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_dataset_name(dataset_name=args.dataset, noise=noise))
+        noisy_dataset = dataset_variants.get('feature', noise)
         data_indices = range(len(dataset))
         for index in tqdm(data_indices):
-            noisy_graph = noisy_dataset[index]
             explainer = GNNExplainer(model, noisy_dataset, task='graph', device=device, epochs=args.epochs)
             explanation = explainer.explain(index)
-            explanation_graph = Data(
-                edge_index=noisy_graph.edge_index.clone(),
-                x=noisy_graph.x.clone(),
-                y=noisy_graph.y.clone(),
-                edge_weight=explanation.detach().clone()
-            )
-            explanations.append(explanation_graph)
-        torch.save(explanations, explanations_path)
+            explanations.append(explanation.detach().clone())
+        explanation_store.save_edge_weights(explanations, explanations_path, dataset_variants.name('feature', noise), data_indices, dataset=noisy_dataset)
 elif args.robustness == 'topology_adversarial':
     for flip_count in [1, 2, 3, 4, 5]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_topology_adversarial_{flip_count}.pt')
         explanations = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_topology_adversarial_attack_dataset_name(dataset_name=args.dataset, flip_count=flip_count))
+        noisy_dataset = dataset_variants.get('topology_adversarial', flip_count)
         data_indices = range(len(dataset))
         for index in tqdm(data_indices):
-            noisy_graph = noisy_dataset[index]
             explainer = GNNExplainer(model, noisy_dataset, task='graph', device=device, epochs=args.epochs)
             explanation = explainer.explain(index)
-            explanation_graph = Data(
-                edge_index=noisy_graph.edge_index.clone(),
-                x=noisy_graph.x.clone(),
-                y=noisy_graph.y.clone(),
-                edge_weight=explanation.detach().clone()
-            )
-            explanations.append(explanation_graph)
-        torch.save(explanations, explanations_path)
+            explanations.append(explanation.detach().clone())
+        explanation_store.save_edge_weights(explanations, explanations_path, dataset_variants.name('topology_adversarial', flip_count), data_indices, dataset=noisy_dataset)
 else:
     raise NotImplementedError()
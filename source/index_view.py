@@ -0,0 +1,72 @@
+# Lazy index views of datasets and explanation collections.
+#
+# A view holds its base collection and an index array. Indexing a view with a slice or an index array composes the
+# index arrays into a new view of the same base, elements are only read from the base when they are accessed, so
+# folds and subsets of packed datasets or explanation stores do not load or copy any graph.
+
+import numpy as np
+import torch
+
+
+def as_index_array(indices):
+    if torch.is_tensor(indices):
+        indices = indices.cpu().numpy()
+    indices = np.asarray(indices)
+    if indices.dtype == bool:
+        return np.flatnonzero(indices)
+    return indices.astype(np.int64, copy=False).reshape(-1)
+
+
+class IndexView(object):
+    """
+    Read-only view of base[indices]. Drop-in for torch.utils.data.Subset: it has dataset and indices attributes and
+    works with DataLoader, views of views index the base directly.
+    """
+
+    def __init__(self, dataset, indices=None):
+        """
+        :param dataset: any collection with __len__ and __getitem__ of an int: dataset, explanation store, list, view
+        :param indices: positions in dataset, all of them if None
+        """
+        if indices is None:
+            indices = np.arange(len(dataset))
+        indices = as_index_array(indices)
+        if isinstance(dataset, IndexView):
+            indices = dataset.indices[indices]
+            dataset = dataset.dataset
+        self.dataset = dataset
+        self.indices = indices
+
+    def __len__(self):
+        return self.indices.shape[0]
+
+    def __getitem__(self, idx):
+        """ Element idx, or a view of a slice or an index array"""
+        if isinstance(idx, (int, np.integer)) or (torch.is_tensor(idx) and idx.dim() == 0):
+            return self.dataset[int(self.indices[int(idx)])]
+        if isinstance(idx, slice):
+            return IndexView(self.dataset, self.indices[idx])
+        return IndexView(self.dataset, self.indices[as_index_array(idx)])
+
+    def __iter__(self):
+        for idx in self.indices:
+            yield self.dataset[int(idx)]
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)} of {len(self.dataset)})'
+
+
+def positions_of(indices, values):
+    """
+    Positions of values in indices, e.g. positions of dataset indices in a collection that only covers the test set.
+    :param indices: distinct indices
+    :param values: indices to look up, each of them must be in indices
+    :return: np.array of positions
+    """
+    indices, values = as_index_array(indices), as_index_array(values)
+    order = np.argsort(indices, kind='stable')
+    found = np.searchsorted(indices, values, sorter=order)
+    positions = order[np.minimum(found, len(order) - 1)]
+    if np.any(indices[positions] != values):
+        raise KeyError('Some values are not in indices.')
+    return positions
@@ -0,0 +1,178 @@
+# Per-graph scores of explanation metrics.
+#
+# Metrics emit one score per graph and metric parameter (the k of faithfulness, the noise budget of stability, ...)
+# into an InstanceStore, a dense [num_keys, num_graphs] matrix of (metric, parameter) keys by graph ids. Means,
+# standard deviations and bootstrap confidence intervals of folds or subsets are aggregations over the stored scores,
+# so no metric is computed again per fold or subset. Graphs without a score (invalid explanations, explanations without
+# a counterfactual) hold NaN and are left out of every aggregate.
+#
+# sequential_scores scores the graphs in a random stream of blocks instead of all of them, and stops once the
+# confidence intervals of the running means of all scores are narrow enough.
+
+from statistics import NormalDist
+
+import numpy as np
+import torch
+
+from index_view import as_index_array, positions_of
+
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 24
+# sequential_scores stops only after this many blocks and scores of every key, the normal interval of fewer scores is
+# unreliable, e.g. zero width when the first scores are equal
+SEQUENTIAL_MIN_BLOCKS = 2
+SEQUENTIAL_MIN_SCORES = 30
+
+
+class InstanceStore(object):
+    """
+    Scores of graphs by (metric, param) key, param is None for metrics without parameters.
+    """
+
+    def __init__(self, graph_ids, keys=None, scores=None):
+        """
+        :param graph_ids: ids of the scored graphs, e.g. their positions in the evaluated dataset
+        :param keys: list of (metric, param) keys of the rows of scores
+        :param scores: Tensor [len(keys), len(graph_ids)]
+        """
+        self.graph_ids = as_index_array(graph_ids)
+        self.keys = [] if keys is None else [tuple(key) for key in keys]
+        self.rows = {key: i for i, key in enumerate(self.keys)}
+        self.values = torch.zeros(0, self.graph_ids.shape[0], dtype=torch.double) if scores is None else scores.double()
+
+    def __len__(self):
+        return self.graph_ids.shape[0]
+
+    def add(self, metric, param, scores):
+        """
+        Sets the scores of a key.
+        :param scores: Tensor, array or list [len(self)], NaN for graphs without a score
+        """
+        if not torch.is_tensor(scores):
+            scores = torch.tensor(np.asarray(scores, dtype=np.float64))
+        scores = scores.detach().double().cpu()
+        assert scores.shape == (len(self),)
+        key = (metric, param)
+        if key in self.rows:
+            self.values[self.rows[key]] = scores
+        else:
+            self.rows[key] = len(self.keys)
+            self.keys.append(key)
+            self.values = torch.cat([self.values, scores.unsqueeze(0)])
+
+    def update(self, metric, param, graph_ids, scores):
+        """ Sets the scores of graph_ids for a key, the other graphs keep their scores, NaN for a new key"""
+        if (metric, param) not in self.rows:
+            self.add(metric, param, torch.full((len(self),), float('nan'), dtype=torch.double))
+        if not torch.is_tensor(scores):
+            scores = torch.tensor(np.asarray(scores, dtype=np.float64))
+        positions = torch.as_tensor(positions_of(self.graph_ids, graph_ids))
+        self.values[self.rows[(metric, param)], positions] = scores.detach().double().cpu()
+
+    def update_all(self, metric_names, param, graph_ids, scores):
+        """ Scores Tensor [len(metric_names), len(graph_ids)] of several metrics with the same param"""
+        for metric, metric_scores in zip(metric_names, scores):
+            self.update(metric, param, graph_ids, metric_scores)
+
+    def params(self, metric):
+        return [param for key_metric, param in self.keys if key_metric == metric]
+
+    def scores(self, metric, param=None, graph_ids=None):
+        """
+        :param graph_ids: ids of the graphs of a fold or subset, all graphs if None
+        :return: Tensor of the scores of graph_ids, NaN included
+        """
+        if (metric, param) not in self.rows:
+            raise KeyError(f'Instance store has no scores of {metric} with parameter {param}.')
+        row = self.values[self.rows[(metric, param)]]
+        if graph_ids is None:
+            return row
+        return row[torch.as_tensor(positions_of(self.graph_ids, graph_ids))]
+
+    def defined(self, metric, param=None, graph_ids=None):
+        """ Scores of graph_ids without NaN"""
+        scores = self.scores(metric, param, graph_ids)
+        return scores[~torch.isnan(scores)]
+
+    def count(self, metric, param=None, graph_ids=None):
+        return self.defined(metric, param, graph_ids).shape[0]
+
+    def mean(self, metric, param=None, graph_ids=None):
+        """ Mean over the graphs with a score, NaN if there is none"""
+        scores = self.defined(metric, param, graph_ids)
+        return scores.mean().item() if scores.shape[0] > 0 else float('nan')
+
+    def std(self, metric, param=None, graph_ids=None):
+        """ Population standard deviation over the graphs with a score, as np.nanstd"""
+        scores = self.defined(metric, param, graph_ids)
+        return scores.std(unbiased=False).item() if scores.shape[0] > 0 else float('nan')
+
+    def bootstrap_ci(self, metric, param=None, graph_ids=None, confidence=0.95, num_resamples=BOOTSTRAP_RESAMPLES, seed=0):
+        """
+        Percentile bootstrap confidence interval of the mean over the graphs with a score.
+        :return: low, high
+        """
+        scores = self.defined(metric, param, graph_ids)
+        if scores.shape[0] == 0:
+            return float('nan'), float('nan')
+        generator = torch.Generator().manual_seed(seed)
+        chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // scores.shape[0])
+        means = []
+        for start in range(0, num_resamples, chunk):
+            resamples = torch.randint(scores.shape[0], (min(chunk, num_resamples - start), scores.shape[0]), generator=generator)
+            means.append(scores[resamples].mean(dim=1))
+        alpha = (1 - confidence) / 2
+        low, high = torch.quantile(torch.cat(means), torch.tensor([alpha, 1 - alpha], dtype=torch.double))
+        return low.item(), high.item()
+
+    def summary(self, metric, param=None, graph_ids=None, confidence=0.95):
+        """ dict of mean, std, ci (low, high) and count of the graphs with a score"""
+        return {'mean': self.mean(metric, param, graph_ids), 'std': self.std(metric, param, graph_ids),
+                'ci': self.bootstrap_ci(metric, param, graph_ids, confidence), 'count': self.count(metric, param, graph_ids)}
+
+    def save(self, path):
+        torch.save({'graph_ids': torch.as_tensor(self.graph_ids), 'keys': self.keys, 'scores': self.values}, path)
+
+    @classmethod
+    def load(cls, path):
+        stored = torch.load(path, map_location='cpu')
+        return cls(stored['graph_ids'], stored['keys'], stored['scores'])
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self.keys)} keys of {len(self)} graphs)'
+
+
+def sequential_scores(score, stores, keys, tolerance, confidence=0.95, block_size=256, seed=0):
+    """
+    Scores the graphs of stores in random order, block_size graphs at a time, until the normal confidence interval of
+    the running mean of every key of every store has a half-width below tolerance or all graphs are scored. The stream
+    does not stop before SEQUENTIAL_MIN_BLOCKS blocks and SEQUENTIAL_MIN_SCORES scores of every key of every store, keys
+    that rarely have a score (e.g. necessity when nothing is left after removal) can consume all graphs.
+    :param score: function of an array of graph ids storing their scores of every key in stores
+    :param stores: list of InstanceStores of the same graphs, e.g. scores of several models
+    :param keys: list of (metric, param) keys that must reach the tolerance in every store
+    :return: ids of the consumed graphs np.array, list of dicts of key to mean, ci (low, high), half_width and count,
+             one per store
+    """
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    order = stores[0].graph_ids[np.random.default_rng(seed).permutation(len(stores[0]))]
+    # running count, sum and sum of squares of the scores of every key
+    moments = [{key: torch.zeros(3, dtype=torch.double) for key in keys} for _ in stores]
+    estimates = [{} for _ in stores]
+    end, blocks = 0, 0
+    while end < len(order):
+        block, end = order[end:end + block_size], min(end + block_size, len(order))
+        score(block)
+        blocks += 1
+        for store, store_moments, store_estimates in zip(stores, moments, estimates):
+            for key in keys:
+                scores = store.defined(key[0], key[1], block)
+                store_moments[key] += torch.stack([torch.tensor(float(scores.shape[0]), dtype=torch.double), scores.sum(), (scores ** 2).sum()])
+                count, total, squares = store_moments[key].tolist()
+                mean = total / count if count > 0 else float('nan')
+                half_width = z * np.sqrt(max(squares - count * mean ** 2, 0) / (count - 1) / count) if count > 1 else float('inf')
+                store_estimates[key] = {'mean': mean, 'ci': (mean - half_width, mean + half_width), 'half_width': half_width, 'count': int(count)}
+        if blocks >= SEQUENTIAL_MIN_BLOCKS and all(estimate['count'] >= SEQUENTIAL_MIN_SCORES and estimate['half_width'] < tolerance
+                                                   for store_estimates in estimates for estimate in store_estimates.values()):
+            break
+    return order[:end], estimates
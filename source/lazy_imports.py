@@ -0,0 +1,48 @@
+# Registry of the heavy dependencies that only some datasets and metrics need.
+#
+# Each entry is a proxy of a module that is imported on first attribute access, e.g. ogb is only imported when
+# ogbg-molhiv is loaded and torchmetrics when a classification or regression metric is computed. Modules using them
+# import the proxy instead of the module, so importing data_utils or metrics, which every entry point does, does not
+# pay for dependencies the run never selects. See startup_benchmark.py for the startup time of the entry points.
+
+import sys
+import importlib
+
+
+class LazyModule(object):
+    """ Proxy of a module, the module is imported on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.is_loaded() else 'not loaded'
+        return f'<lazy module {self._name} ({state})>'
+
+    def is_loaded(self):
+        return self._name in sys.modules
+
+
+ogb_graphproppred = LazyModule('ogb.graphproppred')
+torchmetrics_functional = LazyModule('torchmetrics.functional')
+networkx = LazyModule('networkx')
+
+REGISTRY = {
+    'ogb.graphproppred': ogb_graphproppred,
+    'torchmetrics.functional': torchmetrics_functional,
+    'networkx': networkx,
+}
+
+
+def loaded_modules():
+    """ Names of the registered modules imported in this process"""
+    return [name for name, module in REGISTRY.items() if module.is_loaded()]
@@ -0,0 +1,111 @@
+# Data loaders of datasets and their index views.
+#
+# Loaders read and collate batches in background worker processes that are kept alive between epochs and prefetch
+# batches while the model computes, finished batches reach the main process through shared memory. Shuffled loaders
+# of sharded datasets (see data_utils.ShardedDataset) stream them: shards are visited in random order, a few at a
+# time, and graphs are shuffled within those shards, so every worker only maps the shards it is reading.
+# The number of workers is 0 for in-memory datasets unless the GNNX_NUM_WORKERS environment variable sets it.
+
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+from torch_geometric.loader import DataLoader
+
+import packed_storage
+from index_view import IndexView
+
+NUM_WORKERS_ENV = 'GNNX_NUM_WORKERS'
+STREAM_WORKERS = 4
+PREFETCH_BATCHES = 4
+WINDOW_SHARDS = 4
+
+
+def sharded_reader(dataset):
+    """ ShardedGraphs of a sharded dataset or of the base of an index view of one, None for other datasets"""
+    base = dataset.dataset if isinstance(dataset, IndexView) else dataset
+    reader = getattr(base, 'packed_graphs', None)
+    return reader if isinstance(reader, packed_storage.ShardedGraphs) else None
+
+
+def num_loader_workers(dataset=None, num_workers=None):
+    """
+    :param num_workers: None reads GNNX_NUM_WORKERS, if it is not set sharded datasets get STREAM_WORKERS workers and
+                        other datasets none
+    """
+    if num_workers is not None:
+        return num_workers
+    if os.environ.get(NUM_WORKERS_ENV, ''):
+        return int(os.environ[NUM_WORKERS_ENV])
+    if dataset is not None and sharded_reader(dataset) is not None:
+        return max(0, min(STREAM_WORKERS, (os.cpu_count() or 1) - 1))
+    return 0
+
+
+def worker_options(num_workers, pin_memory=False):
+    """ DataLoader keyword arguments of num_workers persistent, prefetching workers"""
+    if num_workers == 0:
+        return {'num_workers': 0, 'pin_memory': pin_memory}
+    return {'num_workers': num_workers, 'persistent_workers': True, 'prefetch_factor': PREFETCH_BATCHES,
+            'pin_memory': pin_memory}
+
+
+class ShardStream(IterableDataset):
+    """
+    Shuffled stream of a sharded dataset or an index view of one. Every epoch visits the shards in a new random order,
+    WINDOW_SHARDS shards at a time, and shuffles the graphs of each window. Batch i of the epoch is read by worker
+    i % num_workers, so the loader returns the batches in epoch order.
+    """
+
+    def __init__(self, dataset, batch_size, seed=None, window_shards=WINDOW_SHARDS):
+        """
+        :param dataset: ShardedDataset or IndexView of one
+        :param seed: seed of the shuffling, drawn from the torch generator if None
+        """
+        if isinstance(dataset, IndexView):
+            self.base, self.indices = dataset.dataset, dataset.indices
+        else:
+            self.base, self.indices = dataset, np.arange(len(dataset))
+        reader = sharded_reader(dataset)
+        self.num_shards = reader.num_shards
+        self.shards = reader.shard_of(self.indices)
+        self.batch_size = batch_size
+        self.seed = int(torch.randint(2 ** 31, ())) if seed is None else seed
+        self.window_shards = window_shards
+        self.epoch = 0
+
+    def __len__(self):
+        return self.indices.shape[0]
+
+    def order(self, epoch):
+        """ Indices of the graphs of epoch in reading order"""
+        rng = np.random.default_rng([self.seed, epoch])
+        shard_rank = np.empty(self.num_shards, dtype=np.int64)
+        shard_rank[rng.permutation(self.num_shards)] = np.arange(self.num_shards)
+        window = shard_rank[self.shards] // self.window_shards
+        positions = rng.permutation(self.indices.shape[0])
+        positions = positions[np.argsort(window[positions], kind='stable')]
+        return self.indices[positions]
+
+    def __iter__(self):
+        # every worker holds its own copy of the stream, the copies count the same epochs
+        order = self.order(self.epoch)
+        self.epoch += 1
+        worker = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+        for start in range(worker_id * self.batch_size, order.shape[0], num_workers * self.batch_size):
+            for idx in order[start:start + self.batch_size]:
+                yield self.base[int(idx)]
+
+
+def data_loader(dataset, batch_size, shuffle=False, num_workers=None, pin_memory=False):
+    """
+    PyTorch Geometric DataLoader of dataset, shuffled loaders of sharded datasets stream them, see ShardStream.
+    :param num_workers: number of background workers, see num_loader_workers
+    :param pin_memory: batches are copied into pinned memory for faster transfers to the gpu
+    """
+    options = worker_options(num_loader_workers(dataset, num_workers), pin_memory)
+    if shuffle and sharded_reader(dataset) is not None:
+        return DataLoader(ShardStream(dataset, batch_size), batch_size=batch_size, **options)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **options)
@@ -5,7 +5,7 @@ from scipy.special import comb
 from itertools import combinations
 import torch.nn.functional as F
 from torch_geometric.utils import to_networkx
-from torch_geometric.data import Data, Batch, Dataset, DataLoader
+from torch_geometric.data import Data, Batch
 
 
 def GnnNetsGC2valueFunc(gnnNets, target_class):
@@ -42,38 +42,17 @@ def get_graph_build_func(build_method):
         raise NotImplementedError
 
 
-class MarginalSubgraphDataset(Dataset):
-    def __init__(self, data, exclude_mask, include_mask, subgraph_build_func):
-        self.num_nodes = data.num_nodes
-        self.X = data.x
-        self.edge_index = data.edge_index
-        self.device = self.X.device
-
-        self.label = data.y
-        self.exclude_mask = torch.tensor(exclude_mask).type(torch.float32).to(self.device)
-        self.include_mask = torch.tensor(include_mask).type(torch.float32).to(self.device)
-        self.subgraph_build_func = subgraph_build_func
-
-    def __len__(self):
-        return self.exclude_mask.shape[0]
-
-    def __getitem__(self, idx):
-        exclude_graph_X, exclude_graph_edge_index = self.subgraph_build_func(self.X, self.edge_index, self.exclude_mask[idx])
-        include_graph_X, include_graph_edge_index = self.subgraph_build_func(self.X, self.edge_index, self.include_mask[idx])
-        exclude_data = Data(x=exclude_graph_X, edge_index=exclude_graph_edge_index)
-        include_data = Data(x=include_graph_X, edge_index=include_graph_edge_index)
-        return exclude_data, include_data
-
-
 def marginal_contribution(data: Data, exclude_mask: np.array, include_mask: np.array,
-                          value_func, subgraph_build_func):
+                          value_func, subgraph_build_func, batch_size=256):
     """ Calculate the marginal value for each pair. Here exclude_mask and include_mask are node mask. """
-    marginal_subgraph_dataset = MarginalSubgraphDataset(data, exclude_mask, include_mask, subgraph_build_func)
-    dataloader = DataLoader(marginal_subgraph_dataset, batch_size=256, shuffle=False, num_workers=0)
+    exclude_mask = torch.tensor(exclude_mask, dtype=torch.float32, device=data.x.device)
+    include_mask = torch.tensor(include_mask, dtype=torch.float32, device=data.x.device)
 
     marginal_contribution_list = []
 
-    for exclude_data, include_data in dataloader:
+    for start in range(0, exclude_mask.shape[0], batch_size):
+        exclude_data = mask_batch(data, exclude_mask[start:start + batch_size], subgraph_build_func)
+        include_data = mask_batch(data, include_mask[start:start + batch_size], subgraph_build_func)
         exclude_values = value_func(exclude_data)
         include_values = value_func(include_data)
         margin_values = include_values - exclude_values
@@ -83,6 +62,29 @@ def marginal_contribution(data: Data, exclude_mask: np.array, include_mask: np.a
     return marginal_contributions
 
 
+def mask_batch(data: Data, node_masks: torch.Tensor, subgraph_build_func):
+    """
+    Batch of the subgraphs subgraph_build_func builds from data for every node mask. The subgraphs of the build
+    functions of this module are built for all masks at once, the same batch as collating them one by one.
+    :param node_masks: float tensor [num_masks, num_nodes]
+    """
+    num_masks, num_nodes = node_masks.shape
+    if subgraph_build_func not in [graph_build_zero_filling, graph_build_split]:
+        return Batch.from_data_list([Data(*subgraph_build_func(data.x, data.edge_index, mask)) for mask in node_masks])
+
+    offsets = torch.arange(num_masks + 1, device=node_masks.device) * num_nodes
+    edge_index = data.edge_index.unsqueeze(1) + offsets[:-1].view(1, -1, 1)
+    if subgraph_build_func is graph_build_zero_filling:
+        x = data.x.unsqueeze(0) * node_masks.unsqueeze(2)
+        edge_index = edge_index.reshape(2, -1)
+    else:
+        x = data.x.unsqueeze(0).expand(num_masks, -1, -1)
+        row, col = data.edge_index
+        edge_index = edge_index[:, (node_masks[:, row] == 1) & (node_masks[:, col] == 1)]
+    batch = torch.arange(num_masks, device=node_masks.device).repeat_interleave(num_nodes)
+    return Batch(x=x.reshape(num_masks * num_nodes, -1), edge_index=edge_index, batch=batch, ptr=offsets)
+
+
 def graph_build_zero_filling(X, edge_index, node_mask: np.array):
     """ subgraph building through masking the unselected nodes with zero features """
     ret_X = X * node_mask.unsqueeze(1)
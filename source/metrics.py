@@ -1,40 +1,42 @@
-from torchmetrics.functional import accuracy as torch_accuracy
-from torchmetrics.functional import auroc as torch_auc
-from torchmetrics.functional import average_precision as torch_ap
-from torchmetrics.functional import r2_score as torch_r2_score
-from torchmetrics.functional import mean_absolute_error as torch_mae
-from torchmetrics.functional import mean_squared_error as torch_mse
+import copy
 
 import torch
 import numpy as np
 from tqdm import tqdm
 
-from torch_geometric.data import Data
-from torch_geometric.transforms import RemoveIsolatedNodes, ToUndirected
+from torch_geometric.data import Data, Batch
+from torch_geometric.transforms import RemoveIsolatedNodes
+
+import edge_ranking
+import canonical_edges
+from lazy_imports import torchmetrics_functional
+
+# number of graphs collated into one forward of the faithfulness metrics
+FAITHFULNESS_BATCH_SIZE = 128
 
 
 def auc(ground, pred):
-    return torch_auc(pred, ground, num_classes=pred.shape[1]).item()
+    return torchmetrics_functional.auroc(pred, ground, num_classes=pred.shape[1]).item()
 
 
 def ap(ground, pred):
-    return torch_ap(pred, ground, num_classes=pred.shape[1]).item()
+    return torchmetrics_functional.average_precision(pred, ground, num_classes=pred.shape[1]).item()
 
 
 def accuracy(ground, pred):
-    return torch_accuracy(pred, ground, num_classes=pred.shape[1]).item()
+    return torchmetrics_functional.accuracy(pred, ground, num_classes=pred.shape[1]).item()
 
 
 def r_squared(ground, pred):
-    return torch_r2_score(pred, ground).item()
+    return torchmetrics_functional.r2_score(pred, ground).item()
 
 
 def mse(ground, pred):
-    return torch_mse(pred, ground).item()
+    return torchmetrics_functional.mean_squared_error(pred, ground).item()
 
 
 def mae(ground, pred):
-    return torch_mae(pred, ground).item()
+    return torchmetrics_functional.mean_absolute_error(pred, ground).item()
 
 
 def prediction_similarity(original_predictions, explanation_predictions, metric='correlation'):
@@ -57,7 +59,176 @@ def prediction_similarity(original_predictions, explanation_predictions, metric=
         raise NotImplementedError
 
 
-def faithfulness(gnn_model, original_graphs, explanations, k, metric_names, device):
+def prediction_agreement(original_predictions, explanation_predictions, metric):
+    """
+    Per graph prediction_similarity: 1 where the predicted classes agree (sufficiency) or differ (necessity), else 0.
+    :return: Tensor [num_graphs]
+    """
+    same = original_predictions.argmax(axis=1) == explanation_predictions.argmax(axis=1)
+    if metric == 'sufficiency':
+        return same.float()
+    elif metric == 'necessity':
+        return (~same).float()
+    else:
+        raise NotImplementedError
+
+
+@torch.no_grad()
+def model_outputs(gnn_model, graphs, device, batch_size=FAITHFULNESS_BATCH_SIZE):
+    """
+    Outputs of gnn_model on graphs, batch_size graphs per forward. They only depend on the model and the graphs, so
+    they are computed once and passed as original_outputs to every faithfulness call of a sweep over k.
+    :return: Tensor [len(graphs), num_classes]
+    """
+    return models_outputs([gnn_model], graphs, device, batch_size=batch_size)[0]
+
+
+@torch.no_grad()
+def models_outputs(gnn_models, graphs, device, batch_size=FAITHFULNESS_BATCH_SIZE):
+    """
+    model_outputs of several models, every batch of graphs is collated once and evaluated by all models.
+    :return: list of Tensor [len(graphs), num_classes], one per model
+    """
+    outs = [[] for _ in gnn_models]
+    for start in range(0, len(graphs), batch_size):
+        batch = Batch.from_data_list([graphs[i] for i in range(start, min(start + batch_size, len(graphs)))]).to(device)
+        for model_outs, gnn_model in zip(outs, gnn_models):
+            model_outs.append(gnn_model(batch)[-1])
+    return [torch.cat(model_outs) for model_outs in outs]
+
+
+def explanation_subgraph(explanation, positions):
+    """
+    Subgraph of both directions of the canonical edges at positions of an explanation, without isolated nodes.
+    :return: PyTorch Geometric Data, None if no edge is selected
+    """
+    edge_index = canonical_edges.select_undirected(explanation, positions)[0]
+    if edge_index.shape[1] == 0:
+        return None
+    return RemoveIsolatedNodes()(Data(edge_index=edge_index, x=explanation.x))
+
+
+def masked_explanation(explanation, positions):
+    """
+    Explanation graph with the subgraph of explanation_subgraph as masks: edge_mask of both directions of the canonical
+    edges at positions and node_mask of their nodes. Nodes keep their ids and no edge is added, the subgraphs are the
+    same for graphs where every edge has its reverse edge.
+    :return: PyTorch Geometric Data, None if no edge is selected
+    """
+    edge_mask = canonical_edges.undirected_edge_mask(canonical_edges.edge_structure(explanation)[0], positions)
+    if not edge_mask.any():
+        return None
+    node_mask = torch.zeros(explanation.num_nodes, dtype=torch.bool)
+    node_mask[explanation.edge_index[:, edge_mask].flatten()] = True
+    return Data(x=explanation.x, edge_index=explanation.edge_index, edge_mask=edge_mask, node_mask=node_mask)
+
+
+def masked_forward(gnn_model, batch):
+    """
+    Outputs of gnn_model on a batch of masked explanations: masked edges get weight 0, or are dropped from the edge
+    index for layers where a 0 weight is not the same as a missing edge, and masked nodes are not pooled.
+    """
+    if getattr(gnn_model, 'masks_by_edge_weight', False):
+        return gnn_model(batch, edge_weight=batch.edge_mask.float(), node_mask=batch.node_mask)[-1]
+    # a shallow copy, the batch may be evaluated by other models
+    batch = copy.copy(batch)
+    batch.edge_index = batch.edge_index[:, batch.edge_mask]
+    return gnn_model(batch, node_mask=batch.node_mask)[-1]
+
+
+@torch.no_grad()
+def selection_outputs(gnn_model, explanations, select_positions, device, mode='subgraph', batch_size=FAITHFULNESS_BATCH_SIZE):
+    """
+    Outputs of gnn_model on the subgraphs of the canonical edges at select_positions(explanation) of explanations.
+    The subgraphs of batch_size explanations are collated into one batch and evaluated with one forward. Explanations
+    with invalid weights or without selected edges are skipped.
+    :param select_positions: function of an explanation returning positions of canonical edges in its edge_index
+    :param mode: subgraph builds every subgraph, see explanation_subgraph, mask keeps the topology of the explanations
+                 and masks the subgraph, see masked_explanation
+    :return: indices of the evaluated explanations LongTensor, outputs Tensor [len(indices), num_classes]
+    """
+    indices, outs = selection_outputs_models([gnn_model], explanations, select_positions, device, mode=mode, batch_size=batch_size)
+    return indices, outs[0]
+
+
+@torch.no_grad()
+def selection_outputs_models(gnn_models, explanations, select_positions, device, mode='subgraph', batch_size=FAITHFULNESS_BATCH_SIZE):
+    """
+    selection_outputs of several models, e.g. base GNNs of other architectures or seeds. Every batch of subgraphs is
+    built and collated once and evaluated by all models.
+    :return: indices of the evaluated explanations LongTensor, list of outputs Tensor [len(indices), num_classes], one
+             per model. Without evaluated explanations the outputs are empty Tensors without a class dimension.
+    """
+    if mode == 'subgraph':
+        build, forward = explanation_subgraph, lambda gnn_model, batch: gnn_model(batch)[-1]
+    elif mode == 'mask':
+        build, forward = masked_explanation, masked_forward
+    else:
+        raise NotImplementedError(f'Fidelity mode: {mode} is not implemented!')
+
+    def evaluate(graphs):
+        batch = Batch.from_data_list(graphs).to(device)
+        for model_outs, gnn_model in zip(outs, gnn_models):
+            model_outs.append(forward(gnn_model, batch))
+
+    indices, graphs, outs = [], [], [[] for _ in gnn_models]
+    for i in tqdm(range(len(explanations))):
+        explanation = explanations[i]
+        if not edge_ranking.has_valid_weights(explanation):
+            continue
+        graph = build(explanation, select_positions(explanation))
+        if graph is None:
+            continue
+        indices.append(i)
+        graphs.append(graph)
+        if len(graphs) == batch_size:
+            evaluate(graphs)
+            graphs = []
+    if len(graphs) > 0:
+        evaluate(graphs)
+    if len(indices) == 0:
+        return torch.zeros(0, dtype=torch.long), [torch.zeros(0) for _ in gnn_models]
+    return torch.tensor(indices, dtype=torch.long), [torch.cat(model_outs) for model_outs in outs]
+
+
+def faithfulness_per_graph(gnn_model, original_graphs, explanations, k, metric_names, device, original_outputs=None, mode='subgraph',
+                           select_positions=edge_ranking.top_k_positions):
+    """
+    Faithfulness of every explanation, see faithfulness.
+    :param select_positions: function of an explanation and k returning the positions of the evaluated canonical edges,
+                             by default the canonical edges with weight >= k-th largest weight, a prefix of the edge ranking
+    :return: Tensor [len(metric_names), len(explanations)], NaN for skipped explanations (invalid weights, no edges)
+    """
+    return faithfulness_per_graph_models([gnn_model], original_graphs, explanations, k, metric_names, device,
+                                         original_outputs=None if original_outputs is None else [original_outputs],
+                                         mode=mode, select_positions=select_positions)[0]
+
+
+def faithfulness_per_graph_models(gnn_models, original_graphs, explanations, k, metric_names, device, original_outputs=None,
+                                  mode='subgraph', select_positions=edge_ranking.top_k_positions):
+    """
+    faithfulness_per_graph of several models, the subgraphs are built once, see selection_outputs_models.
+    :param original_outputs: list of the outputs of every model on original_graphs, see models_outputs. Computed if None.
+    :return: Tensor [len(gnn_models), len(metric_names), len(explanations)]
+    """
+    assert len(explanations) == len(original_graphs)
+
+    if original_outputs is None:
+        original_outputs = models_outputs(gnn_models, original_graphs, device)
+    indices, explanations_outs = selection_outputs_models(
+        gnn_models, explanations, lambda explanation: select_positions(explanation, k), device, mode=mode)
+
+    faithfulness_scores = torch.full((len(gnn_models), len(metric_names), len(explanations)), float('nan'))
+    if indices.shape[0] == 0:
+        return faithfulness_scores
+    for m, (model_outputs_m, explanations_out) in enumerate(zip(original_outputs, explanations_outs)):
+        original_graphs_out = model_outputs_m[indices.to(model_outputs_m.device)]
+        for i, metric in enumerate(metric_names):
+            faithfulness_scores[m, i, indices] = prediction_agreement(original_graphs_out, explanations_out, metric).cpu()
+    return faithfulness_scores
+
+
+def faithfulness(gnn_model, original_graphs, explanations, k, metric_names, device, original_outputs=None, mode='subgraph'):
     """
     Calculates the faithfulness of explanations on gnn model, under continuous explanations.
     :param gnn_model: PyTorch Geometric GNN model
@@ -66,43 +237,13 @@ def faithfulness(gnn_model, original_graphs, explanations, k, metric_names, devi
     :param k: selecting top k edges as explanations
     :param metric_names: list of metrics that will be checked
     :param device: device to run the model
+    :param original_outputs: outputs of gnn_model on original_graphs, see model_outputs. Computed if None.
+    :param mode: subgraph or mask evaluation of the explanations, see selection_outputs
     :return: faithfulness degree of explanations on gnn model
     """
-
-    assert len(explanations) == len(original_graphs)
-
-    explanations_out, original_graphs_out = [], []
-
-    for i in tqdm(range(len(explanations))):
-        if explanations[i].edge_index.shape[1] > 0 and not explanations[i].edge_weight.sum().isnan().item():
-            directed_edge_weight = explanations[i].edge_weight[explanations[i].edge_index[0] <= explanations[i].edge_index[1]]
-            directed_edge_index = explanations[i].edge_index[:, explanations[i].edge_index[0] <= explanations[i].edge_index[1]]
-            threshold = directed_edge_weight.topk(min(k, directed_edge_weight.shape[0]))[0][-1]
-            idx = directed_edge_weight >= threshold
-            directed_edge_index = directed_edge_index[:, idx]
-
-            new_data = Data(
-                edge_index=directed_edge_index.clone(),
-                x=explanations[i].x.clone(),
-            )
-            # remove isolated nodes
-            new_data = ToUndirected()(new_data)
-            new_data = RemoveIsolatedNodes()(new_data)
-
-            with torch.no_grad():
-                _, _, explanations_out_i = gnn_model(new_data.to(device))
-                _, _, original_graphs_out_i = gnn_model(original_graphs[i].to(device))
-
-            explanations_out.append(explanations_out_i)
-            original_graphs_out.append(original_graphs_out_i)
-    explanations_out = torch.vstack(explanations_out)
-    original_graphs_out = torch.vstack(original_graphs_out)
-
-    faithfulness_scores = []
-    for metric in metric_names:
-        faithfulness_scores.append(prediction_similarity(original_graphs_out, explanations_out, metric))
-
-    return faithfulness_scores
+    faithfulness_scores = faithfulness_per_graph(gnn_model, original_graphs, explanations, k, metric_names, device,
+                                                 original_outputs=original_outputs, mode=mode)
+    return torch.nanmean(faithfulness_scores, dim=1).tolist()
 
 
 def similarity_of_explanations(original_matrix_elements, noisy_matrix_elements, top_k=10, metric='jaccard'):
@@ -110,7 +251,7 @@ def similarity_of_explanations(original_matrix_elements, noisy_matrix_elements,
     Calculate similarity between two explanations
     :param original_matrix_elements:
     :param noisy_matrix_elements:
-    :param top_k: top k edges that will be checked
+    :param top_k: top k edges that will be checked, ties are taken in order of position
     :param metric: jaccard
     :return: similarity score of two matrix from explanations
     """
@@ -120,8 +261,8 @@ def similarity_of_explanations(original_matrix_elements, noisy_matrix_elements,
         if metric == 'jaccard':
             # checks top_k edges that is available in original matrix and also in noisy matrix
             k = min(top_k, original_matrix_elements.shape[0])
-            idx1 = torch.topk(original_matrix_elements, min(len(noisy_matrix_elements), k))[1]
-            idx2 = torch.topk(noisy_matrix_elements, min(len(noisy_matrix_elements), k))[1]
+            idx1 = torch.sort(original_matrix_elements, descending=True, stable=True)[1][:min(len(noisy_matrix_elements), k)]
+            idx2 = torch.sort(noisy_matrix_elements, descending=True, stable=True)[1][:min(len(noisy_matrix_elements), k)]
             mask = torch.logical_not(torch.isin(idx1, idx2))
             diff = torch.masked_select(idx1, mask)
             score = 1 - len(diff) / k
@@ -130,6 +271,120 @@ def similarity_of_explanations(original_matrix_elements, noisy_matrix_elements,
             raise NotImplementedError
 
 
+def collate_canonical_edges(explanations):
+    """
+    Canonical (u <= v) edges of all explanations in edge order, concatenated, with the rank of every edge in its
+    explanation by decreasing weight, ties in edge order.
+    :return: dict of graph LongTensor [num_edges] explanation of every edge, edge_index LongTensor [2, num_edges],
+             edge_weight Tensor [num_edges], order LongTensor [num_edges] edges sorted by explanation and rank,
+             rank LongTensor [num_edges], num_edges LongTensor [len(explanations)],
+             valid BoolTensor [len(explanations)] explanations with valid weights
+    """
+    graphs, edge_indices, edge_weights, valid = [], [], [], []
+    for i in range(len(explanations)):
+        explanation = explanations[i]
+        edge_index = explanation.edge_index.detach().cpu()
+        canonical = edge_index[0] <= edge_index[1]
+        edge_indices.append(edge_index[:, canonical])
+        edge_weights.append(explanation.edge_weight.detach().cpu()[canonical].float())
+        graphs.append(torch.full((int(canonical.sum()),), i, dtype=torch.long))
+        valid.append(edge_ranking.has_valid_weights(explanation))
+    graph, edge_weight = torch.cat(graphs), torch.cat(edge_weights)
+    order = torch.sort(edge_weight, descending=True, stable=True)[1]
+    order = order[torch.sort(graph[order], stable=True)[1]]
+    rank = torch.empty_like(order)
+    rank[order] = segment_positions(graph)
+    return {'graph': graph, 'edge_index': torch.cat(edge_indices, dim=1), 'edge_weight': edge_weight, 'order': order,
+            'rank': rank, 'num_edges': torch.bincount(graph, minlength=len(valid)), 'valid': torch.tensor(valid, dtype=torch.bool)}
+
+
+def segment_cumcount(segment, mask):
+    """ Number of True elements of mask before every element in its segment, segment ids are sorted"""
+    counts = torch.cat([torch.zeros(1, dtype=torch.long), torch.cumsum(mask.long(), dim=0)])
+    return counts[:-1] - counts[torch.searchsorted(segment, segment)]
+
+
+def segment_positions(segment):
+    """ Position of every element in its segment, segment ids are sorted"""
+    return torch.arange(segment.shape[0]) - torch.searchsorted(segment, segment)
+
+
+def jaccard_scores(edges, other_edges, top_k):
+    """
+    Top-k overlap (see similarity_of_explanations) of every explanation of a collated set with the explanation of the
+    same graph in another one, for all graphs at once: edges are int64 keys graph * n^2 + u * n + v and the common
+    edges are found with one isin, top k edges come from the ranks of the collated sets.
+    :param edges: collate_canonical_edges of explanations
+    :param other_edges: collate_canonical_edges of the other explanations, of the same graphs
+    :return: Tensor [num_graphs], NaN for explanations with invalid weights
+    """
+    num_graphs = edges['valid'].shape[0]
+    nodes = torch.cat([edges['edge_index'], other_edges['edge_index']], dim=1)
+    n = int(nodes.max()) + 1 if nodes.numel() > 0 else 1
+
+    def keys(collated):
+        return (collated['graph'] * n + collated['edge_index'][0]) * n + collated['edge_index'][1]
+
+    # edges of the other explanation that are also in the explanation, their rank and position among these edges
+    graph, other_graph = edges['graph'], other_edges['graph']
+    common = torch.isin(keys(other_edges), keys(edges))
+    common_rank = torch.empty_like(other_edges['rank'])
+    common_rank[other_edges['order']] = segment_cumcount(other_graph, common[other_edges['order']])
+    common_position = segment_cumcount(other_graph, common)
+
+    num_common = torch.bincount(other_graph[common], minlength=num_graphs)
+    k = edges['num_edges'].clamp(max=top_k)
+    selected = torch.minimum(k, num_common)
+    top = edges['rank'] < selected[graph]
+    common_top = common & (common_rank < selected[other_graph])
+    # top positions of both lists are compared, as in similarity_of_explanations
+    size = int(torch.cat([edges['num_edges'], other_edges['num_edges'], torch.zeros(1, dtype=torch.long)]).max()) + 1
+    position_keys = graph[top] * size + segment_positions(graph)[top]
+    common_position_keys = other_graph[common_top] * size + common_position[common_top]
+    matched = torch.bincount(graph[top][torch.isin(position_keys, common_position_keys)], minlength=num_graphs)
+
+    scores = 1 - (selected - matched).double() / k.clamp(min=1)
+    weight_sum = torch.zeros(num_graphs).index_add_(0, graph, edges['edge_weight'])
+    common_weight_sum = torch.zeros(num_graphs).index_add_(0, other_graph[common], other_edges['edge_weight'][common])
+    scores[(num_common == 0) | (weight_sum == 0) | (common_weight_sum == 0)] = 0
+    scores[~edges['valid']] = float('nan')
+    return scores
+
+
+def stability_matrix(explanation_sets, top_k):
+    """
+    Top-k Jaccard similarity (see robustness) of every ordered pair of explanation sets of the same graphs, every set is
+    read and collated once, e.g. explanations of several seeds, base GNNs or explainers.
+    :param explanation_sets: list of N explanation collections
+    :param top_k: top k edges that will be checked
+    :return: Tensor [N, N, num_graphs], scores[i, j] compares explanations j to explanations i, NaN for invalid
+             explanations of set i
+    """
+    collated = [collate_canonical_edges(explanations) for explanations in explanation_sets]
+    scores = torch.empty(len(collated), len(collated), collated[0]['valid'].shape[0], dtype=torch.double)
+    for i in range(len(collated)):
+        for j in range(len(collated)):
+            scores[i, j] = jaccard_scores(collated[i], collated[j], top_k)
+    return scores
+
+
+def robustness_per_graph(explanations, explanations_under_noise, top_k, metric_names):
+    """
+    Robustness of every explanation, see robustness.
+    :return: Tensor [len(metric_names), len(explanations)], NaN for explanations with invalid weights
+    """
+    assert len(explanations) == len(explanations_under_noise)
+
+    edges, noisy_edges = collate_canonical_edges(explanations), collate_canonical_edges(explanations_under_noise)
+    scores = []
+    for metric_name in metric_names:
+        if metric_name == 'jaccard':
+            scores.append(jaccard_scores(edges, noisy_edges, top_k))
+        else:
+            raise NotImplementedError
+    return torch.stack(scores)
+
+
 def robustness(explanations, explanations_under_noise, top_k, metric_names):
     """
     Calculates the robustness of explanations under noise
@@ -139,52 +394,31 @@ def robustness(explanations, explanations_under_noise, top_k, metric_names):
     :param metric_names: list of metrics that will be checked
     :return:
     """
-    assert len(explanations) == len(explanations_under_noise)
+    return torch.nanmean(robustness_per_graph(explanations, explanations_under_noise, top_k, metric_names), dim=1).tolist()
 
-    scores = {metric_name: [] for metric_name in metric_names}
-    for i in tqdm(range(len(explanations))):
-        if explanations[i].edge_index.shape[1] > 0 and not explanations[i].edge_weight.sum().isnan().item():
-            edge_index = explanations[i].edge_index.t().detach().cpu()
-            edge_index_under_noise = explanations_under_noise[i].edge_index.t().detach().cpu()
-            edge_weight = explanations[i].edge_weight.detach().cpu()
-            edge_weight_under_noise = explanations_under_noise[i].edge_weight.detach().cpu()
-
-            idx = edge_index[:, 0] <= edge_index[:, 1]
-            idx_under_noise = edge_index_under_noise[:, 0] <= edge_index_under_noise[:, 1]
-
-            edge_index = edge_index[idx]
-            edge_index_under_noise = edge_index_under_noise[idx_under_noise]
-            edge_weight = edge_weight[idx]
-            edge_weight_under_noise = edge_weight_under_noise[idx_under_noise]
-
-            # Convert the edge indexes to sets for efficient comparison
-            set_edge_index_1 = set([tuple(edge.tolist()) for edge in edge_index])
-            set_edge_index_2 = set([tuple(edge.tolist()) for edge in edge_index_under_noise])
-
-            # Find the edges that exist in both edge_index_1 and edge_index_2
-            common_edges = [edge for edge in set_edge_index_1 if edge in set_edge_index_2]
-
-            # if explanation under noise and explanation do not have common edges, it is 0 score.
-            if len(common_edges) == 0:
-                for metric_name in metric_names:
-                    scores[metric_name].append(0)
-                continue
 
-            # Find the indices of common edges in edge_index_1
-            common_edge_indices = [torch.where((edge_index_under_noise == torch.tensor(edge)).sum(dim=1) == 2)[0] for edge in common_edges]
-            common_edge_indices = torch.cat(common_edge_indices, dim=0).sort()[0]
+def faithfulness_with_removal_per_graph(gnn_model, original_graphs, explanations, k, metric_names, device, original_outputs=None,
+                                        mode='subgraph'):
+    """
+    Faithfulness of every explanation after removing its top k edges, see faithfulness_with_removal.
+    :return: Tensor [len(metric_names), len(explanations)], NaN for skipped explanations (invalid weights, no edges left)
+    """
+    # canonical edges with weight < k-th largest weight, the rest of the edge ranking
+    return faithfulness_per_graph(gnn_model, original_graphs, explanations, k, metric_names, device,
+                                  original_outputs=original_outputs, mode=mode, select_positions=edge_ranking.remaining_positions)
 
-            explanations_elements = edge_weight.detach().cpu()
-            explanations_under_noise_elements = edge_weight_under_noise[common_edge_indices].detach().cpu()
 
-            for metric_name in metric_names:
-                score = similarity_of_explanations(explanations_elements, explanations_under_noise_elements, top_k, metric_name)
-                if not np.isnan(score):
-                    scores[metric_name].append(score)
-    return [sum(scores[metric_name]) / len(scores[metric_name]) for metric_name in metric_names]
+def faithfulness_with_removal_per_graph_models(gnn_models, original_graphs, explanations, k, metric_names, device,
+                                               original_outputs=None, mode='subgraph'):
+    """
+    faithfulness_with_removal_per_graph of several models, see faithfulness_per_graph_models.
+    :return: Tensor [len(gnn_models), len(metric_names), len(explanations)]
+    """
+    return faithfulness_per_graph_models(gnn_models, original_graphs, explanations, k, metric_names, device,
+                                         original_outputs=original_outputs, mode=mode, select_positions=edge_ranking.remaining_positions)
 
 
-def faithfulness_with_removal(gnn_model, original_graphs, explanations, k, metric_names, device):
+def faithfulness_with_removal(gnn_model, original_graphs, explanations, k, metric_names, device, original_outputs=None, mode='subgraph'):
     """
     Calculate faithfulness of explanations by removing top k edges from explanations
     :param gnn_model: PyTorch Geometric GNN model
@@ -193,40 +427,179 @@ def faithfulness_with_removal(gnn_model, original_graphs, explanations, k, metri
     :param k: removing top k edges from the explanations
     :param metric_names: list of metrics that will be checked
     :param device: device to run the model
+    :param original_outputs: outputs of gnn_model on original_graphs, see model_outputs. Computed if None.
+    :param mode: subgraph or mask evaluation of the explanations, see selection_outputs
     :return: faithfulness degree of explanations on gnn model
     """
-    assert len(explanations) == len(original_graphs)
+    faithfulness_scores = faithfulness_with_removal_per_graph(gnn_model, original_graphs, explanations, k, metric_names, device,
+                                                              original_outputs=original_outputs, mode=mode)
+    return torch.nanmean(faithfulness_scores, dim=1).tolist()
 
-    explanations_out, original_graphs_out = [], []
 
-    for i in tqdm(range(len(explanations))):
-        if explanations[i].edge_index.shape[1] > 0 and not explanations[i].edge_weight.sum().isnan().item():
-            directed_edge_weight = explanations[i].edge_weight[explanations[i].edge_index[0] <= explanations[i].edge_index[1]]
-            directed_edge_index = explanations[i].edge_index[:, explanations[i].edge_index[0] <= explanations[i].edge_index[1]]
-
-            threshold = directed_edge_weight.topk(min(k, directed_edge_weight.shape[0]))[0][-1]
-            idx = directed_edge_weight < threshold
-            directed_edge_index = directed_edge_index[:, idx]
-
-            new_data = Data(
-                edge_index=directed_edge_index.clone(),
-                x=explanations[i].x.clone(),
-            )
-            # remove isolated nodes
-            new_data = ToUndirected()(new_data)
-            new_data = RemoveIsolatedNodes()(new_data)
-
-            if new_data.edge_index.shape[1] > 0:
-                _, _, explanations_out_i = gnn_model(new_data.to(device))
-                _, _, original_graphs_out_i = gnn_model(original_graphs[i].to(device))
-
-                explanations_out.append(explanations_out_i)
-                original_graphs_out.append(original_graphs_out_i)
-    explanations_out = torch.vstack(explanations_out)
-    original_graphs_out = torch.vstack(original_graphs_out)
-
-    faithfulness_scores = []
-    for metric in metric_names:
-        faithfulness_scores.append((original_graphs_out, explanations_out, metric))
+def edge_rank_of_edges(explanation, edge_rank):
+    """
+    Rank of every directed edge of explanation: the rank of its canonical edge, both directions of an undirected edge
+    share it. Edges whose undirected edge has no ranked canonical direction get the number of ranked edges.
+    :return: LongTensor [num_edges]
+    """
+    undirected_id = canonical_edges.edge_structure(explanation)[0]
+    undirected_rank = torch.full((canonical_edges.num_undirected_edges(undirected_id),), edge_rank.shape[0], dtype=torch.long)
+    undirected_rank[undirected_id[edge_rank]] = torch.arange(edge_rank.shape[0])
+    return undirected_rank[undirected_id]
 
-    return faithfulness_scores
+
+def variant_batch(graphs, edge_masks):
+    """
+    Batch of masked variants of graphs for masked_forward, variant j of graph i keeps the edges of edge_masks[i][j]
+    and pools the nodes of those edges. Built with tensor operations, no graph is copied per variant.
+    :param graphs: list of PyTorch Geometric Data
+    :param edge_masks: list of BoolTensor [num_variants, num_edges], one per graph
+    """
+    xs, edge_indices, node_masks, sizes, offset = [], [], [], [], 0
+    for graph, edge_mask in zip(graphs, edge_masks):
+        num_variants, num_nodes = edge_mask.shape[0], graph.num_nodes
+        xs.append(graph.x.repeat(num_variants, 1))
+        offsets = offset + torch.arange(num_variants) * num_nodes
+        edge_indices.append((graph.edge_index.unsqueeze(1) + offsets.view(1, -1, 1)).reshape(2, -1))
+        row, col = graph.edge_index
+        endpoints = torch.zeros(num_variants, num_nodes).index_add_(1, row, edge_mask.float()).index_add_(1, col, edge_mask.float())
+        node_masks.append((endpoints > 0).reshape(-1))
+        sizes += [num_nodes] * num_variants
+        offset += num_variants * num_nodes
+    sizes = torch.tensor(sizes, dtype=torch.long)
+    return Batch(x=torch.cat(xs), edge_index=torch.cat(edge_indices, dim=1), edge_mask=torch.cat([mask.reshape(-1) for mask in edge_masks]),
+                 node_mask=torch.cat(node_masks), batch=torch.arange(sizes.shape[0]).repeat_interleave(sizes),
+                 ptr=torch.cat([torch.zeros(1, dtype=torch.long), sizes.cumsum(0)]))
+
+
+def curve_sizes(explanations):
+    """ Default ks of faithfulness_curves: every k from 1 to the largest number of canonical edges of explanations"""
+    num_ranked = [edge_ranking.edge_ranking(explanations[i])[0].shape[0] for i in range(len(explanations))
+                  if edge_ranking.has_valid_weights(explanations[i])]
+    return list(range(1, max(num_ranked, default=1) + 1))
+
+
+def faithfulness_curves(gnn_model, original_graphs, explanations, device, ks=None, original_outputs=None, patience=None,
+                        batch_size=FAITHFULNESS_BATCH_SIZE):
+    """
+    Sufficiency (top k edges kept) and necessity (top k edges removed) of explanations at every k of ks in one sweep.
+    The k-variants of an explanation are masks of its ranked edges on its original topology (see masked_explanation),
+    evaluated batch_size variants per forward, variants of small graphs share forwards. Values at a k match
+    faithfulness and faithfulness_with_removal in mask mode.
+    :param ks: increasing numbers of top edges, every k from 1 to the largest number of canonical edges if None
+    :param original_outputs: outputs of gnn_model on original_graphs, see model_outputs. Computed if None.
+    :param patience: stops evaluating the variants of an explanation once the predictions of its last patience
+                     evaluated sizes did not change, the remaining sizes get the last predictions. None evaluates all.
+    :return: dict of ks, per graph sufficiency and necessity curves Tensor [len(explanations), len(ks)] (NaN where
+             undefined: invalid explanations, nothing left to keep after removal), their mean curves over graphs and
+             the normalized areas under the mean curves
+    """
+    return faithfulness_curves_models([gnn_model], original_graphs, explanations, device, ks=ks,
+                                      original_outputs=None if original_outputs is None else [original_outputs],
+                                      patience=patience, batch_size=batch_size)[0]
+
+
+@torch.no_grad()
+def faithfulness_curves_models(gnn_models, original_graphs, explanations, device, ks=None, original_outputs=None, patience=None,
+                               batch_size=FAITHFULNESS_BATCH_SIZE):
+    """
+    faithfulness_curves of several models, every batch of variants is built once and evaluated by all models. With
+    patience, the variants of an explanation are evaluated until the predictions of every model settled.
+    :param original_outputs: list of the outputs of every model on original_graphs, see models_outputs. Computed if None.
+    :return: list of the results of faithfulness_curves, one per model
+    """
+    assert len(explanations) == len(original_graphs)
+
+    if original_outputs is None:
+        original_outputs = models_outputs(gnn_models, original_graphs, device)
+    original_predictions = torch.stack([outputs.argmax(dim=1).cpu() for outputs in original_outputs])
+    if ks is None:
+        ks = curve_sizes(explanations)
+    ks = torch.as_tensor(list(ks), dtype=torch.long)
+
+    sufficiency = torch.full((len(gnn_models), len(explanations), ks.shape[0]), float('nan'))
+    necessity = torch.full((len(gnn_models), len(explanations), ks.shape[0]), float('nan'))
+    # distinct top-k sets of every explanation: index of the set of every k, predictions of every model with the set
+    # kept and removed
+    sweeps, pending = {}, []
+
+    def flush():
+        masks = [torch.cat([kept, removed]) for _, _, _, kept, removed in pending]
+        batch = variant_batch([graph for _, graph, _, _, _ in pending], masks).to(device)
+        predictions = torch.stack([masked_forward(gnn_model, batch).argmax(dim=1).cpu() for gnn_model in gnn_models])
+        for (i, _, start, kept, _), chunk in zip(pending, torch.split(predictions, [mask.shape[0] for mask in masks], dim=1)):
+            sweep, end = sweeps[i], start + kept.shape[0]
+            sweep['kept'][:, start:end] = chunk[:, :kept.shape[0]]
+            sweep['removed'][:, start:end][:, sweep['removed_any'][start:end]] = chunk[:, kept.shape[0]:]
+        pending.clear()
+
+    chunk_size = max(1, batch_size // 2)
+    for i in tqdm(range(len(explanations))):
+        explanation = explanations[i]
+        if not edge_ranking.has_valid_weights(explanation):
+            continue
+        edge_rank, edge_rank_tie = edge_ranking.edge_ranking(explanation)
+        num_ranked = edge_rank.shape[0]
+        if num_ranked == 0:
+            continue
+        ends, inverse = torch.unique(edge_ranking.top_k_ends(edge_rank_tie, ks), return_inverse=True)
+        rank = edge_rank_of_edges(explanation, edge_rank)
+        graph = Data(x=explanation.x, edge_index=explanation.edge_index)
+        sweeps[i] = sweep = {'inverse': inverse, 'removed_any': ends < num_ranked, 'stop': ends.shape[0],
+                             'kept': torch.full((len(gnn_models), ends.shape[0]), -1, dtype=torch.long),
+                             'removed': torch.full((len(gnn_models), ends.shape[0]), -1, dtype=torch.long)}
+        for start in range(0, ends.shape[0], chunk_size):
+            end = min(start + chunk_size, ends.shape[0])
+            kept = rank.unsqueeze(0) < ends[start:end].unsqueeze(1)
+            removed = ~kept[sweep['removed_any'][start:end]] & (rank < num_ranked)
+            pending.append((i, graph, start, kept, removed))
+            if sum(mask.shape[0] for entry in pending for mask in entry[3:]) >= batch_size:
+                flush()
+            if patience is None or end == ends.shape[0]:
+                continue
+            # the next sizes are only evaluated if the predictions of some model did not settle
+            if len(pending) > 0:
+                flush()
+            window = slice(end - patience, end)
+            if end >= patience and all(stable(kept_m[window]) and stable(removed_m[window][sweep['removed_any'][window]])
+                                       for kept_m, removed_m in zip(sweep['kept'], sweep['removed'])):
+                sweep['stop'] = end
+                break
+    if len(pending) > 0:
+        flush()
+
+    for i, sweep in sweeps.items():
+        kept, removed, stop = sweep['kept'], sweep['removed'], sweep['stop']
+        kept[:, stop:] = kept[:, stop - 1:stop]
+        removed[:, stop:] = removed[:, stop - 1:stop]
+        original = original_predictions[:, i].unsqueeze(1)
+        sufficiency[:, i] = (kept == original).float()[:, sweep['inverse']]
+        necessity[:, i] = torch.where(sweep['removed_any'], (removed != original).float(), torch.tensor(float('nan')))[:, sweep['inverse']]
+
+    return [curve_results(ks, sufficiency[m], necessity[m]) for m in range(len(gnn_models))]
+
+
+def curve_results(ks, sufficiency, necessity):
+    """ Results of faithfulness_curves from per graph curves, e.g. the rows of the graphs of a fold"""
+    ks = torch.as_tensor(list(ks), dtype=torch.long)
+    results = {'ks': ks.tolist(), 'sufficiency': sufficiency, 'necessity': necessity}
+    for metric in ['sufficiency', 'necessity']:
+        curve = torch.nanmean(results[metric], dim=0)
+        results[f'{metric}_curve'] = curve.tolist()
+        results[f'{metric}_auc'] = curve_auc(ks, curve)
+    return results
+
+
+def stable(predictions):
+    return predictions.shape[0] == 0 or bool((predictions == predictions[0]).all())
+
+
+def curve_auc(ks, curve):
+    """ Area under curve over ks normalized by the range of ks, the mean value for a single k, NaN points skipped"""
+    defined = ~torch.isnan(curve)
+    ks, curve = ks[defined].double(), curve[defined].double()
+    if ks.shape[0] == 0:
+        return float('nan')
+    if ks.shape[0] == 1:
+        return curve[0].item()
+    return (torch.trapezoid(curve, ks) / (ks[-1] - ks[0])).item()
@@ -0,0 +1,252 @@
+# Packed, memory-mapped storage for lists of graphs.
+#
+# A packed folder holds one `<key>.npy` per graph attribute where the attributes of all graphs are concatenated
+# along their PyG concatenation dimension, one `<key>_ptr.npy` offset table per attribute and a `packed.json` meta
+# file. Reading graph i is an O(1) slice of the memory-mapped arrays, no unpickling happens.
+# A sharded folder holds consecutive ranges of graphs in packed `shard_{i}` subfolders and a `shards.json` meta file,
+# shards are only mapped when one of their graphs is read, so streaming readers touch one shard at a time.
+
+import os
+import re
+import sys
+import glob
+import json
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+META_FILE_NAME = 'packed.json'
+SHARDS_META_FILE_NAME = 'shards.json'
+SHARD_SIZE = 1024
+SHARD_FOLDER_PREFIX = 'shard_'
+LEGACY_FILE_PATTERN = re.compile(r'data_(\d+)\.pt$')
+
+
+def pack_graphs(graphs, folder, attributes=None):
+    """
+    Writes graphs into folder in packed format.
+    :param graphs: iterable of PyTorch Geometric Data, only tensor attributes are stored
+    :param folder: output folder, created if it does not exist
+    :param attributes: json serializable dict of dataset level attributes stored in the meta file
+    :return: number of packed graphs
+    """
+    os.makedirs(folder, exist_ok=True)
+    chunks, cat_dims, num_nodes = {}, {}, []
+    for i, graph in enumerate(graphs):
+        keys = set()
+        for key, value in graph:
+            if not torch.is_tensor(value):
+                continue
+            keys.add(key)
+            if key not in cat_dims:
+                if i > 0:
+                    raise ValueError(f'Attribute {key} is missing in the graphs before graph {i}.')
+                cat_dims[key] = graph.__cat_dim__(key, value) % max(value.dim(), 1)
+                chunks[key] = []
+            chunks[key].append(value.detach().cpu().numpy())
+        if keys != set(cat_dims.keys()):
+            raise ValueError(f'Graph {i} does not have the same attributes as the previous graphs.')
+        num_nodes.append(graph.num_nodes)
+
+    for key, dim in cat_dims.items():
+        sizes = [chunk.shape[dim] if chunk.ndim > 0 else 1 for chunk in chunks[key]]
+        array = np.concatenate([np.atleast_1d(chunk) for chunk in chunks[key]], axis=dim)
+        np.save(os.path.join(folder, f'{key}.npy'), np.ascontiguousarray(array))
+        np.save(os.path.join(folder, f'{key}_ptr.npy'), np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64))
+    np.save(os.path.join(folder, 'num_nodes.npy'), np.asarray(num_nodes, dtype=np.int64))
+
+    # meta file is written last, a folder without it is considered incomplete
+    with open(os.path.join(folder, META_FILE_NAME), 'w') as f:
+        json.dump({'num_graphs': len(num_nodes), 'cat_dims': cat_dims, 'attributes': attributes or {}}, f)
+    return len(num_nodes)
+
+
+def pack_shards(graphs, folder, shard_size=SHARD_SIZE, attributes=None):
+    """
+    Writes graphs into folder in sharded format, every shard_size consecutive graphs are packed into one shard.
+    :return: number of packed graphs
+    """
+    os.makedirs(folder, exist_ok=True)
+    offsets, shard = [0], []
+
+    def write_shard():
+        pack_graphs(shard, os.path.join(folder, shard_folder_name(len(offsets) - 1)))
+        offsets.append(offsets[-1] + len(shard))
+        shard.clear()
+
+    for graph in graphs:
+        shard.append(graph)
+        if len(shard) == shard_size:
+            write_shard()
+    if len(shard) > 0:
+        write_shard()
+
+    # meta file is written last, a folder without it is considered incomplete
+    with open(os.path.join(folder, SHARDS_META_FILE_NAME), 'w') as f:
+        json.dump({'num_graphs': offsets[-1], 'offsets': offsets, 'attributes': attributes or {}}, f)
+    return offsets[-1]
+
+
+def shard_folder_name(shard):
+    return f'{SHARD_FOLDER_PREFIX}{shard:05d}'
+
+
+def publish_graphs(graphs, folder, attributes=None, shard_size=None):
+    """
+    Packs graphs into folder for processes that may build the same folder concurrently: graphs are packed into a
+    temporary sibling folder which is renamed to folder, the first process to finish wins and the others drop theirs.
+    :param shard_size: packs graphs in sharded format if given, see pack_shards
+    :return: folder
+    """
+    if is_packed(folder) or is_sharded(folder):
+        return folder
+    parent = os.path.dirname(os.path.abspath(folder))
+    os.makedirs(parent, exist_ok=True)
+    tmp_folder = tempfile.mkdtemp(prefix=f'{os.path.basename(folder)}.', dir=parent)
+    if shard_size is None:
+        pack_graphs(graphs, tmp_folder, attributes=attributes)
+    else:
+        pack_shards(graphs, tmp_folder, shard_size=shard_size, attributes=attributes)
+    try:
+        os.rename(tmp_folder, folder)
+    except OSError:
+        # folder was published by another process in the meantime
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+    return folder
+
+
+def is_packed(folder):
+    return os.path.exists(os.path.join(folder, META_FILE_NAME))
+
+
+def is_sharded(folder):
+    return os.path.exists(os.path.join(folder, SHARDS_META_FILE_NAME))
+
+
+class PackedGraphs(object):
+    """Random access reader of a packed folder. Returned tensors are zero-copy views of the memory-mapped arrays."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, META_FILE_NAME)) as f:
+            meta = json.load(f)
+        self.num_graphs = meta['num_graphs']
+        self.cat_dims = meta['cat_dims']
+        self.attributes = meta.get('attributes', {})
+        # copy-on-write mapping keeps the arrays writable for torch.from_numpy without touching the files
+        self.arrays = {key: np.load(os.path.join(folder, f'{key}.npy'), mmap_mode='c') for key in self.cat_dims}
+        self.ptrs = {key: np.load(os.path.join(folder, f'{key}_ptr.npy')) for key in self.cat_dims}
+        self.num_nodes = np.load(os.path.join(folder, 'num_nodes.npy'))
+
+    def __reduce__(self):
+        # worker processes map the files again instead of receiving copies of the arrays
+        return self.__class__, (self.folder,)
+
+    def __len__(self):
+        return self.num_graphs
+
+    def __getitem__(self, idx):
+        """ Graph idx, or list of graphs of a slice or an index array"""
+        if isinstance(idx, slice):
+            return [self.get(i) for i in range(*idx.indices(self.num_graphs))]
+        if isinstance(idx, (int, np.integer)) or (torch.is_tensor(idx) and idx.dim() == 0):
+            return self.get(int(idx))
+        return [self.get(int(i)) for i in idx]
+
+    def __iter__(self):
+        for idx in range(self.num_graphs):
+            yield self.get(idx)
+
+    def slice(self, key, idx):
+        start, end = self.ptrs[key][idx], self.ptrs[key][idx + 1]
+        array = self.arrays[key]
+        index = [slice(None)] * array.ndim
+        index[self.cat_dims[key]] = slice(start, end)
+        return torch.from_numpy(array[tuple(index)])
+
+    def get(self, idx):
+        if idx < 0:
+            idx += self.num_graphs
+        if not 0 <= idx < self.num_graphs:
+            raise IndexError(f'Index {idx} is out of range for {self.num_graphs} graphs.')
+        data = Data(**{key: self.slice(key, idx) for key in self.cat_dims})
+        if 'x' not in self.cat_dims:
+            data.num_nodes = int(self.num_nodes[idx])
+        return data
+
+
+class ShardedGraphs(PackedGraphs):
+    """Random access reader of a sharded folder, a shard is mapped when one of its graphs is first read."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, SHARDS_META_FILE_NAME)) as f:
+            meta = json.load(f)
+        self.num_graphs = meta['num_graphs']
+        self.offsets = np.asarray(meta['offsets'], dtype=np.int64)
+        self.attributes = meta.get('attributes', {})
+        self.shards = {}
+
+    @property
+    def num_shards(self):
+        return self.offsets.shape[0] - 1
+
+    def shard_of(self, indices):
+        """ Shards of graph indices, np.array"""
+        return np.searchsorted(self.offsets, indices, side='right') - 1
+
+    def shard(self, shard):
+        if shard not in self.shards:
+            self.shards[shard] = PackedGraphs(os.path.join(self.folder, shard_folder_name(shard)))
+        return self.shards[shard]
+
+    def get(self, idx):
+        if idx < 0:
+            idx += self.num_graphs
+        if not 0 <= idx < self.num_graphs:
+            raise IndexError(f'Index {idx} is out of range for {self.num_graphs} graphs.')
+        shard = int(self.shard_of(idx))
+        return self.shard(shard).get(idx - int(self.offsets[shard]))
+
+
+def legacy_files(folder):
+    """Returns paths of data_{i}.pt files in folder, ordered by i."""
+    files = {}
+    for path in glob.glob(os.path.join(folder, 'data_*.pt')):
+        match = LEGACY_FILE_PATTERN.search(path)
+        if match is not None:
+            files[int(match.group(1))] = path
+    if len(files) > 0 and sorted(files.keys()) != list(range(len(files))):
+        raise ValueError(f'{folder} has missing data_{{i}}.pt files.')
+    return [files[i] for i in range(len(files))]
+
+
+def convert_processed_dir(folder, remove_legacy=False):
+    """
+    Converts a processed folder with one data_{i}.pt per graph into packed format.
+    :param folder: processed folder of a dataset
+    :param remove_legacy: removes data_{i}.pt files after conversion
+    :return: number of converted graphs
+    """
+    paths = legacy_files(folder)
+    if len(paths) == 0:
+        return 0
+    count = pack_graphs((torch.load(path) for path in paths), folder)
+    if remove_legacy:
+        for path in paths:
+            os.remove(path)
+    return count
+
+
+if __name__ == '__main__':
+    # usage: python source/packed_storage.py [processed folders...] [--remove]
+    # converts every data/*/processed folder if no folder is given.
+    remove = '--remove' in sys.argv
+    folders = [arg for arg in sys.argv[1:] if arg != '--remove'] or sorted(glob.glob('data/*/processed'))
+    for processed_folder in folders:
+        if is_packed(processed_folder) or len(legacy_files(processed_folder)) == 0:
+            continue
+        print(f'Converting {processed_folder}: {convert_processed_dir(processed_folder, remove_legacy=remove)} graphs')
@@ -0,0 +1,193 @@
+# Perturbation engines used to generate the noisy variants of datasets.
+
+import numpy as np
+import torch
+
+
+def perturb_features(x, noise, mode='legacy', seed=0):
+    """
+    Perturbs node features: half of the nodes are sampled (with replacement) and noise% of their features are moved by
+    delta * sigma, where delta ~ U(-0.1, 0.1) and sigma is the standard deviation of the feature column.
+    :param x: node features, tensor of shape [num_nodes, num_features]
+    :param noise: percentage of perturbed features of a sampled node
+    :param mode: 'legacy' draws the same random numbers in the same order as the original per node, per feature loop
+                 and updates the column statistics after every node as the loop did. 'vectorized' precomputes the
+                 column statistics once and draws all masks and deltas in one go, it is faster but its random
+                 numbers differ from the legacy loop.
+    :param seed: seed of the graph
+    :return: perturbed node features
+    """
+    perturbed_x = x.clone().detach().numpy()
+    num_nodes, num_features = perturbed_x.shape
+    p = noise / 100
+    if mode == 'legacy':
+        random_state = np.random.RandomState(seed)
+        chosen_idx = random_state.randint(0, num_nodes, size=int(0.5 * num_nodes))
+
+        # running mean and sum of squared deviations of every column, updated after each perturbed node
+        column = perturbed_x.astype(np.float64)
+        mean = column.mean(axis=0)
+        m2 = ((column - mean) ** 2).sum(axis=0)
+        for idx in chosen_idx:
+            mask = random_state.choice([0, 1], size=num_features, p=[1 - p, p])
+            perb_idx = np.where(mask == 1)[0]
+            delta = random_state.uniform(-0.1, 0.1, perb_idx.shape[0])
+            sigma = np.sqrt(np.maximum(m2[perb_idx], 0) / num_nodes)
+            old = perturbed_x[idx, perb_idx].astype(np.float64)
+            perturbed_x[idx, perb_idx] = old + delta * sigma
+            new = perturbed_x[idx, perb_idx].astype(np.float64)
+            new_mean = mean[perb_idx] + (new - old) / num_nodes
+            m2[perb_idx] += (new - old) * (new + old - new_mean - mean[perb_idx])
+            mean[perb_idx] = new_mean
+    elif mode == 'vectorized':
+        generator = np.random.default_rng(seed)
+        chosen_idx = generator.integers(0, num_nodes, size=int(0.5 * num_nodes))
+        sigma = perturbed_x.std(axis=0, dtype=np.float64)
+        mask = generator.random((chosen_idx.shape[0], num_features)) < p
+        delta = generator.uniform(-0.1, 0.1, (chosen_idx.shape[0], num_features))
+        # add.at accumulates the perturbations of nodes that are sampled more than once
+        np.add.at(perturbed_x, chosen_idx, (mask * delta * sigma).astype(perturbed_x.dtype))
+    else:
+        raise NotImplementedError(f'Perturbation mode: {mode} is not implemented!')
+    return torch.tensor(perturbed_x)
+
+
+def _shift_right(x, bits):
+    # logical right shift of int64 tensors, >> is arithmetic in torch
+    return (x >> bits) & ((1 << (64 - bits)) - 1)
+
+
+def _splitmix64(x):
+    # torch int64 arithmetic wraps around, which is what splitmix64 expects from uint64
+    x = x + (0x9E3779B97F4A7C15 - (1 << 64))
+    x = (x ^ _shift_right(x, 30)) * (0xBF58476D1CE4E5B9 - (1 << 64))
+    x = (x ^ _shift_right(x, 27)) * (0x94D049BB133111EB - (1 << 64))
+    return x ^ _shift_right(x, 31)
+
+
+def random_integers(seed, graph_ids, counters, high):
+    """
+    Counter based random integers: the value of (graph, counter) only depends on seed, graph id and counter, so a graph
+    gets the same numbers whether it is processed alone or together with the whole dataset.
+    :param seed: seed
+    :param graph_ids: LongTensor [num_graphs], index of the graphs in their dataset
+    :param counters: LongTensor [num_draws]
+    :param high: LongTensor [num_graphs], exclusive upper bound of every graph
+    :return: LongTensor [num_graphs, num_draws]
+    """
+    graph_keys = _splitmix64(_splitmix64(torch.tensor(seed, dtype=torch.long)) + graph_ids)
+    bits = _splitmix64(graph_keys.unsqueeze(1) + counters.unsqueeze(0))
+    return _shift_right(bits, 1) % high.unsqueeze(1)
+
+
+def sample_flip_pairs(num_nodes, flip_count, graph_ids=None, seed=0, oversample=4):
+    """
+    Samples distinct node pairs u < v to flip for every graph at once. Pairs are kept in the order they are drawn,
+    so the first k pairs are the flips of flip count k for every k <= flip_count.
+    :param num_nodes: LongTensor [num_graphs]
+    :param flip_count: maximum number of flips, graphs with fewer node pairs get all of their pairs
+    :param graph_ids: LongTensor [num_graphs], index of the graphs in their dataset, defaults to 0..num_graphs-1
+    :param seed: seed
+    :param oversample: candidate pairs drawn per flip in every round
+    :return: pairs LongTensor [num_graphs, flip_count, 2] padded with -1, counts LongTensor [num_graphs]
+    """
+    num_nodes = torch.as_tensor(num_nodes, dtype=torch.long)
+    num_graphs = num_nodes.shape[0]
+    graph_ids = torch.arange(num_graphs) if graph_ids is None else torch.as_tensor(graph_ids, dtype=torch.long)
+    targets = torch.clamp(num_nodes * (num_nodes - 1) // 2, max=flip_count)
+
+    keys = torch.full((num_graphs, flip_count), -1, dtype=torch.long)  # u * num_nodes + v of the sampled pairs
+    found = torch.zeros(num_graphs, dtype=torch.long)
+    slots = oversample * flip_count
+    drawn = 0
+    while True:
+        missing = (found < targets).nonzero().flatten()
+        if missing.numel() == 0:
+            break
+        n = num_nodes[missing].unsqueeze(1)
+        counters = drawn + torch.arange(slots)
+        u = random_integers(seed, graph_ids[missing], 2 * counters, n.squeeze(1))
+        v = random_integers(seed, graph_ids[missing], 2 * counters + 1, n.squeeze(1))
+        drawn += slots
+        new_keys = torch.minimum(u, v) * n + torch.maximum(u, v)
+        new_keys[u == v] = -1
+
+        # keep the first occurrence of every pair, pairs found in earlier rounds come first
+        candidates = torch.cat([keys[missing], new_keys], dim=1)
+        rows = torch.arange(missing.numel()).unsqueeze(1).expand_as(candidates)
+        positions = torch.arange(candidates.shape[1]).unsqueeze(0).expand_as(candidates)
+        width = candidates.shape[1]
+        valid = candidates >= 0
+        rows, positions, candidates = rows[valid], positions[valid], candidates[valid]
+        hashed = rows * (num_nodes.max() ** 2) + candidates
+        unique_keys, inverse = torch.unique(hashed, return_inverse=True)
+        first = torch.full(unique_keys.shape, width, dtype=torch.long)
+        first = first.scatter_reduce(0, inverse, positions, reduce='amin')
+        is_first = positions == first[inverse]
+        rows, positions, candidates = rows[is_first], positions[is_first], candidates[is_first]
+
+        order = torch.argsort(rows * width + positions)
+        rows, candidates = rows[order], candidates[order]
+        row_counts = torch.bincount(rows, minlength=missing.numel())
+        rank = torch.arange(rows.numel()) - (torch.cumsum(row_counts, 0) - row_counts)[rows]
+        keep = rank < targets[missing][rows]
+        keys[missing[rows[keep]], rank[keep]] = candidates[keep]
+        found[missing] = torch.minimum(row_counts, targets[missing])
+
+    n = num_nodes.unsqueeze(1)
+    pairs = torch.stack([keys // n, keys % n], dim=2)
+    pairs[keys < 0] = -1
+    return pairs, targets
+
+
+def flip_edges(edge_indices, num_nodes, pairs, counts):
+    """
+    Flips node pairs of many graphs with one isin and one sort over the whole dataset: existing edges of a flipped
+    pair are removed, missing ones are added in both directions. Returned edges are sorted like dense_to_sparse.
+    :param edge_indices: list of LongTensor [2, num_edges_i]
+    :param num_nodes: LongTensor [num_graphs]
+    :param pairs: LongTensor [num_graphs, max_flip_count, 2], output of sample_flip_pairs
+    :param counts: LongTensor [num_graphs], number of pairs to flip per graph
+    :return: list of flipped LongTensor [2, num_new_edges_i]
+    """
+    num_nodes = torch.as_tensor(num_nodes, dtype=torch.long)
+    # every graph owns the key range [base, base + num_nodes^2)
+    sizes = num_nodes ** 2
+    base = torch.cumsum(sizes, 0) - sizes
+
+    edge_counts = torch.tensor([edge_index.shape[1] for edge_index in edge_indices], dtype=torch.long)
+    edge_graph = torch.repeat_interleave(torch.arange(num_nodes.shape[0]), edge_counts)
+    row, col = torch.cat(edge_indices, dim=1) if len(edge_indices) > 0 else torch.empty((2, 0), dtype=torch.long)
+    existing = torch.unique(base[edge_graph] + row * num_nodes[edge_graph] + col)
+
+    selected = torch.arange(pairs.shape[1]).unsqueeze(0) < counts.unsqueeze(1)
+    flip_graph = torch.arange(num_nodes.shape[0]).unsqueeze(1).expand(-1, pairs.shape[1])[selected]
+    u, v = pairs[selected].t()
+    n = num_nodes[flip_graph]
+    flipped = torch.cat([base[flip_graph] + u * n + v, base[flip_graph] + v * n + u])
+
+    kept = existing[~torch.isin(existing, flipped)]
+    added = flipped[~torch.isin(flipped, existing)]
+    new_keys = torch.sort(torch.cat([kept, added]))[0]
+
+    new_graph = torch.searchsorted(base, new_keys, right=True) - 1
+    local = new_keys - base[new_graph]
+    new_edge_index = torch.stack([local // num_nodes[new_graph], local % num_nodes[new_graph]])
+    return list(torch.split(new_edge_index, torch.bincount(new_graph, minlength=num_nodes.shape[0]).tolist(), dim=1))
+
+
+def flip_graphs(graphs, flip_counts=(1, 2, 3, 4, 5), graph_ids=None, seed=0):
+    """
+    Topology adversarial attack of many graphs for several flip counts at once. The flips of a smaller count are a
+    prefix of the flips of a larger count.
+    :param graphs: list of PyTorch Geometric Data
+    :param flip_counts: flip counts to generate
+    :param graph_ids: index of the graphs in their dataset, defaults to 0..len(graphs)-1
+    :param seed: seed
+    :return: dict of flip count to list of flipped edge_index tensors
+    """
+    num_nodes = torch.tensor([graph.num_nodes for graph in graphs], dtype=torch.long)
+    edge_indices = [graph.edge_index for graph in graphs]
+    pairs, counts = sample_flip_pairs(num_nodes, max(flip_counts), graph_ids=graph_ids, seed=seed)
+    return {flip_count: flip_edges(edge_indices, num_nodes, pairs, torch.clamp(counts, max=flip_count))
+            for flip_count in flip_counts}
@@ -5,8 +5,8 @@ import numpy as np
 import os
 
 import data_utils
+import explanation_store
 from gnn_trainer import GNNTrainer
-from torch_geometric.data import Data
 from methods.PGExplainer.explainers.PGExplainer import PGExplainer
 
 parser = argparse.ArgumentParser()
@@ -22,6 +22,8 @@ parser.add_argument('--explainer_run', type=int, default=1)
 parser.add_argument('--gnn_type', type=str, default='gcn', choices=['gcn', 'gat', 'gin', 'sage'])
 parser.add_argument('--epochs', type=int, default=20)
 parser.add_argument('--robustness', type=str, default='na', choices=['topology_random', 'topology_adversarial', 'feature', 'na'], help="na by default means we do not run for perturbed data")
+parser.add_argument('--lazy_variants', action='store_true', help='Perturbs the graphs of the robustness runs on access instead of loading the materialized noisy datasets, topology adversarial graphs are the vectorized flips.')
+parser.add_argument('--flip_mode', type=str, default='legacy', choices=['legacy', 'vectorized'], help='Topology adversarial datasets of the original flip loop or of the vectorized flips.')
 
 args = parser.parse_args()
 
@@ -32,6 +34,7 @@ if not os.path.exists(result_folder):
 
 device = torch.device(f'cuda:{args.device}' if torch.cuda.is_available() else 'cpu')
 dataset = data_utils.load_dataset(args.dataset)
+dataset_variants = data_utils.DatasetVariants(args.dataset, original_graphs=dataset, flip_mode=args.flip_mode, lazy=args.lazy_variants)
 splits, indices = data_utils.split_data(dataset)
 
 torch.manual_seed(args.explainer_run)
@@ -68,68 +71,47 @@ explainer = PGExplainer(model, dataset, node_embeddings, task='graph', device=de
 
 if args.robustness == 'na':
     explainer.prepare(train_indices=train_indices, val_indices=val_indices, start_training=True)
-    explanation_graphs = []
+    edge_weights = []
     for i in range(len(dataset)):
-        graph = dataset[i]
         explanation = explainer.explain(i)
-        explanation_graphs.append(Data(
-            edge_index=graph.edge_index.clone(),
-            x=graph.x.clone(),
-            y=graph.y.clone(),
-            edge_weight=explanation.detach().cpu().clone()
-        ))
-    torch.save(explanation_graphs, explanations_path)
+        edge_weights.append(explanation.detach().cpu().clone())
+    explanation_store.save_edge_weights(edge_weights, explanations_path, args.dataset, range(len(dataset)), dataset=dataset)
 elif args.robustness == 'topology_random':
     explainer.prepare(train_indices=train_indices, val_indices=val_indices, start_training=False)
     explainer.explainer_model.load_state_dict(torch.load(args.best_explainer_model_path, map_location=device))
     for noise in [1, 2, 3, 4, 5]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_noise_{noise}.pt')
-        explanation_graphs = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_dataset_name(dataset_name=args.dataset, noise=noise))
+        edge_weights = []
+        noisy_dataset = dataset_variants.get('topology_random', noise)
         for i in range(len(dataset)):
             noisy_graph = noisy_dataset[i].to(device)
             explanation = explainer.explain_graph(noisy_graph)
-            explanation_graphs.append(Data(
-                edge_index=noisy_graph.edge_index.clone(),
-                x=noisy_graph.x.clone(),
-                y=noisy_graph.y.clone(),
-                edge_weight=explanation.detach().cpu().clone()
-            ))
-        torch.save(explanation_graphs, explanations_path)
+            edge_weights.append(explanation.detach().cpu().clone())
+        explanation_store.save_edge_weights(edge_weights, explanations_path, dataset_variants.name('topology_random', noise), range(len(dataset)), dataset=noisy_dataset)
 elif args.robustness == 'feature':
     explainer.prepare(train_indices=train_indices, val_indices=val_indices, start_training=False)
     explainer.explainer_model.load_state_dict(torch.load(args.best_explainer_model_path, map_location=device))
     for noise in [10, 20, 30, 40, 50]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_feature_noise_{noise}.pt')
-        explanation_graphs = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_feature_dataset_name(dataset_name=args.dataset, noise=noise))
+        edge_weights = []
+        noisy_dataset = dataset_variants.get('feature', noise)
         for i in range(len(dataset)):
             noisy_graph = noisy_dataset[i].to(device)
             explanation = explainer.explain_graph(noisy_graph)
-            explanation_graphs.append(Data(
-                edge_index=noisy_graph.edge_index.clone(),
-                x=noisy_graph.x.clone(),
-                y=noisy_graph.y.clone(),
-                edge_weight=explanation.detach().cpu().clone()
-            ))
-        torch.save(explanation_graphs, explanations_path)
+            edge_weights.append(explanation.detach().cpu().clone())
+        explanation_store.save_edge_weights(edge_weights, explanations_path, dataset_variants.name('feature', noise), range(len(dataset)), dataset=noisy_dataset)
 elif args.robustness == 'topology_adversarial':
     explainer.prepare(train_indices=train_indices, val_indices=val_indices, start_training=False)
     explainer.explainer_model.load_state_dict(torch.load(args.best_explainer_model_path, map_location=device))
     for flip_count in [1, 2, 3, 4, 5]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_topology_adversarial_{flip_count}.pt')
-        explanation_graphs = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_topology_adversarial_attack_dataset_name(dataset_name=args.dataset, flip_count=flip_count))
+        edge_weights = []
+        noisy_dataset = dataset_variants.get('topology_adversarial', flip_count)
         for i in range(len(dataset)):
             noisy_graph = noisy_dataset[i].to(device)
             explanation = explainer.explain_graph(noisy_graph)
-            explanation_graphs.append(Data(
-                edge_index=noisy_graph.edge_index.clone(),
-                x=noisy_graph.x.clone(),
-                y=noisy_graph.y.clone(),
-                edge_weight=explanation.detach().cpu().clone()
-            ))
-        torch.save(explanation_graphs, explanations_path)
+            edge_weights.append(explanation.detach().cpu().clone())
+        explanation_store.save_edge_weights(edge_weights, explanations_path, dataset_variants.name('topology_adversarial', flip_count), range(len(dataset)), dataset=noisy_dataset)
 else:
     raise ValueError(f'Unknown robustness type {args.robustness}')
 
@@ -8,6 +8,7 @@ from methods.rcexplainer.rcexplainer_helper import RuleMinerLargeCandiPool, eval
 from torch_geometric.utils import to_dense_adj
 from methods.rcexplainer.rcexplainer_helper import ExplainModule, train_explainer, evaluator_explainer
 import data_utils
+import artifact_cache
 from tqdm import tqdm
 import torch.nn.functional as F
 from gnn_trainer import GNNTrainer
@@ -17,8 +18,8 @@ from torch_geometric.utils import dense_to_sparse
 
 
 def get_rce_format(data, node_embeddings):
-    num_nodes = [graph.num_nodes for graph in data]
-    max_num_nodes = max(num_nodes)
+    num_nodes = artifact_cache.graph_sizes(data)[0]
+    max_num_nodes = int(num_nodes.max())
     label = [graph.y for graph in data]
     feat = []
     adj = []
@@ -36,7 +37,6 @@ def get_rce_format(data, node_embeddings):
     adj = torch.stack(adj)
     feat = torch.stack(feat)
     label = torch.LongTensor(label)
-    num_nodes = torch.LongTensor(num_nodes)
     node_embs_pads = torch.stack(node_embs_pads)
 
     return adj, feat, label, num_nodes, node_embs_pads
@@ -152,6 +152,8 @@ parser.add_argument('--explainer_run', type=int, default=1)
 parser.add_argument('--gnn_type', type=str, default='gcn', choices=['gcn', 'gat', 'gin', 'sage'])
 parser.add_argument('--epochs', type=int, default=20)
 parser.add_argument('--robustness', type=str, default='na', choices=['topology_random', 'topology_adversarial', 'feature', 'na'], help="na by default means we do not run for perturbed data")
+parser.add_argument('--lazy_variants', action='store_true', help='Perturbs the graphs of the robustness runs on access instead of loading the materialized noisy datasets, topology adversarial graphs are the vectorized flips.')
+parser.add_argument('--flip_mode', type=str, default='legacy', choices=['legacy', 'vectorized'], help='Topology adversarial datasets of the original flip loop or of the vectorized flips.')
 
 args = parser.parse_args()
 
@@ -162,6 +164,7 @@ if not os.path.exists(result_folder):
 
 device = torch.device(f'cuda:{args.device}' if torch.cuda.is_available() else 'cpu')
 dataset = data_utils.load_dataset(args.dataset)
+dataset_variants = data_utils.DatasetVariants(args.dataset, original_graphs=dataset, flip_mode=args.flip_mode, lazy=args.lazy_variants)
 splits, indices = data_utils.split_data(dataset)
 
 torch.manual_seed(args.explainer_run)
@@ -265,7 +268,7 @@ elif args.robustness == 'topology_random':
         if (args.lambda_ != 0.0):
             counterfactuals_path = os.path.join(result_folder, f'counterfactuals_{args.gnn_type}_run_{args.explainer_run}_noise_{noise}.pt')
         explanation_graphs = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_dataset_name(dataset_name=args.dataset, noise=noise))
+        noisy_dataset = dataset_variants.get('topology_random', noise)
         with torch.no_grad():
             node_embeddings = []
             graph_embeddings = []
@@ -315,7 +318,7 @@ elif args.robustness == 'feature':
         if (args.lambda_ != 0.0):
             counterfactuals_path = os.path.join(result_folder, f'counterfactuals_{args.gnn_type}_run_{args.explainer_run}_feature_noise_{noise}.pt')
         explanation_graphs = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_feature_dataset_name(dataset_name=args.dataset, noise=noise))
+        noisy_dataset = dataset_variants.get('feature', noise)
         with torch.no_grad():
             node_embeddings = []
             graph_embeddings = []
@@ -365,7 +368,7 @@ elif args.robustness == 'topology_adversarial':
         if (args.lambda_ != 0.0):
             counterfactuals_path = os.path.join(result_folder, f'counterfactuals_{args.gnn_type}_run_{args.explainer_run}_topology_adversarial_{flip_count}.pt')
         explanation_graphs = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_topology_adversarial_attack_dataset_name(dataset_name=args.dataset, flip_count=flip_count))
+        noisy_dataset = dataset_variants.get('topology_adversarial', flip_count)
         with torch.no_grad():
             node_embeddings = []
             graph_embeddings = []
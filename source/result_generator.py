@@ -2,9 +2,12 @@
 
 import torch
 import argparse
-from gnn_trainer import GNNTrainer
+from gnn_trainer import load_base_gnn
 import data_utils
 import metrics
+from index_view import IndexView
+from instance_store import InstanceStore, sequential_scores
+import numpy as np
 import os
 
 
@@ -20,20 +23,172 @@ def parse_args():
     parser.add_argument('--explainer_name', type=str, choices=['pgexplainer', 'tagexplainer', 'tagexplainer_1', 'tagexplainer_2',
                                                                'cff_1.0', 'rcexplainer_1.0', 'gnnexplainer', 'gem', 'subgraphx'],
                         help='Name of explainer to use.')
-    parser.add_argument('--explanation_metric', type=str, choices=['faithfulness', 'faithfulness_with_removal', 'faithfulness_on_test', 'faithfulness_under_noise',
-                                                                   'stability_noise', 'stability_seed', 'stability_base', 'stability_noise_feature', 'stability_topology_adversarial'],
+    parser.add_argument('--explanation_metric', type=str, required=True, choices=['faithfulness', 'faithfulness_with_removal', 'faithfulness_on_test', 'faithfulness_under_noise', 'faithfulness_curves',
+                                                                   'stability_noise', 'stability_seed', 'stability_base', 'stability_explainer', 'stability_noise_feature', 'stability_topology_adversarial'],
                         help='Explanation metric to use.')
     parser.add_argument('--folded', action='store_true', help='Whether to use folded results.')
-    return parser.parse_args()
+    parser.add_argument('--fidelity_mode', type=str, default='subgraph', choices=['subgraph', 'mask'],
+                        help='Faithfulness metrics evaluate explanation subgraphs built for every k, or masks of them on the original topology.')
+    parser.add_argument('--curve_ks', type=int, nargs='+', default=None,
+                        help='Numbers of top edges of faithfulness_curves, every k from 1 to the largest explanation if not given.')
+    parser.add_argument('--curve_patience', type=int, default=None,
+                        help='Stops the curves of an explanation once its predictions did not change for this many sizes.')
+    parser.add_argument('--other_explainers', type=str, nargs='+', default=[],
+                        help='Explainers that stability_explainer compares with the explanations of explainer_name.')
+    parser.add_argument('--bootstrap', action='store_true',
+                        help='Saves mean, standard deviation and bootstrap confidence interval of every score over the whole dataset.')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='Scores graphs in random order until the confidence interval half-width of every score is below this tolerance, all graphs if not given.')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the intervals of --tolerance.')
+    parser.add_argument('--stream_block', type=int, default=256, help='Number of graphs scored between two checks of --tolerance.')
+    parser.add_argument('--stream_seed', type=int, default=0, help='Random seed of the graph order of --tolerance.')
+    parser.add_argument('--base_gnn_types', type=str, nargs='+', default=None, choices=['gcn', 'gat', 'gin', 'sage'],
+                        help='GNN layer types of the base GNNs that the faithfulness metrics evaluate, gnn_type if not given.')
+    parser.add_argument('--base_gnn_runs', type=int, nargs='+', default=None,
+                        help='Runs of the base GNNs that the faithfulness metrics evaluate, gnn_run if not given.')
+    args = parser.parse_args()
+    if args.tolerance is not None and args.folded:
+        parser.error('--tolerance evaluates a random stream of graphs, it cannot be combined with --folded.')
+    if len(base_gnns(args)) > 1 and not args.explanation_metric.startswith('faithfulness'):
+        parser.error('Only the faithfulness metrics evaluate base GNNs, --base_gnn_types and --base_gnn_runs need one of them.')
+    return args
+
+
+def base_gnns(args):
+    """ (gnn_type, gnn_run) of every base GNN evaluated with the explanations of gnn_type"""
+    return [(gnn_type, gnn_run) for gnn_type in (args.base_gnn_types or [args.gnn_type]) for gnn_run in (args.base_gnn_runs or [args.gnn_run])]
+
+
+def stability_sets(args, explanations):
+    """
+    Explanation sets compared by stability_seed, stability_base and stability_explainer, the explanations of args are
+    not loaded again.
+    :return: list of set names, list of explanation collections
+    """
+    if args.explanation_metric == 'stability_seed':
+        names = [1, 2, 3]
+        keys = [(args.explainer_name, args.gnn_type, seed) for seed in names]
+    elif args.explanation_metric == 'stability_base':
+        names = ['gcn', 'gat', 'gin', 'sage']
+        keys = [(args.explainer_name, base, 1) for base in names]
+    else:
+        names = [args.explainer_name] + args.other_explainers
+        keys = [(explainer_name, args.gnn_type, args.explainer_run) for explainer_name in names]
+    explanation_sets = []
+    for explainer_name, gnn_type, run in keys:
+        if (explainer_name, gnn_type, run) == (args.explainer_name, args.gnn_type, args.explainer_run) and args.explainer_name != 'subgraphx':
+            explanation_sets.append(explanations)
+        else:
+            explanation_sets.append(data_utils.load_explanations(args.dataset, explainer_name, gnn_type, torch.device('cpu'), run=run))
+    return names, explanation_sets
+
+
+def metric_scores(args, models, dataset, explanations, device):
+    """
+    Per graph scores of the explanation metric of args. Noisy and compared explanation sets are loaded once, the scores
+    of any subset of the graphs can then be computed, e.g. blocks of a random stream of graphs. Faithfulness metrics
+    evaluate every model on the same subgraphs, they are built once.
+    :param models: list of base GNNs
+    :return: metric names, their parameters ks, file name of the results, names of the sets of stability_seed,
+             stability_base and stability_explainer (None for other metrics) and a function score(graph_ids, stores)
+             storing the scores of the graphs at graph_ids of dataset in a list of InstanceStores, one per model
+    """
+    stability_names = None
+    if args.explanation_metric in ['faithfulness', 'faithfulness_on_test']:  # faithfulness_on_test only for inductive methods
+        ks = [5, 10, 15, 20, 25]
+        metric_names = ['sufficiency']
+        scored_sets = {k: explanations for k in ks}
+        file_name = f'faithfulness_{args.gnn_type}_run_{args.explainer_run}'
+        if args.explanation_metric == 'faithfulness_on_test':
+            file_name += '_test_only'
+    elif args.explanation_metric == 'faithfulness_with_removal':
+        ks = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+        metric_names = ['necessity']
+        scored_sets = {k: explanations for k in ks}
+        file_name = f'faithfulness_with_removal_{args.gnn_type}_run_{args.explainer_run}'
+    elif args.explanation_metric == 'faithfulness_under_noise':
+        ks = [0, 1, 2, 3, 4, 5]  # noise amounts
+        metric_names = ['sufficiency']
+        scored_sets = {noise_amount: explanations if noise_amount == 0 else data_utils.load_explanations_noisy(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=noise_amount)
+                       for noise_amount in ks}
+        file_name = f'faithfulness_under_noise_{args.gnn_type}_run_{args.explainer_run}'
+    elif args.explanation_metric == 'faithfulness_curves':
+        # the sizes of the whole dataset, so every block of graphs is evaluated at the same ks
+        ks = list(args.curve_ks) if args.curve_ks is not None else metrics.curve_sizes(explanations)
+        metric_names = ['sufficiency', 'necessity']
+        file_name = f'faithfulness_curves_{args.gnn_type}_run_{args.explainer_run}'
+    elif args.explanation_metric in ['stability_noise', 'stability_noise_feature', 'stability_topology_adversarial']:
+        if args.explanation_metric == 'stability_noise_feature':
+            ks = [10, 20, 30, 40, 50]
+        else:
+            ks = [1, 2, 3, 4, 5]
+        metric_names = ['jaccard']
+        scored_sets = {}
+        for k in ks:
+            if args.explanation_metric == 'stability_noise_feature':
+                scored_sets[k] = data_utils.load_explanations_noisy_feature(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=k)
+            elif args.explanation_metric == 'stability_topology_adversarial':
+                scored_sets[k] = data_utils.load_explanations_topology_adversarial(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=k)
+            elif args.explainer_name == 'subgraphx':
+                scored_sets[k] = data_utils.load_explanations_noisy_test(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=k)
+            else:
+                scored_sets[k] = data_utils.load_explanations_noisy(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=k)
+        file_name = f'{args.explanation_metric}_{args.gnn_type}_run_{args.explainer_run}'
+    elif args.explanation_metric in ['stability_seed', 'stability_base', 'stability_explainer']:
+        # every compared set is read once, scores of every ordered pair of sets
+        stability_names, scored_sets = stability_sets(args, explanations)
+        metric_names = ['jaccard']
+        ks = [(name_i, name_j) for name_i in stability_names for name_j in stability_names]
+        if args.explanation_metric == 'stability_base':
+            file_name = f'stability_base_run_{args.explainer_run}'
+        else:
+            file_name = f'{args.explanation_metric}_{args.gnn_type}_run_{args.explainer_run}'
+    else:
+        raise NotImplementedError
+
+    def score(graph_ids, stores):
+        graphs = IndexView(dataset, graph_ids)
+        if args.explanation_metric.startswith('faithfulness'):
+            # outputs of the original graphs are shared by every k and noise amount
+            original_outputs = metrics.models_outputs(models, graphs, device)
+
+        if args.explanation_metric in ['faithfulness', 'faithfulness_on_test', 'faithfulness_under_noise']:
+            k = 10  # fixed explanation size of faithfulness_under_noise
+            for param in ks:
+                if args.explanation_metric != 'faithfulness_under_noise':
+                    k = param
+                faithfulness_scores = metrics.faithfulness_per_graph_models(models, graphs, IndexView(scored_sets[param], graph_ids), k, metric_names, device=device, original_outputs=original_outputs, mode=args.fidelity_mode)
+                for instances, model_scores in zip(stores, faithfulness_scores):
+                    instances.update_all(metric_names, param, graph_ids, model_scores)
+        elif args.explanation_metric == 'faithfulness_with_removal':
+            for k in ks:
+                faithfulness_scores = metrics.faithfulness_with_removal_per_graph_models(models, graphs, IndexView(explanations, graph_ids), k, metric_names, device=device, original_outputs=original_outputs, mode=args.fidelity_mode)
+                for instances, model_scores in zip(stores, faithfulness_scores):
+                    instances.update_all(metric_names, k, graph_ids, model_scores)
+        elif args.explanation_metric == 'faithfulness_curves':
+            # sufficiency and necessity at every k in one sweep, always evaluated with masks
+            faithfulness_curves = metrics.faithfulness_curves_models(models, graphs, IndexView(explanations, graph_ids), device, ks=ks, original_outputs=original_outputs, patience=args.curve_patience)
+            for instances, model_curves in zip(stores, faithfulness_curves):
+                for j, k in enumerate(ks):
+                    instances.update_all(metric_names, k, graph_ids, [model_curves[metric][:, j] for metric in metric_names])
+        elif stability_names is None:
+            for k in ks:
+                robustness_scores = metrics.robustness_per_graph(IndexView(explanations, graph_ids), IndexView(scored_sets[k], graph_ids), 10, metric_names)
+                for instances in stores:
+                    instances.update_all(metric_names, k, graph_ids, robustness_scores)
+        else:
+            stability_scores = metrics.stability_matrix([IndexView(explanation_set, graph_ids) for explanation_set in scored_sets], top_k=10)
+            for instances in stores:
+                for i in range(len(stability_names)):
+                    for j in range(len(stability_names)):
+                        instances.update(metric_names[0], (stability_names[i], stability_names[j]), graph_ids, stability_scores[i, j])
+
+    return metric_names, ks, file_name, stability_names, score
 
 
 if __name__ == '__main__':
     args = parse_args()
 
-    trainer = GNNTrainer(dataset_name=args.dataset, gnn_type=args.gnn_type, task='basegnn', device=args.device)
-    model = trainer.load(args.gnn_run)
-    model.eval()
-
     result_folder = f'data/{args.dataset}/{args.explainer_name}_fold/'
     if not os.path.exists(result_folder):
         os.makedirs(result_folder)
@@ -43,6 +198,13 @@ if __name__ == '__main__':
     splits, indices = data_utils.split_data(dataset)
     test_indices = indices[2]
 
+    # the explanations of gnn_type are evaluated on every base GNN, their checkpoints share the loaded dataset
+    models = []
+    for gnn_type, gnn_run in base_gnns(args):
+        model = load_base_gnn(dataset, args.dataset, gnn_type, gnn_run, device)
+        model.eval()
+        models.append(model)
+
     if args.explainer_name == 'subgraphx':
         # we only have explanations for test set
         explanations = data_utils.load_explanations_test(args.dataset, args.explainer_name, args.gnn_type, torch.device('cpu'), args.explainer_run)
@@ -52,10 +214,22 @@ if __name__ == '__main__':
 
     if args.explanation_metric == 'faithfulness_on_test':  # for inductive methods
         dataset = dataset[test_indices]
-        explanations = [explanations[idx] for idx in test_indices]
+        explanations = IndexView(explanations, test_indices)
 
     print(f'Started: {args.dataset}, {args.explainer_name}, {args.gnn_type}, {args.explanation_metric}')
 
+    metric_names, ks, file_name, stability_names, score = metric_scores(args, models, dataset, explanations, device)
+    stores = [InstanceStore(np.arange(len(dataset))) for _ in models]
+    if args.tolerance is None:
+        # every metric emits per graph scores of the whole dataset once, folds are aggregations of these scores
+        score(np.arange(len(dataset)), stores)
+        consumed, estimates = None, None
+    else:
+        consumed, estimates = sequential_scores(lambda graph_ids: score(graph_ids, stores), stores,
+                                                [(metric, k) for metric in metric_names for k in ks], args.tolerance,
+                                                confidence=args.confidence, block_size=args.stream_block, seed=args.stream_seed)
+        print(f'Sequential: {len(consumed)} of {len(dataset)} graphs')
+
     # split dataset and explanations into 5
     dataset_splits, dataset_splits_indices = data_utils.split_data_equally(dataset, num_splits=5)
 
@@ -64,157 +238,52 @@ if __name__ == '__main__':
     else:
         fold_number = 1
 
-    for fold in range(fold_number):
-        if args.folded:
-            print('Fold', fold)
-            indices = dataset_splits_indices[fold]
-            explanations_fold = [explanations[idx] for idx in indices]
-            dataset_fold = [dataset[idx] for idx in indices]
+    for m, (gnn_type, gnn_run) in enumerate(base_gnns(args)):
+        instances = stores[m]
+        # results of the base GNN of the explanations keep their names
+        if (gnn_type, gnn_run) == (args.gnn_type, args.gnn_run):
+            model_file_name = file_name
         else:
-            indices = range(len(dataset))
-            explanations_fold = explanations
-            dataset_fold = dataset
-
-        # Generate explanation quality based on metrics
-        if args.explanation_metric == 'faithfulness':
-            ks = [5, 10, 15, 20, 25]
-            metric_names = ['sufficiency']
-            faithfulness_scores_dict = {metric: [] for metric in metric_names}
-            for k in ks:
-                faithfulness_scores = metrics.faithfulness(model, dataset_fold, explanations_fold, k, metric_names, device=device)
-                for i in range(len(metric_names)):
-                    faithfulness_scores_dict[metric_names[i]].append(faithfulness_scores[i])
-            if args.folded:
-                torch.save(faithfulness_scores_dict, result_folder + f'faithfulness_{args.gnn_type}_run_{args.explainer_run}_fold_{fold}.pt')
-            else:
-                torch.save(faithfulness_scores_dict, result_folder + f'faithfulness_{args.gnn_type}_run_{args.explainer_run}.pt')
-        elif args.explanation_metric == 'faithfulness_on_test':  # only for inductive methods
-            ks = [5, 10, 15, 20, 25]
-            metric_names = ['sufficiency']
-            faithfulness_scores_dict = {metric: [] for metric in metric_names}
-            for k in ks:
-                faithfulness_scores = metrics.faithfulness(model, dataset_fold, explanations_fold, k, metric_names, device=device)
-                for i in range(len(metric_names)):
-                    faithfulness_scores_dict[metric_names[i]].append(faithfulness_scores[i])
-            if args.folded:
-                torch.save(faithfulness_scores_dict, result_folder + f'faithfulness_{args.gnn_type}_run_{args.explainer_run}_test_only_fold_{fold}.pt')
-            else:
-                torch.save(faithfulness_scores_dict, result_folder + f'faithfulness_{args.gnn_type}_run_{args.explainer_run}_test_only.pt')
-        elif args.explanation_metric == 'faithfulness_with_removal':
-            ks = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
-            metric_names = ['necessity']
-            faithfulness_scores_dict = {metric: [] for metric in metric_names}
-            for k in ks:
-                faithfulness_scores = metrics.faithfulness_with_removal(model, dataset_fold, explanations_fold, k, metric_names, device=device)
-                for i in range(len(metric_names)):
-                    faithfulness_scores_dict[metric_names[i]].append(faithfulness_scores[i])
-            if args.folded:
-                torch.save(faithfulness_scores_dict, result_folder + f'faithfulness_with_removal_{args.gnn_type}_run_{args.explainer_run}_fold_{fold}.pt')
-            else:
-                torch.save(faithfulness_scores_dict, result_folder + f'faithfulness_with_removal_{args.gnn_type}_run_{args.explainer_run}.pt')
-        elif args.explanation_metric == 'faithfulness_under_noise':
-            k = 10  # fixed explanation size
-            metric_names = ['sufficiency']
-            faithfulness_scores_dict = {metric: [] for metric in metric_names}
-            # noise amount = 0
-            faithfulness_scores = metrics.faithfulness(model, dataset_fold, explanations_fold, k, metric_names, device=device)
-            for i in range(len(metric_names)):
-                faithfulness_scores_dict[metric_names[i]].append(faithfulness_scores[i])
-            for noise_amount in [1, 2, 3, 4, 5]:
-                explanations_noise = data_utils.load_explanations_noisy(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=noise_amount)
-                explanations_noise_fold = [explanations_noise[idx] for idx in indices]
-                faithfulness_scores = metrics.faithfulness(model, dataset_fold, explanations_noise_fold, k, metric_names, device=device)
-                for i in range(len(metric_names)):
-                    faithfulness_scores_dict[metric_names[i]].append(faithfulness_scores[i])
-            if args.folded:
-                torch.save(faithfulness_scores_dict, result_folder + f'faithfulness_under_noise_{args.gnn_type}_run_{args.explainer_run}_fold_{fold}.pt')
-            else:
-                torch.save(faithfulness_scores_dict, result_folder + f'faithfulness_under_noise_{args.gnn_type}_run_{args.explainer_run}.pt')
-        elif args.explanation_metric == 'stability_noise':
-            ks = [1, 2, 3, 4, 5]
-            metric_names = ['jaccard']
-            robustness_scores_dict = {metric: [] for metric in metric_names}
-            top_k = 10
-            for k in ks:
-                if args.explainer_name == 'subgraphx':
-                    explanations_noise = data_utils.load_explanations_noisy_test(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=k)
-                else:
-                    explanations_noise = data_utils.load_explanations_noisy(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=k)
-                explanations_noise_fold = [explanations_noise[idx] for idx in indices]
-                robustness_scores = metrics.robustness(explanations_fold, explanations_noise_fold, top_k, metric_names)
-                for i in range(len(metric_names)):
-                    robustness_scores_dict[metric_names[i]].append(robustness_scores[i])
-            if args.folded:
-                torch.save(robustness_scores_dict, result_folder + f'stability_noise_{args.gnn_type}_run_{args.explainer_run}_fold_{fold}.pt')
-            else:
-                torch.save(robustness_scores_dict, result_folder + f'stability_noise_{args.gnn_type}_run_{args.explainer_run}.pt')
-        elif args.explanation_metric == 'stability_noise_feature':
-            ks = [10, 20, 30, 40, 50]
-            metric_names = ['jaccard']
-            robustness_scores_dict = {metric: [] for metric in metric_names}
-            top_k = 10
-            for k in ks:
-                explanations_noise = data_utils.load_explanations_noisy_feature(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=k)
-                explanations_noise_fold = [explanations_noise[idx] for idx in indices]
-                robustness_scores = metrics.robustness(explanations_fold, explanations_noise_fold, top_k, metric_names)
-                for i in range(len(metric_names)):
-                    robustness_scores_dict[metric_names[i]].append(robustness_scores[i])
-            if args.folded:
-                torch.save(robustness_scores_dict, result_folder + f'stability_noise_feature_{args.gnn_type}_run_{args.explainer_run}_fold_{fold}.pt')
-            else:
-                torch.save(robustness_scores_dict, result_folder + f'stability_noise_feature_{args.gnn_type}_run_{args.explainer_run}.pt')
-        elif args.explanation_metric == 'stability_topology_adversarial':
-            ks = [1, 2, 3, 4, 5]
-            metric_names = ['jaccard']
-            robustness_scores_dict = {metric: [] for metric in metric_names}
-            top_k = 10
-            for k in ks:
-                explanations_noise = data_utils.load_explanations_topology_adversarial(args.dataset, args.explainer_name, args.gnn_type, device, args.explainer_run, k=k)
-                explanations_noise_fold = [explanations_noise[idx] for idx in indices]
-                robustness_scores = metrics.robustness(explanations_fold, explanations_noise_fold, top_k, metric_names)
-                for i in range(len(metric_names)):
-                    robustness_scores_dict[metric_names[i]].append(robustness_scores[i])
-            if args.folded:
-                torch.save(robustness_scores_dict, result_folder + f'stability_topology_adversarial_{args.gnn_type}_run_{args.explainer_run}_fold_{fold}.pt')
-            else:
-                torch.save(robustness_scores_dict, result_folder + f'stability_topology_adversarial_{args.gnn_type}_run_{args.explainer_run}.pt')
-        elif args.explanation_metric == 'stability_seed':
-            seeds = [1, 2, 3]
-            metric_names = ['jaccard']
-            stability_seed_scores_dict = {metric: [] for metric in metric_names}
-            top_k = 10
-            for i in range(len(seeds)):
-                for j in range(i + 1, len(seeds)):
-                    explanations_seed_i = data_utils.load_explanations(args.dataset, args.explainer_name, args.gnn_type, torch.device('cpu'), run=seeds[i])
-                    explanations_seed_i_fold = [explanations_seed_i[idx] for idx in indices]
-                    explanations_seed_j = data_utils.load_explanations(args.dataset, args.explainer_name, args.gnn_type, torch.device('cpu'), run=seeds[j])
-                    explanations_seed_j_fold = [explanations_seed_j[idx] for idx in indices]
-                    stability_seed_scores = metrics.robustness(explanations_seed_i_fold, explanations_seed_j_fold, top_k, metric_names)
-                    for l in range(len(metric_names)):
-                        stability_seed_scores_dict[metric_names[l]].append((seeds[i], seeds[j], stability_seed_scores[l]))
+            model_file_name = f'{file_name}_base_{gnn_type}_run_{gnn_run}'
+
+        if estimates is not None:
+            report = {'num_graphs': len(consumed), 'graph_ids': consumed, 'tolerance': args.tolerance, 'confidence': args.confidence,
+                      'estimates': {metric: [estimates[m][(metric, k)] for k in ks] for metric in metric_names}}
+            torch.save(report, result_folder + f'{model_file_name}_sequential.pt')
+            for metric in metric_names:
+                for k in ks:
+                    estimate = estimates[m][(metric, k)]
+                    print(f'{gnn_type} run {gnn_run}, {metric} {k}: {estimate["mean"]:.4f} [{estimate["ci"][0]:.4f}, {estimate["ci"][1]:.4f}] of {estimate["count"]} graphs')
+
+        instances.save(result_folder + f'{model_file_name}_instances.pt')
+        if args.bootstrap:
+            torch.save({metric: [instances.summary(metric, k, consumed) for k in ks] for metric in metric_names}, result_folder + f'{model_file_name}_summary.pt')
+
+        for fold in range(fold_number):
             if args.folded:
-                torch.save(stability_seed_scores_dict, result_folder + f'stability_seed_{args.gnn_type}_run_{args.explainer_run}_fold_{fold}.pt')
+                print('Fold', fold)
+                indices = dataset_splits_indices[fold]
+                # stability_base results were saved without the fold prefix
+                fold_suffix = f'_{fold}' if args.explanation_metric == 'stability_base' else f'_fold_{fold}'
             else:
-                torch.save(stability_seed_scores_dict, result_folder + f'stability_seed_{args.gnn_type}_run_{args.explainer_run}.pt')
-        elif args.explanation_metric == 'stability_base':
-            bases = ['gcn', 'gat', 'gin', 'sage']
-            metric_names = ['jaccard']
-            stability_base_scores_dict = {metric: [] for metric in metric_names}
-            top_k = 10
-            for i in range(len(bases)):
-                for j in range(i + 1, len(bases)):
-                    explanations_base1 = data_utils.load_explanations(args.dataset, args.explainer_name, bases[i], torch.device('cpu'), run=1)
-                    explanations_base1_fold = [explanations_base1[idx] for idx in indices]
-                    explanations_base2 = data_utils.load_explanations(args.dataset, args.explainer_name, bases[j], torch.device('cpu'), run=1)
-                    explanations_base2_fold = [explanations_base2[idx] for idx in indices]
-                    stability_base_scores = metrics.robustness(explanations_base1_fold, explanations_base2_fold, top_k, metric_names)
-                    for l in range(len(metric_names)):
-                        stability_base_scores_dict[metric_names[l]].append((bases[i], bases[j], stability_base_scores[l]))
-            if args.folded:
-                torch.save(stability_base_scores_dict, result_folder + f'stability_base_run_{args.explainer_run}_{fold}.pt')
+                indices = consumed
+                fold_suffix = ''
+
+            if args.explanation_metric == 'faithfulness_curves':
+                scores_dict = metrics.curve_results(ks, *[torch.stack([instances.scores(metric, k, indices) for k in ks], dim=1).float() for metric in metric_names])
+            elif args.explanation_metric in ['stability_seed', 'stability_base', 'stability_explainer']:
+                # pairs of distinct sets as before, the matrix of all pairs next to them
+                scores_dict = {metric: [] for metric in metric_names}
+                matrix_dict = {'names': stability_names}
+                for metric in metric_names:
+                    matrix = torch.tensor([instances.mean(metric, pair, indices) for pair in ks], dtype=torch.double).view(len(stability_names), -1)
+                    for i in range(len(stability_names)):
+                        for j in range(i + 1, len(stability_names)):
+                            scores_dict[metric].append((stability_names[i], stability_names[j], matrix[i, j].item()))
+                    matrix_dict[metric] = matrix
+                torch.save(matrix_dict, result_folder + f'{model_file_name}_matrix{fold_suffix}.pt')
             else:
-                torch.save(stability_base_scores_dict, result_folder + f'stability_base_run_{args.explainer_run}.pt')
-        else:
-            raise NotImplementedError
+                scores_dict = {metric: [instances.mean(metric, k, indices) for k in ks] for metric in metric_names}
+            torch.save(scores_dict, result_folder + f'{model_file_name}{fold_suffix}.pt')
 
-        print(f'Finished: {args.dataset}, {args.explainer_name}, {args.gnn_type}, {args.explanation_metric}')
+        print(f'Finished: {args.dataset}, {args.explainer_name}, {args.gnn_type} on {gnn_type} run {gnn_run}, {args.explanation_metric}')
@@ -0,0 +1,82 @@
+# Startup time of the entry points.
+#
+# Every entry point is started with --help in a fresh interpreter, which imports all of its modules and exits after
+# parsing the arguments, so the wall-clock time is the fixed cost each process pays before doing any work. One more
+# run with -X importtime gives the slowest top-level imports and the registered lazy modules that were imported.
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+from lazy_imports import REGISTRY
+
+ENTRY_POINTS = ['basegnn.py', 'result_generator.py', 'cf_result_generator_avg.py', 'reproducibility.py',
+                'reverse_reproducibility.py', 'plot_explanations.py', 'gnnexplainer.py', 'pgexplainer.py',
+                'subgraphx.py', 'tagexplainer.py', 'gem.py', 'gem_gt.py', 'rcexplainer.py', 'cff.py']
+SOURCE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entry_points', type=str, nargs='+', default=ENTRY_POINTS, help='Scripts in source/ to time.')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of timed starts of every entry point.')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest top-level imports to report.')
+    return parser.parse_args()
+
+
+def start(entry_point, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [os.path.join(SOURCE_FOLDER, entry_point), '--help']
+    begin = time.perf_counter()
+    process = subprocess.run(command, cwd=os.getcwd(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - begin, process.returncode, process.stderr
+
+
+def import_times(stderr):
+    """
+    :param stderr: output of python -X importtime
+    :return: dict of cumulative import time in seconds of the top-level imports
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith('  ') or name.strip().startswith('_'):
+            continue
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def benchmark(entry_point, repeats, top):
+    timings = []
+    for _ in range(repeats):
+        elapsed, returncode, stderr = start(entry_point)
+        if returncode != 0:
+            return {'entry_point': entry_point, 'error': stderr.strip().splitlines()[-1] if stderr.strip() else returncode}
+        timings.append(elapsed)
+    _, _, stderr = start(entry_point, importtime=True)
+    times = import_times(stderr)
+    all_modules = {line.split('|')[-1].strip() for line in stderr.splitlines() if line.startswith('import time:')}
+    return {
+        'entry_point': entry_point,
+        'median': float(np.median(timings)),
+        'min': float(np.min(timings)),
+        'slowest_imports': sorted(times.items(), key=lambda item: -item[1])[:top],
+        'lazy_modules_loaded': [name for name in REGISTRY if name in all_modules],
+    }
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for entry_point in args.entry_points:
+        result = benchmark(entry_point, args.repeats, args.top)
+        if 'error' in result:
+            print(f'{entry_point}: failed to start: {result["error"]}')
+            continue
+        print(f'{entry_point}: median {result["median"]:.3f}s, min {result["min"]:.3f}s')
+        print('    slowest imports: ' + ', '.join(f'{name} {seconds:.3f}s' for name, seconds in result['slowest_imports']))
+        print(f'    lazy modules loaded: {", ".join(result["lazy_modules_loaded"]) or "none"}')
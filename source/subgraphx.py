@@ -8,9 +8,8 @@ import os
 from tqdm import tqdm
 
 import data_utils
+import explanation_store
 from gnn_trainer import GNNTrainer
-from torch_geometric.data import Data
-import torch_geometric.utils.subgraph as subgraph_func
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--dataset', type=str, default='Mutagenicity',
@@ -54,17 +53,16 @@ model.eval()
 
 
 def get_explanations_from_subgraphx_results(explanation, graph):
-    edge_map = {}
     edge_weights = torch.zeros(graph.edge_index.shape[1])
-    for i, (a, b) in enumerate(graph.edge_index.T):
-        edge_map[(a.item(), b.item())] = i
+    graph_nodes = set(graph.edge_index.unique().tolist())
 
     for ex in explanation[:20]:  # get top 20 explanations and generate continuous edge weights
         nodes = ex['coalition']
-        if nodes is not None and len(nodes) > 0 and len(set(nodes) - set(graph.edge_index.unique().tolist())) == 0:
-            explanation_graph = subgraph_func(nodes, graph.edge_index)[0]
-            for a, b in explanation_graph.T:
-                edge_weights[edge_map[(a.item(), b.item())]] += 1.0
+        if nodes is not None and len(nodes) > 0 and len(set(nodes) - graph_nodes) == 0:
+            # edges of the coalition subgraph have both endpoints in the coalition
+            node_mask = torch.zeros(graph.num_nodes, dtype=torch.bool)
+            node_mask[nodes] = True
+            edge_weights += (node_mask[graph.edge_index[0]] & node_mask[graph.edge_index[1]]).float()
 
     edge_weights = edge_weights / edge_weights.sum()
     return edge_weights
@@ -83,14 +81,8 @@ if args.robustness == 'na':
         _, explanation, related_preds = subgraphx(graph.x.to(device), graph.edge_index.to(device), graph.y.to(device))
         explanation_weights = get_explanations_from_subgraphx_results(explanation[0], graph)
 
-        explanation_ = Data(
-            edge_index=graph.edge_index.clone(),
-            x=graph.x.clone(),
-            y=graph.y.clone(),
-            edge_weight=explanation_weights.clone()
-        )
-        explanations.append(explanation_)
-    torch.save(explanations, explanations_path)
+        explanations.append(explanation_weights.clone())
+    explanation_store.save_edge_weights(explanations, explanations_path, args.dataset, data_indices, dataset=dataset)
 elif args.robustness == 'topology_random':
     for noise in [1, 2, 3, 4, 5]:
         if not args.explain_test_only:
@@ -105,11 +97,5 @@ elif args.robustness == 'topology_random':
             _, explanation, related_preds = subgraphx(graph.x.to(device), graph.edge_index.to(device), graph.y.to(device))
             explanation_weights = get_explanations_from_subgraphx_results(explanation[0], graph)
 
-            explanation_ = Data(
-                edge_index=graph.edge_index.clone(),
-                x=graph.x.clone(),
-                y=graph.y.clone(),
-                edge_weight=explanation_weights.clone()
-            )
-            explanations.append(explanation_)
-        torch.save(explanations, explanations_path)
+            explanations.append(explanation_weights.clone())
+        explanation_store.save_edge_weights(explanations, explanations_path, data_utils.get_variant_dataset_name(args.dataset, 'topology_random', noise), data_indices, dataset=noisy_dataset)
@@ -4,10 +4,10 @@ import random
 import numpy as np
 import os
 
-from torch_geometric.loader import DataLoader
 import data_utils
+import explanation_store
+import loaders
 from gnn_trainer import GNNTrainer
-from torch_geometric.data import Data
 from methods.TAGE.tagexplainer import TAGExplainer, MLPExplainer
 from methods.TAGE.downstream import train_MLP, MLP
 from tqdm import tqdm
@@ -26,6 +26,8 @@ parser.add_argument('--gnn_run', type=int, default=1)
 parser.add_argument('--explainer_run', type=int, default=1)
 parser.add_argument('--gnn_type', type=str, default='gcn', choices=['gcn', 'gat', 'gin', 'sage'], help='GNN layer type to use.')
 parser.add_argument('--robustness', type=str, default='na', choices=['topology_random', 'topology_adversarial', 'feature', 'na'], help="na by default means we do not run for perturbed data")
+parser.add_argument('--lazy_variants', action='store_true', help='Perturbs the graphs of the robustness runs on access instead of loading the materialized noisy datasets, topology adversarial graphs are the vectorized flips.')
+parser.add_argument('--flip_mode', type=str, default='legacy', choices=['legacy', 'vectorized'], help='Topology adversarial datasets of the original flip loop or of the vectorized flips.')
 parser.add_argument('--stage', type=int, default=2, help='Stage to run. Default is 2. 1 is embedding explainer, 2 is embedding explainer+downstream training.')
 
 args = parser.parse_args()
@@ -37,6 +39,7 @@ if not os.path.exists(result_folder):
 
 device = torch.device(f'cuda:{args.device}' if torch.cuda.is_available() and args.device != 'cpu' else 'cpu')
 dataset = data_utils.load_dataset(args.dataset)
+dataset_variants = data_utils.DatasetVariants(args.dataset, original_graphs=dataset, flip_mode=args.flip_mode, lazy=args.lazy_variants)
 splits, indices = data_utils.split_data(dataset)
 train_set, valid_set, test_set = splits
 
@@ -45,9 +48,10 @@ torch.cuda.manual_seed(args.explainer_run)
 np.random.seed(args.explainer_run)
 random.seed(args.explainer_run)
 
-train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True, num_workers=0)
-valid_loader = DataLoader(valid_set, batch_size=args.batch_size, shuffle=True, num_workers=0)
-test_loader = DataLoader(test_set, batch_size=args.batch_size, shuffle=True, num_workers=0)
+pin_memory = device.type == 'cuda'
+train_loader = loaders.data_loader(train_set, args.batch_size, shuffle=True, pin_memory=pin_memory)
+valid_loader = loaders.data_loader(valid_set, args.batch_size, shuffle=True, pin_memory=pin_memory)
+test_loader = loaders.data_loader(test_set, args.batch_size, shuffle=True, pin_memory=pin_memory)
 
 best_explainer_model_path = os.path.join(result_folder, f'best_model_base_{args.gnn_type}_run_{args.gnn_run}_explainer_run_{args.explainer_run}.pt')
 args.best_explainer_model_path = best_explainer_model_path
@@ -77,7 +81,7 @@ if args.stage == 2:
 if args.robustness == 'na':
     embedding_explainer.train_explainer_graph(train_loader, epochs=args.epochs, lr=lr)
     torch.save(embedding_explainer.explainer.state_dict(), args.best_explainer_model_path)
-    explanation_graphs = []
+    edge_weights = []
     embedding_explainer.eval()
     for i in tqdm(range(len(dataset))):
         graph = dataset[i].to(device)
@@ -89,13 +93,8 @@ if args.robustness == 'na':
             explanation = embedding_explainer(graph, mlp_explainer)
         else:
             raise NotImplementedError
-        explanation_graphs.append(Data(
-            edge_index=graph.edge_index.clone(),
-            x=graph.x.clone(),
-            y=graph.y.clone(),
-            edge_weight=explanation.detach().clone()
-        ))
-    torch.save(explanation_graphs, explanations_path)
+        edge_weights.append(explanation.detach().clone())
+    explanation_store.save_edge_weights(edge_weights, explanations_path, args.dataset, range(len(dataset)), dataset=dataset)
 elif args.robustness == 'topology_random':
     # load trained explainers
     embedding_explainer.explainer.load_state_dict(torch.load(args.best_explainer_model_path, map_location=device))
@@ -107,8 +106,8 @@ elif args.robustness == 'topology_random':
         mlp_explainer.eval()
     for noise in [1, 2, 3, 4, 5]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_noise_{noise}.pt')
-        explanation_graphs = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_dataset_name(dataset_name=args.dataset, noise=noise))
+        edge_weights = []
+        noisy_dataset = dataset_variants.get('topology_random', noise)
         for i in tqdm(range(len(dataset))):
             noisy_graph = noisy_dataset[i].to(device)
             if args.stage == 1:
@@ -119,13 +118,8 @@ elif args.robustness == 'topology_random':
                 explanation = embedding_explainer(noisy_graph, mlp_explainer)
             else:
                 raise NotImplementedError
-            explanation_graphs.append(Data(
-                edge_index=noisy_graph.edge_index.clone(),
-                x=noisy_graph.x.clone(),
-                y=noisy_graph.y.clone(),
-                edge_weight=explanation.detach().clone()
-            ))
-        torch.save(explanation_graphs, explanations_path)
+            edge_weights.append(explanation.detach().clone())
+        explanation_store.save_edge_weights(edge_weights, explanations_path, dataset_variants.name('topology_random', noise), range(len(dataset)), dataset=noisy_dataset)
 elif args.robustness == 'feature':
     # load trained explainers
     embedding_explainer.explainer.load_state_dict(torch.load(args.best_explainer_model_path, map_location=device))
@@ -137,8 +131,8 @@ elif args.robustness == 'feature':
         mlp_explainer.eval()
     for noise in [10, 20, 30, 40, 50]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_feature_noise_{noise}.pt')
-        explanation_graphs = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_noisy_dataset_name(dataset_name=args.dataset, noise=noise))
+        edge_weights = []
+        noisy_dataset = dataset_variants.get('feature', noise)
         for i in tqdm(range(len(dataset))):
             noisy_graph = noisy_dataset[i].to(device)
             if args.stage == 1:
@@ -149,13 +143,8 @@ elif args.robustness == 'feature':
                 explanation = embedding_explainer(noisy_graph, mlp_explainer)
             else:
                 raise NotImplementedError
-            explanation_graphs.append(Data(
-                edge_index=noisy_graph.edge_index.clone(),
-                x=noisy_graph.x.clone(),
-                y=noisy_graph.y.clone(),
-                edge_weight=explanation.detach().clone()
-            ))
-        torch.save(explanation_graphs, explanations_path)
+            edge_weights.append(explanation.detach().clone())
+        explanation_store.save_edge_weights(edge_weights, explanations_path, dataset_variants.name('feature', noise), range(len(dataset)), dataset=noisy_dataset)
 elif args.robustness == 'topology_adversarial':
     # load trained explainers
     embedding_explainer.explainer.load_state_dict(torch.load(args.best_explainer_model_path, map_location=device))
@@ -167,8 +156,8 @@ elif args.robustness == 'topology_adversarial':
         mlp_explainer.eval()
     for flip_count in [1, 2, 3, 4, 5]:
         explanations_path = os.path.join(result_folder, f'explanations_{args.gnn_type}_run_{args.explainer_run}_topology_adversarial_{flip_count}.pt')
-        explanation_graphs = []
-        noisy_dataset = data_utils.load_dataset(data_utils.get_topology_adversarial_attack_dataset_name(dataset_name=args.dataset, flip_count=flip_count))
+        edge_weights = []
+        noisy_dataset = dataset_variants.get('topology_adversarial', flip_count)
         for i in tqdm(range(len(dataset))):
             noisy_graph = noisy_dataset[i].to(device)
             if args.stage == 1:
@@ -179,12 +168,7 @@ elif args.robustness == 'topology_adversarial':
                 explanation = embedding_explainer(noisy_graph, mlp_explainer)
             else:
                 raise NotImplementedError
-            explanation_graphs.append(Data(
-                edge_index=noisy_graph.edge_index.clone(),
-                x=noisy_graph.x.clone(),
-                y=noisy_graph.y.clone(),
-                edge_weight=explanation.detach().clone()
-            ))
-        torch.save(explanation_graphs, explanations_path)
+            edge_weights.append(explanation.detach().clone())
+        explanation_store.save_edge_weights(edge_weights, explanations_path, dataset_variants.name('topology_adversarial', flip_count), range(len(dataset)), dataset=noisy_dataset)
 else:
     raise NotImplementedError
@@ -0,0 +1,19 @@
+import torch
+from torch_geometric.nn.dense.linear import Linear
+
+
+def one_hot_linear(weight, bias, x):
+    """
+    Linear layer applied to one-hot features as a lookup of the weight columns of the categories.
+    :param weight: Tensor [out_channels, num_categories]
+    :param bias: Tensor [out_channels] or None
+    :param x: category ids of the nodes, tensor of shape [num_nodes] or [num_nodes, 1]
+    """
+    out = weight.t()[x.view(-1).long()]
+    return out if bias is None else out + bias
+
+
+class CategoricalLinear(Linear):
+    """ Linear layer whose input are category ids, it has the parameters of the Linear layer over the one-hot features"""
+    def forward(self, x):
+        return one_hot_linear(self.weight, self.bias, x)
@@ -19,6 +19,8 @@ from torch_geometric.utils import add_self_loops, remove_self_loops, softmax
 
 from torch_geometric.nn.inits import glorot, zeros
 
+from wrappers.categorical import CategoricalLinear
+
 
 class GATConvModified(MessagePassing):
     r"""The graph attentional operator from the `"Graph Attention Networks"
@@ -85,6 +87,9 @@ class GATConvModified(MessagePassing):
             :obj:`"min"`, :obj:`"max"`, :obj:`"mul"`). (default: :obj:`"mean"`)
         bias (bool, optional): If set to :obj:`False`, the layer will not learn
             an additive bias. (default: :obj:`True`)
+        categorical (bool, optional): If set to :obj:`True`, the input node
+            features are category ids of one-hot features with
+            :obj:`in_channels` categories. (default: :obj:`False`)
         **kwargs (optional): Additional arguments of
             :class:`torch_geometric.nn.conv.MessagePassing`.
 
@@ -116,6 +121,7 @@ class GATConvModified(MessagePassing):
             edge_dim: Optional[int] = None,
             fill_value: Union[float, Tensor, str] = 'mean',
             bias: bool = True,
+            categorical: bool = False,
             **kwargs,
     ):
         kwargs.setdefault('aggr', 'add')
@@ -133,7 +139,11 @@ class GATConvModified(MessagePassing):
 
         # In case we are operating in bipartite graphs, we apply separate
         # transformations 'lin_src' and 'lin_dst' to source and target nodes:
-        if isinstance(in_channels, int):
+        if isinstance(in_channels, int) and categorical:
+            self.lin_src = CategoricalLinear(in_channels, heads * out_channels,
+                                             bias=False, weight_initializer='glorot')
+            self.lin_dst = self.lin_src
+        elif isinstance(in_channels, int):
             self.lin_src = Linear(in_channels, heads * out_channels,
                                   bias=False, weight_initializer='glorot')
             self.lin_dst = self.lin_src
@@ -3,27 +3,30 @@ from torch_geometric.nn.conv import MessagePassing
 from torch_geometric.nn.inits import reset
 from torch_sparse import matmul
 
+from wrappers.categorical import one_hot_linear
+
 
 class GINConv(torch.nn.Module):
-    def __init__(self, in_channels, out_channels, **kwargs):
+    def __init__(self, in_channels, out_channels, categorical=False, **kwargs):
         super(GINConv, self).__init__()
 
         mlp = torch.nn.Sequential(torch.nn.Linear(in_channels, out_channels),
                                   torch.nn.BatchNorm1d(out_channels),
                                   torch.nn.Linear(out_channels, out_channels),
                                   torch.nn.BatchNorm1d(out_channels))
-        self.conv = GINConvWrapper(mlp, **kwargs)
+        self.conv = GINConvWrapper(mlp, categorical=categorical, **kwargs)
 
     def forward(self, x, edge_index, edge_weight):
         return self.conv(x, edge_index, edge_weight)
 
 
 class GINConvWrapper(MessagePassing):
-    def __init__(self, nn, eps=0., train_eps=False,
+    def __init__(self, nn, eps=0., train_eps=False, categorical=False,
                  **kwargs):
         kwargs.setdefault('aggr', 'add')
         super().__init__(**kwargs)
         self.nn = nn
+        self.categorical = categorical
         self.initial_eps = eps
         if train_eps:
             self.eps = torch.nn.Parameter(torch.Tensor([eps]))
@@ -37,6 +40,9 @@ class GINConvWrapper(MessagePassing):
 
     def forward(self, x, edge_index, edge_weight, size=None):
         """"""
+        if self.categorical:
+            return self.categorical_forward(x, edge_index, edge_weight, size)
+
         if isinstance(x, torch.Tensor):
             x = (x, x)
 
@@ -49,6 +55,17 @@ class GINConvWrapper(MessagePassing):
 
         return self.nn(out)
 
+    def categorical_forward(self, x, edge_index, edge_weight, size=None):
+        # x holds category ids, the first linear layer of nn commutes with the sum aggregation so it is applied to
+        # the ids as a lookup before the aggregation
+        first = self.nn[0]
+        x = one_hot_linear(first.weight, None, x)
+        out = self.propagate(edge_index, x=(x, x), edge_weight=edge_weight, size=size)
+        out += (1 + self.eps) * x
+        if first.bias is not None:
+            out += first.bias
+        return self.nn[1:](out)
+
     def message(self, x_j, edge_weight):
         return x_j if edge_weight is None else edge_weight.view(-1, 1) * x_j
 
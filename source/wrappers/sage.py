@@ -10,6 +10,8 @@ from torch_geometric.nn.conv import MessagePassing
 from torch_geometric.nn.dense.linear import Linear
 from torch_geometric.typing import Adj, OptTensor, OptPairTensor, Size
 
+from wrappers.categorical import one_hot_linear
+
 
 class SAGEConvModified(MessagePassing):
     r"""The GraphSAGE operator from the `"Inductive Representation Learning on
@@ -52,6 +54,10 @@ class SAGEConvModified(MessagePassing):
             (default: :obj:`False`)
         bias (bool, optional): If set to :obj:`False`, the layer will not learn
             an additive bias. (default: :obj:`True`)
+        categorical (bool, optional): If set to :obj:`True`, the input node
+            features are category ids of one-hot features with
+            :obj:`in_channels` categories, only for linear aggregations.
+            (default: :obj:`False`)
         **kwargs (optional): Additional arguments of
             :class:`torch_geometric.nn.conv.MessagePassing`.
 
@@ -74,6 +80,7 @@ class SAGEConvModified(MessagePassing):
             root_weight: bool = True,
             project: bool = False,
             bias: bool = True,
+            categorical: bool = False,
             **kwargs,
     ):
         self.in_channels = in_channels
@@ -81,6 +88,9 @@ class SAGEConvModified(MessagePassing):
         self.normalize = normalize
         self.root_weight = root_weight
         self.project = project
+        self.categorical = categorical
+        if categorical and (project or aggr not in ['mean', 'add', 'sum']):
+            raise NotImplementedError(f'Categorical features with aggregation: {aggr} is not implemented!')
 
         if isinstance(in_channels, int):
             in_channels = (in_channels, in_channels)
@@ -122,6 +132,9 @@ class SAGEConvModified(MessagePassing):
     def forward(self, x: Union[Tensor, OptPairTensor], edge_index: Adj,
                 size: Size = None, edge_weight=None) -> Tensor:
         """"""
+        if self.categorical:
+            return self.categorical_forward(x, edge_index, size, edge_weight)
+
         if isinstance(x, Tensor):
             x: OptPairTensor = (x, x)
 
@@ -141,6 +154,21 @@ class SAGEConvModified(MessagePassing):
 
         return out
 
+    def categorical_forward(self, x: Tensor, edge_index: Adj, size: Size = None, edge_weight=None) -> Tensor:
+        # x holds category ids, lin_l commutes with the linear aggregation so both linear layers are lookups
+        x_l = one_hot_linear(self.lin_l.weight, None, x)
+        out = self.propagate(edge_index, x=(x_l, x_l), size=size, edge_weight=edge_weight)
+        if self.lin_l.bias is not None:
+            out = out + self.lin_l.bias
+
+        if self.root_weight:
+            out += one_hot_linear(self.lin_r.weight, self.lin_r.bias, x)
+
+        if self.normalize:
+            out = F.normalize(out, p=2., dim=-1)
+
+        return out
+
     def message(self, x_j: Tensor, edge_weight: OptTensor) -> Tensor:
         return x_j if edge_weight is None else edge_weight.view(-1, 1) * x_j
 